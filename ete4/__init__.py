@@ -2,22 +2,57 @@ from .core.tree import Tree, TreeError
 
 from .core import operations, text_viz
 
+from .core.compact import CompactTree
+
 from .core.seqgroup import SeqGroup
 
-from .parser import newick, ete_format, nexus, indent
+from .parser import newick, ete_format, ete_binary, nexus, indent
 
 from .config import (ETE_DATA_HOME, ETE_CONFIG_HOME, ETE_CACHE_HOME,
                      update_ete_data)
 
-from .ncbi_taxonomy import *
-from .gtdb_taxonomy import *
+from .utils import SVG_COLORS, COLOR_SCHEMES, random_color
+
+from .version import __version__
 
-from .phylo.phylotree import *
-from .evol.evoltree import *
-from .evol import EvolTree
 
-from .phyloxml import Phyloxml, PhyloxmlTree
+# Names that are imported only the first time they are used, because
+# their modules are slow to load (they bring scipy, big xml bindings...).
+_lazy_names = {  # name -> module where it is defined
+    'NCBITaxa': 'ncbi_taxonomy',
+    'GTDBTaxa': 'gtdb_taxonomy',
+    'is_taxadb_up_to_date': 'gtdb_taxonomy',  # the gtdb one, as it was
+    'PhyloTree': 'phylo.phylotree',
+    'EvolNode': 'evol.evoltree',
+    'EvolTree': 'evol',
+    'Phyloxml': 'phyloxml',
+    'PhyloxmlTree': 'phyloxml',
+    'ncbiquery': 'ncbi_taxonomy',
+    'gtdbquery': 'gtdb_taxonomy',
+}
 
-from .utils import SVG_COLORS, COLOR_SCHEMES, random_color
+_lazy_modules = ['ncbi_taxonomy', 'gtdb_taxonomy', 'phylo', 'evol', 'phyloxml',
+                 'tools']
 
-from .version import __version__
+# For "from ete4 import *" (which loads them all, like it used to).
+__all__ = ([name for name in globals() if not name.startswith('_')] +
+           list(_lazy_names) + _lazy_modules)
+
+
+def __getattr__(name):
+    import importlib
+
+    if name in _lazy_names:
+        module = importlib.import_module('.' + _lazy_names[name], __name__)
+        value = getattr(module, name)
+    elif name in _lazy_modules:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    globals()[name] = value  # so next time it is found directly
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_names) | set(_lazy_modules))
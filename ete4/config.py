@@ -6,7 +6,6 @@ Constants with the XDG-compliant directories for ete.
 
 import os
 from os.path import dirname, exists
-import requests
 
 
 # Helper function to define global ETE_* variables.
@@ -37,6 +36,8 @@ def update_ete_data(path, url, overwrite=False):
         url = 'https://github.com/etetoolkit/ete-data/raw/main/' + url
 
     # Update local file with the content from the url.
+    import requests  # imported here because it is slow to load
+
     with open(path, 'wb') as f:
         print(f'{url} -> {path}')
         f.write(requests.get(url).content)
@@ -0,0 +1,116 @@
+"""
+Bipartitions (splits) of a tree, represented as bitsets.
+
+Every leaf (or every value of a leaf property, like its name) gets a
+bit, and the set of leaves under a node is the (python) int with the
+bits of those leaves. Comparing, hashing and combining these ints is
+much faster than doing it with sets or sorted tuples of names.
+
+The bits are given in the order of the sorted values, so decoding a
+bitset gives directly the sorted values of its leaves.
+"""
+
+import numpy as np
+
+
+def get_bits(values, sort=True):
+    """Return dict that assigns a bit to each value (in sorted order)."""
+    if sort:
+        values = sorted(values)
+    return {value: 1 << i for i, value in enumerate(values)}
+
+
+def full(n):
+    """Return the bitset with the first n bits set."""
+    return (1 << n) - 1  # n is a python int here, so no overflow
+
+
+def get_node_bits(tree, leaf_bit):
+    """Return dict with the bitset of every node of tree (in preorder).
+
+    :param leaf_bit: Function that returns the bit of a leaf (or 0).
+    """
+    nodes = list(tree.traverse('preorder'))
+
+    bits = {}
+    for node in reversed(nodes):  # children before their parents
+        if node.is_leaf:
+            bits[node] = leaf_bit(node)
+        else:
+            node_bits = 0
+            for child in node.children:
+                node_bits |= bits[child]
+            bits[node] = node_bits
+
+    return {node: bits[node] for node in nodes}
+
+
+def canonical(bits, all_bits):
+    """Return the side of the branch (bits or its complement) without bit 0.
+
+    For unrooted trees both sides of a branch are the same bipartition.
+    """
+    return all_bits ^ bits if bits & 1 else bits
+
+
+def count(bits):
+    """Return the number of bits set."""
+    return bin(bits).count('1')
+
+
+def as_array(values):
+    """Return a numpy array of objects with the given values."""
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):  # not array[:] = values (for nodes)
+        array[i] = value
+    return array
+
+
+def decode(bits, values):
+    """Return tuple with the values (a numpy array) that bits select."""
+    if not bits:
+        return ()
+
+    if count(bits) < len(values) // 64:  # few bits: go directly to them
+        selected = []
+        while bits:
+            lowest = bits & -bits
+            selected.append(values[lowest.bit_length() - 1])
+            bits ^= lowest
+        return tuple(selected)
+
+    nbytes = (len(values) + 7) // 8
+    flags = np.unpackbits(np.frombuffer(bits.to_bytes(nbytes, 'little'),
+                                        dtype=np.uint8),
+                          count=len(values), bitorder='little')
+    return tuple(values[flags.view(bool)].tolist())
+
+
+def decoder(values, all_bits=None):
+    """Return a function that decodes (and remembers) bitsets into values.
+
+    If all_bits is given, the bitsets are canonical splits of an
+    unrooted tree, decoded as in decode_unrooted().
+    """
+    values = as_array(values)
+    decoded = {}
+
+    def decode_bits(bits):
+        if bits not in decoded:
+            decoded[bits] = (decode(bits, values) if all_bits is None else
+                             decode_unrooted(bits, all_bits, values))
+        return decoded[bits]
+
+    return decode_bits
+
+
+def decode_unrooted(split, all_bits, values):
+    """Return the pair of tuples of values at each side of a canonical split.
+
+    They are sorted like tuples of sorted values (the side with bit 0
+    goes first, unless the other one is empty).
+    """
+    if split == 0:
+        return ((), decode(all_bits, values))
+    else:
+        return (decode(all_bits ^ split, values), decode(split, values))
@@ -0,0 +1,426 @@
+"""
+Compact, read-only representation of a tree, stored in arrays.
+
+The nodes are numbered in preorder (the root is 0), and the topology
+is kept in integer arrays (parent, first child, next sibling...). The
+branch lengths and supports are float arrays (with nan for missing
+values), and the rest of the properties are stored as columns.
+
+Since the numbering is in preorder, all the descendants of node i are
+the nodes in the range [i, i + size[i]).
+"""
+
+import gc
+
+import numpy as np
+
+from libc.stdint cimport int64_t
+
+from .tree import Tree, TreeError
+from ..parser import newick
+
+
+# Arrays that describe the topology (all are computed from "parent").
+TOPOLOGY = ['parent', 'size', 'depth', 'first_child', 'next_sibling',
+            'root_dist']
+
+
+class CompactTree:
+    """A frozen tree whose nodes are integers pointing to column arrays.
+
+    Example::
+
+      t = Tree('((a:1,b:2)c:3,d:4);', parser=1)
+      ct = CompactTree.from_tree(t)
+      ct.leaf_names()          # ['a', 'b', 'd']
+      ct.distance(1, 3)        # distance between c and its child b -> 2.0
+      t2 = ct.to_tree()        # back to a normal Tree
+    """
+
+    def __init__(self, parent, props=None):
+        """
+        :param parent: Array with the parent of each node, for nodes
+            numbered in preorder (so parent[0] == -1 for the root).
+        :param props: Dict with the column (a sequence with a value
+            for each node) of every property.
+        """
+        self.parent = freeze(np.asarray(parent, dtype=np.int64))
+
+        n = len(self.parent)
+        assert n > 0 and self.parent[0] == -1, 'the root must be node 0'
+
+        self.props = {pname: as_column(values)
+                      for pname, values in (props or {}).items()}
+
+        for pname in ['dist', 'support']:  # always present, as floats
+            self.props[pname] = freeze(np.asarray(
+                self.props.get(pname, np.full(n, np.nan)), dtype=np.float64))
+
+        assert all(len(v) == n for v in self.props.values()), \
+            'property columns must have a value for each node'
+
+        self.size, self.depth = map(freeze, get_sizes_and_depths(self.parent))
+
+        self.first_child, self.next_sibling = map(freeze,
+            get_children_links(self.parent, self.size))
+
+        self.root_dist = freeze(get_root_dists(self.parent, self.dist))
+
+    @classmethod
+    def from_arrays(cls, arrays, props):
+        """Return a compact tree made directly from its (precomputed) arrays.
+
+        :param arrays: Dict with an array for each name in TOPOLOGY.
+        :param props: Dict with the column of every property (including
+            "dist" and "support"). The columns are used as they are.
+        """
+        ct = cls.__new__(cls)
+
+        for name in TOPOLOGY:
+            setattr(ct, name, freeze(arrays[name]))
+
+        ct.props = props
+
+        return ct
+
+    @classmethod
+    def from_tree(cls, tree):
+        """Return a compact tree with the contents of the given tree."""
+        parent = []
+        nodes_props = []
+
+        visiting = [(tree, -1)]  # nodes to visit, with the index of their parent
+        while visiting:
+            node, i_parent = visiting.pop()
+            i = len(parent)
+            parent.append(i_parent)
+            nodes_props.append(node.props)
+            visiting += [(n, i) for n in node.children[::-1]]
+
+        return cls(parent, get_columns(nodes_props))
+
+    @classmethod
+    def from_newick(cls, str text, parser=None):
+        """Return a compact tree read from its newick representation.
+
+        The nodes are read directly into columns, without creating the
+        intermediate Tree nodes.
+        """
+        gc_was_enabled = gc.isenabled()
+        gc.disable()  # like in newick.loads(), to not revisit the new objects
+
+        try:
+            assert text.endswith(';'), 'text ends with no ";"'
+
+            parser = parser if type(parser) is dict else newick.PARSERS[parser]
+
+            parent, nodes_props, pos = read_newick(text, parser)
+
+            assert pos == len(text) - 1, f'root node ends prematurely at {pos}'
+
+            return cls(parent, get_columns(nodes_props))
+        except AssertionError as e:
+            raise newick.NewickError(str(e))
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def to_tree(self, int64_t node=0, tree_class=Tree):
+        """Return a Tree with the contents of the subtree starting at node."""
+        cdef int64_t i
+        end = node + self.size[node]
+
+        columns = [(pname, values[node:end], get_converter(values))
+                   for pname, values in self.props.items()]
+
+        gc_was_enabled = gc.isenabled()
+        gc.disable()  # like in newick.loads(), to not revisit the new nodes
+
+        try:
+            nodes = []
+            for i in range(end - node):
+                props = {}
+                for pname, values, convert in columns:
+                    value = values[i]
+                    if not is_missing(value):
+                        props[pname] = convert(value)
+
+                nodes.append(tree_class(props))
+
+                if i > 0:
+                    nodes[self.parent[node + i] - node].add_child(nodes[-1])
+
+            return nodes[0]
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    # Basic properties.
+
+    @property
+    def nnodes(self):
+        """Number of nodes in the tree."""
+        return len(self.parent)
+
+    @property
+    def dist(self):
+        """Array with the branch length of each node (nan if missing)."""
+        return self.props['dist']
+
+    @property
+    def support(self):
+        """Array with the support of each node (nan if missing)."""
+        return self.props['support']
+
+    @property
+    def nbytes(self):
+        """Number of bytes used by the arrays (excluding python objects)."""
+        arrays = [self.parent, self.size, self.depth, self.first_child,
+                  self.next_sibling, self.root_dist, *self.props.values()]
+        return sum(a.nbytes for a in arrays)
+
+    def __len__(self):
+        """Return the number of leaves."""
+        return int(np.count_nonzero(self.first_child == -1))
+
+    def __repr__(self):
+        return '<CompactTree with %d nodes at %s>' % (self.nnodes,
+                                                      hex(id(self)))
+
+    def get_prop(self, node, prop, default=None):
+        """Return the value of property prop for the given node."""
+        values = self.props.get(prop)
+        if values is None or is_missing(values[node]):
+            return default
+        return get_converter(values)(values[node])
+
+    # Topology.
+
+    def is_leaf(self, node):
+        """Return True if the given node is a leaf."""
+        return self.first_child[node] == -1
+
+    def children(self, node):
+        """Return a list with the children of the given node."""
+        children = []
+        child = self.first_child[node]
+        while child != -1:
+            children.append(int(child))
+            child = self.next_sibling[child]
+        return children
+
+    def ancestors(self, node):
+        """Yield the ancestors of the given node, up to the root."""
+        node = self.parent[node]
+        while node != -1:
+            yield int(node)
+            node = self.parent[node]
+
+    def is_ancestor(self, node1, node2):
+        """Return True if node1 is an ancestor of node2 (or node2 itself)."""
+        return node1 <= node2 < node1 + self.size[node1]
+
+    def descendants(self, node=0):
+        """Return an array with all the descendants of node, in preorder."""
+        return np.arange(node + 1, node + self.size[node])
+
+    def leaves(self, node=0):
+        """Return an array with the leaves under the given node, in preorder."""
+        end = node + self.size[node]
+        return np.flatnonzero(self.first_child[node:end] == -1) + node
+
+    def leaf_names(self, node=0):
+        """Return a list with the names of the leaves under the given node."""
+        names = self.props.get('name')
+        if names is None:
+            return [None] * len(self.leaves(node))
+        return [names[i] for i in self.leaves(node)]
+
+    def traverse(self, strategy='levelorder', node=0):
+        """Yield the nodes under the given one, with the given strategy.
+
+        :param strategy: "preorder", "postorder" or "levelorder".
+        """
+        cdef int64_t i, end = node + self.size[node]
+        cdef const int64_t[:] size = self.size
+
+        if strategy == 'preorder':
+            yield from range(node, end)
+        elif strategy == 'levelorder':
+            order = np.argsort(self.depth[node:end], kind='stable') + node
+            yield from (int(i) for i in order)
+        elif strategy == 'postorder':
+            visiting = []  # open nodes, whose descendants are not all seen
+            for i in range(node, end):
+                while visiting and i >= visiting[-1] + size[visiting[-1]]:
+                    yield visiting.pop()
+                visiting.append(i)
+            yield from reversed(visiting)
+        else:
+            raise TreeError(f'Unknown strategy: {strategy}')
+
+    def common_ancestor(self, node1, node2):
+        """Return the last common ancestor of the given nodes."""
+        cdef int64_t n1 = node1, n2 = node2
+        cdef const int64_t[:] parent = self.parent, size = self.size
+
+        while not (n1 <= n2 < n1 + size[n1]):  # n1 is not an ancestor of n2
+            n1 = parent[n1]
+
+        return n1
+
+    def distance(self, node1, node2, topological=False):
+        """Return the distance between the given nodes.
+
+        :param topological: If True, return the number of branches
+            between the nodes instead of the sum of their lengths.
+        """
+        ancestor = self.common_ancestor(node1, node2)
+        if topological:
+            d = self.depth
+            return int(d[node1] + d[node2] - 2 * d[ancestor])
+        else:
+            d = self.root_dist
+            return float(d[node1] + d[node2] - 2 * d[ancestor])
+
+
+# Auxiliary functions.
+
+def freeze(array):
+    """Return a read-only view of the given array (which stays as it was)."""
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+def as_column(values):
+    """Return a read-only array with the given values."""
+    if isinstance(values, np.ndarray):
+        return freeze(values)
+
+    values = list(values)
+    present = [v for v in values if v is not None]
+
+    if present and all(type(v) is float for v in present):
+        return freeze(np.array([np.nan if v is None else v for v in values],
+                               dtype=np.float64))
+    elif present and len(present) == len(values) and \
+            all(type(v) is int for v in values):
+        return freeze(np.array(values, dtype=np.int64))
+    else:
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        return freeze(column)
+
+
+def get_columns(nodes_props):
+    """Return a dict with a list of values for every property in nodes_props."""
+    pnames = {}  # to keep the order in which they appear (set does not)
+    for props in nodes_props:
+        pnames.update(dict.fromkeys(props))
+
+    return {pname: [props.get(pname) for props in nodes_props]
+            for pname in pnames}
+
+
+def is_missing(value):
+    """Return True if value represents a missing property in a column."""
+    return value is None or (type(value) in [float, np.float64] and
+                             value != value)  # only true for nan
+
+
+def get_converter(values):
+    """Return function that converts elements of values to python objects."""
+    kind = values.dtype.kind
+    return float if kind == 'f' else int if kind in 'iu' else (lambda x: x)
+
+
+def get_sizes_and_depths(const int64_t[:] parent):
+    """Return arrays with the number of nodes under each node, and its depth."""
+    cdef int64_t i, n = len(parent)
+
+    size_array = np.ones(n, dtype=np.int64)
+    depth_array = np.zeros(n, dtype=np.int64)
+    cdef int64_t[:] size = size_array, depth = depth_array
+
+    for i in range(1, n):  # parents come before their children in preorder
+        assert 0 <= parent[i] < i, f'node {i} not in preorder'
+        depth[i] = depth[parent[i]] + 1
+
+    for i in range(n - 1, 0, -1):  # children before parents in reverse
+        size[parent[i]] += size[i]
+
+    return size_array, depth_array
+
+
+def get_children_links(const int64_t[:] parent, const int64_t[:] size):
+    """Return arrays with the first child and next sibling of each node."""
+    cdef int64_t i, j, n = len(parent)
+
+    first_child_array = np.full(n, -1, dtype=np.int64)
+    next_sibling_array = np.full(n, -1, dtype=np.int64)
+    cdef int64_t[:] first_child = first_child_array
+    cdef int64_t[:] next_sibling = next_sibling_array
+
+    for i in range(1, n):
+        if parent[i] == i - 1:
+            first_child[i - 1] = i  # in preorder, first child follows parent
+        j = i + size[i]  # node after all the descendants of i
+        if j < n and parent[j] == parent[i]:
+            next_sibling[i] = j
+
+    return first_child_array, next_sibling_array
+
+
+def get_root_dists(const int64_t[:] parent, dist):
+    """Return array with the distance from the root to each node."""
+    cdef int64_t i, n = len(parent)
+
+    root_dist_array = np.zeros(n, dtype=np.float64)
+    cdef double[:] root_dist = root_dist_array
+    cdef const double[:] d = np.nan_to_num(dist)  # missing dists count as 0
+
+    for i in range(1, n):
+        root_dist[i] = root_dist[parent[i]] + d[i]
+
+    return root_dist_array
+
+
+def read_newick(str text, dict parser):
+    """Return the parents, props and end position of the nodes in text.
+
+    The nodes are numbered in preorder, and read like in newick.read_node().
+    """
+    cdef long n = len(text), pos = 0
+
+    parent = []  # parent of each node
+    nodes_props = []  # props of each node
+
+    open_nodes = []  # nodes whose "(" we have entered
+
+    pos = newick.skip_spaces_and_comments(text, pos)
+
+    while True:
+        while pos < n and text[pos] == '(':  # open nodes
+            open_nodes.append(len(parent))
+            parent.append(open_nodes[-2] if len(open_nodes) > 1 else -1)
+            nodes_props.append(None)  # will be filled when we close it
+            pos = newick.skip_spaces_and_comments(text, pos + 1)
+
+        props, pos = newick.read_props(text, pos, True, parser, bool(open_nodes))
+        parent.append(open_nodes[-1] if open_nodes else -1)
+        nodes_props.append(props)
+
+        while open_nodes:  # close nodes
+            assert pos < n and text[pos] in ',)', \
+                'nodes text ends missing a matching ")"'
+
+            if text[pos] == ',':
+                pos = newick.skip_spaces_and_comments(text, pos + 1)
+                break
+
+            i = open_nodes.pop()
+            nodes_props[i], pos = newick.read_props(text, pos + 1, False,
+                                                    parser, bool(open_nodes))
+        else:
+            return parent, nodes_props, pos
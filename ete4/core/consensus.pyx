@@ -0,0 +1,557 @@
+"""
+Consensus of many trees, like the ones of a bootstrap or posterior sample.
+
+The trees are read one at a time, and only the number of trees where
+each split (bipartition) appears is kept, in a table indexed by the
+bitsets of the splits (see bipartitions.pyx). The consensus tree is
+then built from the selected splits, with their frequency as support
+and their mean length as distance::
+
+  trees = newick.iter_load(open('bootstrap.nw'))
+  t = consensus(trees, mode='majority')
+
+All the trees must have the same set of leaf names. The counting can
+be done in parallel for chunks of newicks with count_splits_newicks().
+
+The splits of a reference tree can also be searched in the trees, to
+set the support of its branches (see map_support()).
+"""
+
+import multiprocessing as mp
+from itertools import islice
+
+import numpy as np
+
+from .tree import Tree
+from . import bipartitions as bp
+from ..parser import newick
+
+
+class ConsensusError(Exception):
+    pass
+
+
+class SplitCounts:
+    """Number of trees where each split appears, and the sum of its lengths.
+
+    For unrooted trees the splits are the canonical sides of each branch
+    (the ones without the first leaf), and for rooted trees they are the
+    sets of leaves under each node (clusters).
+    """
+
+    def __init__(self, unrooted=True, max_splits=None):
+        """
+        :param unrooted: If True, treat the trees as unrooted.
+        :param max_splits: Maximum number of splits to remember. When
+            there are more, the least frequent half is forgotten (so
+            the counts of rare splits may be too low).
+        """
+        self.unrooted = unrooted
+        self.max_splits = max_splits
+
+        self.names = None  # sorted leaf names (leaf i corresponds to bit i)
+        self.ntrees = 0  # number of trees counted
+        self.counts = {}  # split -> number of trees that have it
+        self.lengths = {}  # split -> sum of its branch lengths in those trees
+        self.leaf_lengths = {}  # leaf number -> sum of its branch lengths
+        self.has_lengths = False  # did any tree have branch lengths?
+
+    def add(self, tree):
+        """Count the splits of the given tree."""
+        if self.names is None:
+            self.set_names([leaf.name for leaf in tree.leaves()])
+
+        leaf_bit = self.leaf_bit
+        all_bits = self.all_bits
+        leaf0_other = all_bits ^ 1  # other side of the branch of leaf 0
+
+        try:
+            node_bits = bp.get_node_bits(tree, lambda leaf: leaf_bit[leaf.name])
+        except KeyError as e:
+            raise ConsensusError(f'unknown leaf in tree {self.ntrees}: {e}')
+
+        # Splits of this tree and their lengths (if unrooted, both children
+        # of the root correspond to the same split).
+        splits = {}  # split -> length
+        leaf_lengths = {}  # leaf number -> length of its branch
+        nleaves = 0
+        for node, bits in node_bits.items():
+            if node is tree:
+                continue
+
+            dist = node.props.get('dist')
+            if dist is not None:
+                self.has_lengths = True
+            length = float(dist or 0)
+
+            if not node.children:
+                nleaves += 1
+                i = bits.bit_length() - 1  # leaf number
+                leaf_lengths[i] = leaf_lengths.get(i, 0) + length
+                continue
+
+            split = bp.canonical(bits, all_bits) if self.unrooted else bits
+            if split == 0 or split == all_bits:
+                continue  # a branch that does not split anything
+            elif self.unrooted and split & (split - 1) == 0:  # one leaf
+                i = split.bit_length() - 1  # (the rest of the tree is above)
+                leaf_lengths[i] = leaf_lengths.get(i, 0) + length
+            elif self.unrooted and split == leaf0_other:
+                leaf_lengths[0] = leaf_lengths.get(0, 0) + length
+            else:
+                splits[split] = splits.get(split, 0.0) + length
+
+        if node_bits[tree] != all_bits or nleaves != len(self.names):
+            raise ConsensusError(f'different leaves in tree {self.ntrees}')
+
+        for split, length in splits.items():
+            self.counts[split] = self.counts.get(split, 0) + 1
+            self.lengths[split] = self.lengths.get(split, 0) + length
+
+        for i, length in leaf_lengths.items():
+            self.leaf_lengths[i] = self.leaf_lengths.get(i, 0) + length
+
+        self.ntrees += 1
+
+        if self.max_splits and len(self.counts) > self.max_splits:
+            self.prune(self.max_splits // 2)
+
+    def set_names(self, names):
+        """Set the names of the leaves (and assign a bit to each one)."""
+        if len(set(names)) != len(names):
+            raise ConsensusError('repeated leaf names')
+
+        self.names = sorted(names)
+        self.leaf_bit = bp.get_bits(self.names, sort=False)
+        self.all_bits = bp.full(len(self.names))
+
+    def update(self, other):
+        """Add the counts of other (from a different group of trees)."""
+        if other.names is None:
+            return
+
+        if self.names is None:
+            self.set_names(other.names)
+        elif other.names != self.names:
+            raise ConsensusError('trees with different leaves')
+
+        assert other.unrooted == self.unrooted, 'mixing rooted and unrooted'
+
+        for split, count in other.counts.items():
+            self.counts[split] = self.counts.get(split, 0) + count
+            self.lengths[split] = self.lengths.get(split, 0) + other.lengths[split]
+
+        for i, length in other.leaf_lengths.items():
+            self.leaf_lengths[i] = self.leaf_lengths.get(i, 0) + length
+
+        self.ntrees += other.ntrees
+        self.has_lengths = self.has_lengths or other.has_lengths
+
+        if self.max_splits and len(self.counts) > self.max_splits:
+            self.prune(self.max_splits // 2)
+
+    def prune(self, n):
+        """Forget all the splits but the n most frequent ones."""
+        keep = sorted(self.counts, key=self.counts.get, reverse=True)[:n]
+        self.counts = {split: self.counts[split] for split in keep}
+        self.lengths = {split: self.lengths[split] for split in keep}
+
+    def support(self, split):
+        """Return the fraction of the trees that have the given split."""
+        return self.counts.get(split, 0) / self.ntrees
+
+
+def count_splits(trees, unrooted=True, max_splits=None):
+    """Return the SplitCounts of the given trees (an iterable of Tree)."""
+    split_counts = SplitCounts(unrooted, max_splits)
+
+    for tree in trees:
+        split_counts.add(tree)
+
+    return split_counts
+
+
+def count_splits_newicks(newicks, parser=None, unrooted=True, max_splits=None,
+                         processes=None, chunk_size=100):
+    """Return the SplitCounts of the trees with the given newicks.
+
+    If processes is given, the newicks are read and counted in chunks by
+    that number of worker processes (or by as many as cpus if 0).
+
+    :param newicks: Iterable of newick strings (like the ones from
+        ``newick.iter_newicks(fp)``).
+    :param parser: Parser used to read the newicks. If using processes,
+        it has to be the name of one of the predefined parsers.
+    :param chunk_size: Number of newicks sent to a worker at a time.
+    """
+    if processes is None:
+        trees = (newick.loads(text, parser) for text in newicks)
+        return count_splits(trees, unrooted, max_splits)
+
+    assert type(parser) is not dict, 'processes need a named parser'
+
+    split_counts = SplitCounts(unrooted, max_splits)
+
+    newicks = iter(newicks)
+    chunks = iter(lambda: list(islice(newicks, chunk_size)), [])
+    args = ((chunk, parser, unrooted, max_splits) for chunk in chunks)
+
+    with mp.Pool(processes or None) as pool:
+        for chunk_counts in pool.imap_unordered(count_chunk, args):
+            split_counts.update(chunk_counts)
+
+    return split_counts
+
+
+def count_chunk(args):
+    """Return the SplitCounts of a chunk of newicks (used by worker processes)."""
+    newicks, parser, unrooted, max_splits = args
+    return count_splits_newicks(newicks, parser, unrooted, max_splits)
+
+
+def select_splits(split_counts, mode='majority', threshold=None):
+    """Return list with the splits that go into the consensus tree.
+
+    :param mode: Kind of consensus. Can be "strict" (splits in all the
+        trees), "majority" (splits in more than a threshold fraction
+        of the trees, which has to be at least 0.5), or "greedy" (the
+        most frequent splits that are compatible with the ones already
+        selected, also known as extended majority rule).
+    :param threshold: Minimum fraction of trees where a split has to
+        appear, for the "majority" (strictly above it, 0.5 by default)
+        and "greedy" (at or above it, 0 by default) modes.
+    """
+    counts = split_counts.counts
+    ntrees = split_counts.ntrees
+
+    if mode == 'strict':
+        return [split for split, count in counts.items() if count == ntrees]
+    elif mode == 'majority':
+        threshold = 0.5 if threshold is None else threshold
+        if threshold < 0.5:
+            raise ConsensusError('majority consensus needs threshold >= 0.5')
+        return [split for split, count in counts.items()
+                if count > threshold * ntrees]
+    elif mode == 'greedy':
+        threshold = threshold or 0
+        candidates = sorted((split for split, count in counts.items()
+                             if count >= threshold * ntrees),
+                            key=lambda split: (-counts[split], split))
+        selected = []
+        for split in candidates:
+            if all(compatible(split, s) for s in selected):
+                selected.append(split)
+        return selected
+    else:
+        raise ConsensusError(f'unknown consensus mode: {mode}')
+
+
+def compatible(split1, split2):
+    """Return True if both splits can be in the same tree."""
+    # Splits are clusters, or canonical sides without the first leaf.
+    common = split1 & split2
+    return common == 0 or common == split1 or common == split2
+
+
+def build_tree(split_counts, splits):
+    """Return the tree with the given (compatible) splits, annotated.
+
+    The internal nodes have as support the fraction of trees with their
+    split, and as distance its mean length (if the trees had lengths).
+    """
+    names = split_counts.names
+    if names is None:
+        raise ConsensusError('no trees to build a consensus from')
+
+    numbers = np.arange(len(names))
+    lengths = split_counts.has_lengths
+
+    root = Tree()
+    owner = [root] * len(names)  # owner[i] is the deepest node with leaf i
+
+    for split in sorted(splits, key=bp.count, reverse=True):  # big first
+        leaves = bp.decode(split, numbers)  # numbers of the leaves in split
+
+        count = split_counts.counts[split]
+        node = owner[leaves[0]].add_child(support=count / split_counts.ntrees)
+        if lengths:
+            node.dist = split_counts.lengths[split] / count
+
+        for i in leaves:
+            owner[i] = node
+
+    for i, name in enumerate(names):
+        leaf = owner[i].add_child(name=name)
+        if lengths:
+            leaf.dist = split_counts.leaf_lengths.get(i, 0) / split_counts.ntrees
+
+    return root
+
+
+def consensus(trees, mode='majority', threshold=None, unrooted=True,
+              max_splits=None):
+    """Return the consensus tree of the given trees.
+
+    :param trees: Iterable of trees (they are read only once, so it
+        can be a generator that reads them from a file).
+    :param mode: "strict", "majority" or "greedy" (see select_splits()).
+    :param threshold: Minimum fraction of trees with a split (see
+        select_splits()).
+    :param unrooted: If True, treat the trees as unrooted.
+    :param max_splits: Maximum number of splits to remember while counting.
+    """
+    split_counts = count_splits(trees, unrooted, max_splits)
+    return build_tree(split_counts, select_splits(split_counts, mode, threshold))
+
+
+class SupportMap:
+    """Support of the branches of a reference tree in a collection of trees.
+
+    The support of a branch is the fraction of the trees that have its
+    split (the usual bootstrap support). With transfer=True, it is
+    instead the transfer bootstrap expectation (TBE), which also gives
+    partial credit to the trees that have a similar split: for each tree
+    it is 1 - d / (p - 1), where d is the minimum number of leaves that
+    have to be moved for the split to appear in the tree, and p is the
+    number of leaves in the smaller side of the split.
+    """
+
+    def __init__(self, tree, unrooted=True, transfer=False):
+        """
+        :param tree: Reference tree, with the branches to annotate.
+        :param unrooted: If True, treat the trees as unrooted.
+        :param transfer: If True, compute the transfer support (TBE).
+        """
+        if transfer and not unrooted:
+            raise ConsensusError('transfer support needs unrooted trees')
+
+        self.tree = tree
+        self.unrooted = unrooted
+        self.transfer = transfer
+
+        names = [leaf.name for leaf in tree.leaves()]
+        if len(set(names)) != len(names):
+            raise ConsensusError('repeated leaf names in reference tree')
+
+        self.names = sorted(names)
+        self.leaf_bit = bp.get_bits(self.names, sort=False)
+        self.all_bits = bp.full(len(self.names))
+
+        leaf_bit = self.leaf_bit
+        node_bits = bp.get_node_bits(tree, lambda leaf: leaf_bit[leaf.name])
+
+        # Nodes with a split above them (the branches to annotate).
+        self.nodes = []
+        self.split_nodes = {}  # split -> positions of its nodes in self.nodes
+        for node, bits in node_bits.items():
+            split = self.get_split(bits)
+            if node is not tree and node.children and split is not None:
+                self.split_nodes.setdefault(split, []).append(len(self.nodes))
+                self.nodes.append(node)
+
+        if transfer:
+            self.init_transfer(node_bits)
+
+        self.ntrees = 0  # number of trees added
+        self.counts = np.zeros(len(self.nodes), dtype=np.int64)  # trees with it
+        self.transfers = np.zeros(len(self.nodes))  # sum of d / (p - 1)
+
+    def __getstate__(self):  # to send it to worker processes without nodes
+        return dict(self.__dict__, tree=None, nodes=None)
+
+    def get_split(self, bits):
+        """Return the split that corresponds to bits, or None if trivial."""
+        split = bp.canonical(bits, self.all_bits) if self.unrooted else bits
+        if split == 0 or split == self.all_bits:
+            return None  # no leaves at one side
+        elif self.unrooted and (split & (split - 1) == 0 or
+                                split == self.all_bits ^ 1):
+            return None  # a single leaf at one side
+        else:
+            return split
+
+    def init_transfer(self, node_bits):
+        """Prepare the arrays used to compute transfer distances."""
+        pos = {node: i for i, node in enumerate(self.nodes)}
+
+        # Positions (in self.nodes) of the ancestors of each leaf, to find
+        # the number of leaves shared with the nodes of another tree.
+        self.leaf_ancestors = {}
+        for leaf in self.tree.leaves():
+            positions = []
+            node = leaf.up
+            while node is not None:
+                if node in pos:
+                    positions.append(pos[node])
+                node = node.up
+            self.leaf_ancestors[leaf.name] = np.array(positions, dtype=np.intp)
+
+        self.sizes = np.array([bp.count(node_bits[node]) for node in self.nodes],
+                              dtype=np.int32)  # number of leaves of each node
+        self.light_sizes = np.minimum(self.sizes, len(self.names) - self.sizes)
+
+    def add(self, tree):
+        """Add the support from the given tree."""
+        leaf_bit = self.leaf_bit
+
+        try:
+            node_bits = bp.get_node_bits(tree, lambda leaf: leaf_bit[leaf.name])
+        except KeyError as e:
+            raise ConsensusError(f'unknown leaf in tree {self.ntrees}: {e}')
+
+        splits = set()
+        nleaves = 0
+        for node, bits in node_bits.items():
+            if node.children:
+                splits.add(self.get_split(bits))
+            else:
+                nleaves += 1
+
+        if node_bits[tree] != self.all_bits or nleaves != len(self.names):
+            raise ConsensusError(f'different leaves in tree {self.ntrees}')
+
+        for split in splits:
+            for i in self.split_nodes.get(split, []):
+                self.counts[i] += 1
+
+        if self.transfer:
+            dists = self.transfer_distances(tree)
+            self.transfers += dists / (self.light_sizes - 1)
+
+        self.ntrees += 1
+
+    def transfer_distances(self, tree):
+        """Return array with the transfer distances of the branches to tree.
+
+        The transfer distance of a branch is the minimum number of leaves
+        that have to be moved to get a branch of the tree with its split.
+        """
+        n = len(self.names)
+        m = len(self.nodes)
+
+        # For every node of tree we compute the number of its leaves that
+        # are in each node of the reference (shared), from the ones of its
+        # children. The leaves to move are sizes + size - 2 * shared (or n
+        # minus that, moving them to the other side), so it is enough to
+        # know the minimum and maximum of size - 2 * shared.
+        low = np.full(m, n, dtype=np.int32)
+        high = np.full(m, -n, dtype=np.int32)
+        diff = np.empty(m, dtype=np.int32)
+
+        pending = {}  # node -> (shared, size), for nodes with pending parent
+        for node in tree.traverse('postorder'):
+            if not node.children or node is tree:
+                continue  # leaves are added directly to their parent
+
+            shared = None
+            size = 0
+            for child in node.children:
+                if child.children:
+                    shared_child, size_child = pending.pop(child)
+                    if shared is None:
+                        shared = shared_child  # reused, nobody else needs it
+                    else:
+                        shared += shared_child
+                    size += size_child
+
+            if shared is None:
+                shared = np.zeros(m, dtype=np.int32)
+
+            for child in node.children:
+                if not child.children:
+                    shared[self.leaf_ancestors[child.name]] += 1
+                    size += 1
+
+            np.multiply(shared, -2, out=diff)
+            diff += size
+            np.minimum(low, diff, out=low)
+            np.maximum(high, diff, out=high)
+
+            pending[node] = (shared, size)
+
+        dists = np.minimum(self.sizes + low, n - (self.sizes + high))
+
+        return np.minimum(dists, self.light_sizes - 1)  # or a leaf's branch
+
+    def supports(self):
+        """Return array with the support of each node in self.nodes."""
+        if self.ntrees == 0:
+            raise ConsensusError('no trees to compute the support from')
+
+        if self.transfer:
+            return 1 - self.transfers / self.ntrees
+        else:
+            return self.counts / self.ntrees
+
+    def annotate(self, prop='support'):
+        """Set the support of the branches of the reference tree in prop."""
+        for node, value in zip(self.nodes, self.supports()):
+            node.add_prop(prop, float(value))
+
+
+def map_support(tree, trees, prop='support', unrooted=True, transfer=False,
+                parser=None, processes=None, chunk_size=100):
+    """Set in prop the support in the given trees of each branch of tree.
+
+    The trees are read only once, and all need the same leaves as tree.
+    Return the SupportMap with the counts.
+
+    :param tree: Reference tree, whose branches are annotated.
+    :param trees: Iterable of trees, or of newicks (which is needed if
+        using processes).
+    :param prop: Property where the support is set.
+    :param unrooted: If True, treat the trees as unrooted.
+    :param transfer: If True, compute the transfer bootstrap expectation
+        instead of the fraction of trees with the branch.
+    :param parser: Parser used to read the newicks.
+    :param processes: If given, read and add the newicks in chunks by
+        that number of worker processes (or by as many as cpus if 0).
+    :param chunk_size: Number of newicks sent to a worker at a time.
+    """
+    support_map = SupportMap(tree, unrooted, transfer)
+
+    if processes is None:
+        for t in trees:
+            support_map.add(t if not isinstance(t, str) else
+                            newick.loads(t, parser))
+    else:
+        assert type(parser) is not dict, 'processes need a named parser'
+
+        trees = iter(trees)
+        chunks = iter(lambda: list(islice(trees, chunk_size)), [])
+        args = ((chunk, parser) for chunk in chunks)
+
+        with mp.Pool(processes or None, initializer=init_worker,
+                     initargs=(support_map,)) as pool:
+            for counts, transfers, ntrees in pool.imap_unordered(add_chunk, args):
+                support_map.counts += counts
+                support_map.transfers += transfers
+                support_map.ntrees += ntrees
+
+    support_map.annotate(prop)
+
+    return support_map
+
+
+_support_map = None  # SupportMap of each worker process (see map_support())
+
+
+def init_worker(support_map):
+    """Set the SupportMap that the worker process uses (a copy without nodes)."""
+    global _support_map
+    _support_map = support_map
+
+
+def add_chunk(args):
+    """Return the counts of a chunk of newicks (used by worker processes)."""
+    newicks, parser = args
+
+    support_map = _support_map
+    support_map.ntrees = 0
+    support_map.counts[:] = 0
+    support_map.transfers[:] = 0
+
+    for text in newicks:
+        support_map.add(newick.loads(text, parser))
+
+    return support_map.counts, support_map.transfers, support_map.ntrees
@@ -0,0 +1,398 @@
+"""
+Index of the nodes of a tree, to look them up without traversing it.
+
+A TreeIndex is built (in one pass) from the root of a tree, and every
+node of the tree keeps a reference to it. The functions that change
+the topology of the tree mark the index as outdated, and it is built
+again the next time that it is needed.
+
+Changes in the tree done without using the methods of Tree or the
+functions in operations (like appending directly to the list of
+children of a node, or replacing its props dict) are not detected.
+Call ``invalidate(node)`` after them. It also clears the statistics
+cached in the node and its ancestors (see stats.pyx).
+
+Besides names, the index can look up nodes by the value of any other
+property (like "species" or "taxid"). The table for a property is made
+the first time that it is used in ``search_nodes()``, and forgotten
+when the property changes in any node. The index counts how many
+lookups and (re)builds it does, in ``index.counts``.
+
+Optionally, the index can also answer lowest common ancestor (LCA)
+queries in constant time, with a sparse table over the Euler tour of
+the tree, and so the distance between any two nodes too. Many queries
+can be done at once with numpy arrays, as in::
+
+  index = t.build_index(lca=True)
+  ancestors = index.lca([(n1, n2), (n3, n4), ...])  # array of numbers
+  dists = index.distance([(n1, n2), (n3, n4), ...])  # array of floats
+  index.nodes[ancestors[0]]  # the node that is the LCA of n1 and n2
+"""
+
+import operator
+
+import numpy as np
+
+from libc.stdint cimport int64_t
+
+from .stats import clear_stats
+
+
+class TreeIndex:
+    """Preorder numbering, depths, ids and names of all the nodes of a tree."""
+
+    def __init__(self, root, lca=False):
+        self.root = root
+        self.has_lca = lca  # do we keep the tables to find common ancestors?
+        self.counts = {'updates': 0, 'table_builds': 0, 'lookups': 0}
+        self.update()
+
+    def __reduce__(self):
+        return (no_index, ())  # so pickled (and copied) trees have no index
+
+    def update(self):
+        """Traverse the tree again to refresh the contents of the index."""
+        nodes = []  # nodes in preorder
+        parents = []  # parents[i] is the number of the parent of nodes[i]
+        positions = []  # positions[i] is the position of nodes[i] in parent
+        depths = []  # depths[i] is the number of ancestors of nodes[i]
+
+        pending = [(self.root, -1, 0, 0)]  # (node, parent, position, depth)
+        while pending:
+            node, parent, position, depth = pending.pop()
+
+            node._index = self
+
+            parents.append(parent)
+            positions.append(position)
+            depths.append(depth)
+
+            parent = len(nodes)
+            nodes.append(node)
+
+            children = node.children
+            for i in range(len(children) - 1, -1, -1):
+                pending.append((children[i], parent, i, depth + 1))
+
+        sizes = [1] * len(nodes)  # sizes[i] is the number of nodes in subtree
+        for i in range(len(nodes) - 1, 0, -1):
+            sizes[parents[i]] += sizes[i]
+
+        self.nodes = nodes
+        self.parents = parents
+        self.positions = positions
+        self.depths = depths
+        self.sizes = sizes
+
+        self.numbers = {node: i for i, node in enumerate(nodes)}
+
+        self.names = {}  # name -> list of numbers of the nodes with that name
+        for i, node in enumerate(nodes):
+            if 'name' in node.props:
+                self.names.setdefault(node.name, []).append(i)
+
+        self.ids = [None] * len(nodes)  # node ids, filled when asked for
+        self.ids[0] = ()
+
+        self.root_dists = None  # distances to the root, computed when needed
+
+        self.tables = {}  # prop name -> (table {value: numbers}, unhashables)
+
+        if self.has_lca:
+            self.update_lca()
+
+        self.valid = True
+        self.counts['updates'] += 1
+
+    def update_lca(self):
+        """Create the tables used to find common ancestors."""
+        parents = np.array(self.parents, dtype=np.int64)
+        euler, first = euler_tour(parents)
+
+        dtype = np.int32 if len(euler) < 2**31 else np.int64
+
+        # Sparse table: table[k,i] = min(euler[i:i+2**k]), the number of
+        # the highest node in that part of the tour (numbered in preorder).
+        nlevels = max(1, len(euler).bit_length())
+        table = np.zeros((nlevels, len(euler)), dtype=dtype)
+        table[0] = euler
+        for k in range(1, nlevels):
+            half = 2**(k-1)
+            size = len(euler) - 2**k + 1
+            np.minimum(table[k-1, :size], table[k-1, half:half+size],
+                       out=table[k, :size])
+
+        self.first = first  # first[i] is the first appearance of i in the tour
+        self.table = table
+        self.log2 = np.log2(np.arange(1, len(euler) + 1)).astype(np.int8)
+        self.depths_array = np.array(self.depths, dtype=np.int64)
+
+    def clear(self):
+        """Stop indexing the tree."""
+        self.root = None
+        self.valid = False
+        self.nodes = self.numbers = self.names = self.ids = self.tables = None
+
+    def number(self, node):
+        """Return the preorder number of node, or None if not in the tree."""
+        return self.numbers.get(node)
+
+    def node_id(self, i):
+        """Return the node id (positions from the root) of node number i."""
+        path = []  # numbers of the nodes whose id we still have to compute
+        while self.ids[i] is None:
+            path.append(i)
+            i = self.parents[i]
+
+        for j in reversed(path):
+            self.ids[j] = self.ids[self.parents[j]] + (self.positions[j],)
+
+        return self.ids[path[0]] if path else self.ids[i]
+
+    def is_under(self, i, j):
+        """Return True if node number i is in the subtree of node number j."""
+        return j <= i < j + self.sizes[j]
+
+    def find(self, name, j=0):
+        """Return the numbers of the nodes named name under node number j.
+
+        They are sorted in levelorder (first by depth, then preorder).
+        """
+        self.counts['lookups'] += 1
+        found = [i for i in self.names.get(name, [])
+                 if self.is_under(i, j) and self.nodes[i].name == name]
+        return sorted(found, key=lambda i: (self.depths[i], i))
+
+    def search(self, conditions, j=0):
+        """Return the numbers of the candidates to satisfy conditions under j.
+
+        The candidates are the nodes that satisfy one of the conditions
+        (the first one with a hashable value), sorted in levelorder. The
+        caller has to check the other conditions. Return None if no
+        condition can be looked up in the index.
+
+        :param conditions: Dict with the values that the properties
+            (as in ``node.get_prop()``) must have.
+        """
+        for pname, value in conditions.items():
+            if is_hashable(value):
+                break
+        else:
+            return None
+
+        self.counts['lookups'] += 1
+
+        if pname == 'name' and value is not None:
+            numbers = self.names.get(value, [])
+        else:
+            table, unhashables = self.get_table(pname)
+            numbers = table.get(value, []) + unhashables
+
+        found = [i for i in numbers if self.is_under(i, j)]
+        return sorted(found, key=lambda i: (self.depths[i], i))
+
+    def get_table(self, pname):
+        """Return dict {value: numbers of nodes} for property pname, and
+        the list of numbers of the nodes whose values cannot be hashed."""
+        if pname not in self.tables:
+            table = {}
+            unhashables = []
+            for i, node in enumerate(self.nodes):
+                value = node.get_prop(pname)
+                if is_hashable(value):
+                    table.setdefault(value, []).append(i)
+                else:
+                    unhashables.append(i)
+
+            self.tables[pname] = (table, unhashables)
+            self.counts['table_builds'] += 1
+
+        return self.tables[pname]
+
+    def forget(self, pname):
+        """Forget the table for property pname, because it changed.
+
+        The tables of attributes that are computed (like the species of
+        a PhyloTree, which can depend on its name) go away too.
+        """
+        self.tables.pop(pname, None)
+
+        for computed in [p for p in self.tables if hasattr(type(self.root), p)]:
+            del self.tables[computed]
+
+    def get_numbers(self, nodes):
+        """Return array with the preorder numbers of the given nodes.
+
+        The nodes can also be given by their numbers (python or numpy ints).
+        """
+        return np.fromiter(map(self.get_number, nodes), dtype=np.int64)
+
+    def get_number(self, node):
+        """Return the preorder number of node (or node if it is a number)."""
+        i = self.numbers.get(node)
+        if i is not None:
+            return i
+
+        try:
+            return operator.index(node)
+        except TypeError:
+            raise KeyError(node)  # a node that is not in the tree
+
+    def lca(self, pairs):
+        """Return array with the numbers of the common ancestors of the pairs.
+
+        :param pairs: Pairs of nodes (or their preorder numbers).
+        """
+        assert self.has_lca, 'index built without lca tables'
+
+        pairs = list(pairs)
+        n1 = self.get_numbers(pair[0] for pair in pairs)
+        n2 = self.get_numbers(pair[1] for pair in pairs)
+
+        return self.lca_numbers(n1, n2)
+
+    def lca_numbers(self, n1, n2):
+        """Return array with the common ancestors of nodes numbered n1 and n2."""
+        start = np.minimum(self.first[n1], self.first[n2])
+        end = np.maximum(self.first[n1], self.first[n2]) + 1
+
+        k = self.log2[end - start - 1].astype(np.int64)  # covers half the range
+
+        return np.minimum(self.table[k, start], self.table[k, end - (1 << k)])
+
+    def distance(self, pairs, topological=False):
+        """Return array with the distances between the nodes of the pairs.
+
+        :param pairs: Pairs of nodes (or their preorder numbers).
+        :param topological: If True, return the number of branches
+            between the nodes instead of the sum of their lengths.
+        """
+        assert self.has_lca, 'index built without lca tables'
+
+        pairs = list(pairs)
+        n1 = self.get_numbers(pair[0] for pair in pairs)
+        n2 = self.get_numbers(pair[1] for pair in pairs)
+
+        d = self.depths_array if topological else self.get_root_dists()
+
+        return d[n1] + d[n2] - 2 * d[self.lca_numbers(n1, n2)]
+
+    def get_root_dists(self):
+        """Return array with the distance from the root to each node.
+
+        It is nan for the nodes with a branch without length in their path.
+        """
+        if self.root_dists is None:
+            dists = np.array([np.nan if node.dist is None else node.dist
+                              for node in self.nodes], dtype=np.float64)
+            dists[0] = 0  # the root does not count its own distance
+
+            root_dists = np.zeros(len(dists))
+            for i in range(1, len(dists)):
+                root_dists[i] = root_dists[self.parents[i]] + dists[i]
+
+            self.root_dists = root_dists
+
+        return self.root_dists
+
+    def rename(self, node, old, new):
+        """Update the name of node, which changes from old to new."""
+        i = self.numbers.get(node)
+        if i is None:
+            return  # not in the tree (anymore)
+
+        if i in self.names.get(old, []):
+            self.names[old].remove(i)
+
+        if new is not None:
+            self.names.setdefault(new, []).append(i)
+
+        self.forget('name')
+
+
+def is_hashable(value):
+    """Return True if value can be hashed (and so used as a dict key)."""
+    try:
+        hash(value)
+        return True
+    except TypeError:
+        return False
+
+
+def euler_tour(const int64_t[:] parents):
+    """Return the Euler tour of the tree and the first position of each node.
+
+    The nodes are numbered in preorder, and parents[i] is the parent of i.
+    """
+    cdef int64_t i, n = len(parents), pos = 0
+
+    euler_array = np.zeros(max(1, 2*n - 1), dtype=np.int64)
+    first_array = np.zeros(n, dtype=np.int64)
+    path_array = np.zeros(n, dtype=np.int64)  # nodes from root to current
+
+    cdef int64_t[:] euler = euler_array, first = first_array
+    cdef int64_t[:] path = path_array
+    cdef int64_t depth = 0  # number of nodes in path
+
+    for i in range(n):
+        while depth > 0 and path[depth-1] != parents[i]:
+            depth -= 1  # going up
+            euler[pos] = path[depth-1]  # the parent (we visit it again)
+            pos += 1
+
+        path[depth] = i
+        depth += 1
+        first[i] = pos
+        euler[pos] = i
+        pos += 1
+
+    while depth > 1:  # go up to the root
+        depth -= 1
+        euler[pos] = path[depth-1]
+        pos += 1
+
+    return euler_array, first_array
+
+
+def no_index():
+    return None
+
+
+def get_index(node):
+    """Return the current index of the tree that node belongs to, or None."""
+    index = node._index
+
+    if index is None:
+        return None
+
+    if not index.valid:
+        if index.root is None or index.root.up is not None:
+            node._index = None  # the indexed root is gone or not a root now
+            return None
+
+        index.update()
+
+    if node not in index.numbers:
+        node._index = None  # node is no longer in the indexed tree
+        return None
+
+    return index
+
+
+def prop_changed(node, pname):
+    """Update the index of node's tree because its property pname changed."""
+    index = node._index
+    if index is not None and index.valid and index.tables:
+        index.forget(pname)
+
+
+def invalidate(*nodes):
+    """Mark as outdated the indices of the trees that the nodes belong to.
+
+    The statistics cached in the nodes and their ancestors are removed too.
+    """
+    for node in nodes:
+        if node._index is not None:
+            node._index.valid = False
+
+        clear_stats(node)
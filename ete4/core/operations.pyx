@@ -7,11 +7,19 @@ Sorting, changing the root to a node, moving branches, removing (prunning)...
 import random
 from collections import namedtuple, deque
 
+import numpy as np
+
+from .index import invalidate, prop_changed
+from . import stats
+from .bipartitions import as_array
+
 
 def sort(tree, key=None, reverse=False):
     """Sort the tree in-place."""
     key = key or (lambda node: (node.size[1], node.size[0], node.name))
 
+    invalidate(tree)
+
     for node in tree.traverse('postorder'):
         node.children.sort(key=key, reverse=reverse)
 
@@ -79,6 +87,8 @@ def interchange_references(node1, node2):
     node1.up = up2
     node2.up = up1
 
+    invalidate(node1, node2)
+
 
 def set_outgroup(node, bprops=None, dist=None):
     """Change tree so the given node is set as outgroup.
@@ -133,6 +143,8 @@ def swap_props(n1, n2, props):
         if p2 is not None:
             n1.props[pname] = p2
 
+    invalidate(n1, n2)
+
 
 def insert_intermediate(node, intermediate, bprops=None, dist=None):
     """Insert, between node and its parent, an intermediate node."""
@@ -157,6 +169,8 @@ def insert_intermediate(node, intermediate, bprops=None, dist=None):
     up.children.insert(pos_in_parent, intermediate)  # put new where old was
     intermediate.up = up
 
+    invalidate(up)
+
 
 def join_branch(node, bprops=None):
     """Substitute node for its only child."""
@@ -179,6 +193,8 @@ def join_branch(node, bprops=None):
     up.children.insert(pos_in_parent, child)  # put child where the old node was
     child.up = up
 
+    invalidate(up, node)
+
 
 def unroot(tree, bprops=None):
     """Unroot the tree (make the root not have 2 children).
@@ -208,6 +224,8 @@ def move(node, shift=1):
 
     siblings[pos_old], siblings[pos_new] = siblings[pos_new], siblings[pos_old]
 
+    invalidate(node)
+
 
 def remove(node):
     """Remove the given node from its tree."""
@@ -332,7 +350,7 @@ def add_branch_values(root, dist_fn, support_fn):
     # Make sure the children of root have the same support.
     if any(node.support is None for node in root.children):
         for node in root.children:
-            node.props.pop('support', None)
+            node.support = None
     else:
         for node in root.children[1:]:
             node.support = root.children[0].support
@@ -387,31 +405,28 @@ def ladderize(tree, topological=False, reverse=False):
       #            ╰──┬╴a
       #               ╰╴b
     """
-    sizes = {}  # sizes of the nodes
+    # Size of a node: the distance from its parent to its farthest leaf.
+    if topological:
+        size = lambda node: 1 + node._stats.height_topo
+    else:
+        size = lambda node: stats.dist(node) + node._stats.height
 
     # Key function for the sort order. Sort by size, then by # of children.
-    key = lambda node: (sizes[node], len(node.children))
+    key = lambda node: (size(node), len(node.children))
 
-    # Distance function (branch length to consider for each node).
-    dist = ((lambda node: 1) if topological else
-            (lambda node: float(node.props.get('dist', 1))))
+    invalidate(tree)
+
+    stats.get_stats(tree)  # so all the nodes have their (cached) stats
 
     for node in tree.traverse('postorder'):
-        if node.is_leaf:
-            sizes[node] = dist(node)
-        else:
+        if not node.is_leaf:
             node.children.sort(key=key, reverse=reverse)  # time to sort!
 
-            sizes[node] = dist(node) + max(sizes[n] for n in node.children)
-
-            for n in node.children:
-                sizes.pop(n)  # free memory, no need to keep all the sizes
-
 
 def to_dendrogram(tree):
     """Convert tree to dendrogram (remove all distance values)."""
     for node in tree.traverse():
-        node.props.pop('dist', None)
+        node.dist = None  # its setter updates the stats and index too
 
 
 def to_ultrametric(tree, topological=False):
@@ -541,6 +556,192 @@ def set_midpoint_outgroup(tree, topological=False):
     set_outgroup(node, dist=dist)
 
 
+def cophenetic_matrix(tree, topological=False, dtype=np.float64,
+                      condensed=False, out=None):
+    """Return the matrix of distances between leaves, and the leaf names.
+
+    The leaves are sorted by name. Every row is computed with numpy in
+    O(n) from the distances to the root and the common ancestors of
+    consecutive leaves, so the full matrix takes O(n^2).
+
+    :param topological: If True, the distance between leaves is the
+        number of branches between them.
+    :param dtype: Type of the numbers in the returned array.
+    :param condensed: If True, return only the upper triangle of the
+        matrix, as a flat array (like scipy's ``pdist()``).
+    :param out: Array where to write the result (like a memory-mapped
+        file, for matrices that do not fit in memory). Rows are
+        written one at a time.
+    """
+    dists, leaves, leaf_numbers, lcas = get_cophenetic_data(tree, topological)
+
+    n = len(leaves)
+    names = [leaf.name for leaf in leaves]
+    order = sorted(range(n), key=lambda i: names[i] or '')  # leaves in output
+
+    shape = (n * (n - 1) // 2,) if condensed else (n, n)
+    if out is None:
+        out = np.zeros(shape, dtype=dtype)
+    else:
+        assert out.shape == shape, f'output has shape {out.shape}, not {shape}'
+
+    rows = cophenetic_rows(dists, leaf_numbers, lcas, order)
+    for r, row in enumerate(rows):
+        if condensed:
+            start = n * r - r * (r + 1) // 2  # where the row starts (scipy)
+            out[start:start + n - r - 1] = row[r+1:]
+        else:
+            out[r] = row
+
+    return out, [names[i] for i in order]
+
+
+def get_cophenetic_data(tree, topological=False):
+    """Return the arrays needed to compute the cophenetic matrix of tree.
+
+    They are the distances from the root to each node (numbered in
+    preorder), the leaves, their numbers, and the numbers of the
+    common ancestors of each pair of consecutive leaves.
+    """
+    dists = []  # distance from the root to each node
+    leaves = []  # leaf nodes, in preorder
+    leaf_numbers = []  # number (in preorder) of each leaf
+    lcas = []  # lcas[k] is the common ancestor of leaves k and k+1
+
+    after_leaf = False  # was the last visited node a leaf?
+    pending = [(tree, -1)]  # (node, number of its parent)
+    while pending:
+        node, parent = pending.pop()
+
+        if parent == -1:
+            dists.append(0)  # we are at the root
+        else:
+            d = 1 if topological else node.props.get('dist', 0)
+            dists.append(dists[parent] + d)
+
+        if after_leaf:  # we went up to parent after the last leaf
+            lcas.append(parent)
+
+        if node.is_leaf:
+            leaves.append(node)
+            leaf_numbers.append(len(dists) - 1)
+            after_leaf = True
+        else:
+            number = len(dists) - 1
+            pending.extend((child, number) for child in node.children[::-1])
+            after_leaf = False
+
+    return (np.array(dists, dtype=np.float64), leaves,
+            np.array(leaf_numbers, dtype=np.int64),
+            np.array(lcas, dtype=np.int64))
+
+
+def cophenetic_rows(dists, leaf_numbers, lcas, order):
+    """Yield the rows of the cophenetic matrix, for the leaves in order."""
+    leaf_dists = dists[leaf_numbers]
+
+    ancestors = np.zeros(len(leaf_numbers), dtype=np.int64)
+
+    for i in order:
+        # As nodes are numbered in preorder, the common ancestor of leaves
+        # i and j is the one with the lowest number among the ancestors of
+        # consecutive leaves between them.
+        ancestors[i] = leaf_numbers[i]
+        np.minimum.accumulate(lcas[i:], out=ancestors[i+1:])
+        ancestors[:i] = np.minimum.accumulate(lcas[:i][::-1])[::-1]
+
+        row = leaf_dists[i] + leaf_dists - 2 * dists[ancestors]
+
+        yield row[order]
+
+
+# Properties as arrays.
+
+def nodes_list(tree, order='preorder'):
+    """Return list with the nodes of tree in the given traversal order.
+
+    It is like list(tree.traverse(order)), but faster.
+    """
+    if order == 'levelorder':
+        return list(traverse_bfs(tree))
+
+    assert order in ['preorder', 'postorder'], f'unknown order: {order}'
+
+    nodes = []
+    pending = [tree]
+    while pending:
+        node = pending.pop()
+        nodes.append(node)
+        if order == 'preorder':
+            pending.extend(node.children[::-1])
+        else:
+            pending.extend(node.children)
+
+    if order == 'postorder':
+        nodes.reverse()  # reversed (root, last child..., first child...)
+
+    return nodes
+
+
+def get_nodes_array(tree, order='preorder'):
+    """Return arrays with the nodes of tree and the positions of their parents.
+
+    The nodes are in the given traversal order, and the parent of
+    tree (the root of the arrays) appears as -1.
+    """
+    nodes = nodes_list(tree, order)
+
+    position = {node: i for i, node in enumerate(nodes)}
+    position[tree.up] = -1  # tree's parent is not in the arrays
+
+    parents = np.fromiter((position[node.up] for node in nodes),
+                          dtype=np.int64, count=len(nodes))
+
+    return as_array(nodes), parents
+
+
+def get_props_array(tree, prop, order='preorder', default=np.nan,
+                    dtype=np.float64):
+    """Return array with the values of property prop for the nodes of tree.
+
+    The nodes are in the given traversal order (like in get_nodes_array()),
+    and the ones without the property have the default value.
+    """
+    values = [node.props.get(prop, default) for node in nodes_list(tree, order)]
+
+    if np.dtype(dtype) == object:
+        return as_array(values)
+    else:
+        return np.array(values, dtype=dtype)
+
+
+def set_props_array(tree, prop, values, order='preorder'):
+    """Set property prop of the nodes of tree to the given values.
+
+    The nodes are in the given traversal order (like in get_nodes_array()).
+    A value of nan (or None) removes the property from its node.
+    """
+    nodes = nodes_list(tree, order)
+
+    values = np.asarray(values)
+    assert values.shape == (len(nodes),), \
+        f'values have shape {values.shape}, not {(len(nodes),)}'
+
+    missing = (np.isnan(values) if values.dtype.kind == 'f' else
+               np.array([v is None for v in values.tolist()], dtype=bool))
+
+    for node, value, is_missing in zip(nodes, values.tolist(), missing):
+        if prop in ['name', 'dist', 'support']:  # use their setters
+            setattr(node, prop, None if is_missing else value)
+        elif is_missing:
+            node.props.pop(prop, None)
+        else:
+            node.props[prop] = value
+
+    if prop not in ['name', 'dist', 'support']:
+        prop_changed(tree, prop)  # once for all the nodes
+
+
 # Traversing the tree.
 
 def traverse(tree, order=-1, is_leaf_fn=None):
@@ -0,0 +1,118 @@
+"""
+Statistics of the subtrees of a tree, cached in their nodes.
+
+The statistics of a node (its number of leaves, its height...) are
+computed the first time that they are needed, reusing the ones that
+its descendants already have, and kept in the node.
+
+The functions that change the tree clear them, from the node that
+changes up to the root (see ``invalidate()`` in index.pyx), so after a
+change only the statistics along that path are computed again. If a
+node has no statistics, none of its ancestors has them either.
+
+Branches without a distance count as 1 (like in ``get_farthest_leaf()``
+and ``ladderize()``). The branch of the node itself is not included.
+"""
+
+import gc
+from collections import namedtuple
+
+
+class Stats(namedtuple('Stats', 'nleaves nnodes height height_topo length',
+                       module=__name__)):
+    # nleaves: number of leaves under the node (1 for a leaf)
+    # nnodes: number of nodes in the subtree (including the node itself)
+    # height: distance from the node to its farthest leaf
+    # height_topo: number of branches from the node to its farthest leaf
+    # length: sum of the distances of all the branches under the node
+    __slots__ = ()
+
+    def __reduce__(self):
+        return (no_stats, ())  # so pickled (and copied) trees have no stats
+
+
+def no_stats():
+    return None
+
+LEAF_STATS = Stats(1, 1, 0.0, 0, 0.0)
+
+
+def get_stats(node):
+    """Return the (cached) statistics of the subtree that starts at node."""
+    if node._stats is None:
+        update_stats(node)
+
+    return node._stats
+
+
+def update_stats(node):
+    """Compute the statistics of node and its descendants that lack them."""
+    missing = []  # nodes without stats, in preorder
+    pending = [node]
+    while pending:
+        n = pending.pop()
+        missing.append(n)
+        pending.extend(child for child in n.children if child._stats is None)
+
+    gc_was_enabled = gc.isenabled()
+    gc.disable()  # like in newick.loads(), to not revisit the new stats
+
+    try:
+        for n in reversed(missing):  # children before their parents
+            if not n.children:
+                n._stats = LEAF_STATS
+            else:
+                nleaves, nnodes, height, height_topo, length = 0, 1, 0.0, 0, 0.0
+                for child in n.children:
+                    s = child._stats
+                    d = dist(child)
+                    nleaves += s.nleaves
+                    nnodes += s.nnodes
+                    height = max(height, d + s.height)
+                    height_topo = max(height_topo, 1 + s.height_topo)
+                    length += d + s.length
+
+                n._stats = Stats(nleaves, nnodes, height, height_topo, length)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def clear_stats(node):
+    """Remove the statistics of node and its ancestors (they are outdated)."""
+    while node is not None and node._stats is not None:
+        node._stats = None
+        node = node.up
+
+
+def dist(node):
+    """Return the length of the branch of node (1 if it has none)."""
+    return float(node.props.get('dist', 1))
+
+
+def farthest_leaf(node, topological=False):
+    """Return the farthest leaf under node, using the cached statistics.
+
+    It is the first one (in preorder) if several are at the same distance.
+    """
+    height = lambda n: n._stats.height_topo if topological else n._stats.height
+    branch = (lambda n: 1) if topological else dist
+
+    top = node
+    get_stats(top)
+
+    while node.children:
+        h = height(node)
+        child = next((child for child in node.children
+                      if branch(child) + height(child) == h), None)
+
+        if child is None:  # outdated stats (props changed directly)
+            clear_stats(top)
+            for n in top.descendants():
+                n._stats = None
+            get_stats(top)  # redo them all
+            node = top  # and start again
+        else:
+            node = child
+
+    return node
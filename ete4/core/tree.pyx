@@ -1,12 +1,17 @@
 import copy
+import gc
 import itertools
 from hashlib import md5
-from functools import cmp_to_key
 import pickle
 import math
 
+import numpy as np
+
 from . import text_viz
 from . import operations as ops
+from . import bipartitions
+from .index import TreeIndex, get_index, invalidate, prop_changed
+from . import stats
 from .. import utils
 from ..parser import newick, ete_format, indent
 
@@ -25,6 +30,8 @@ cdef class Tree:
     cdef public dict props
     cdef public list _children
     cdef public (double, double) size  # sum of lengths, number of leaves
+    cdef public object _index  # TreeIndex of its tree, if any (see index.pyx)
+    cdef public object _stats  # cached Stats of its subtree (see stats.pyx)
 
     def __init__(self, data=None, children=None, parser=None):
         """
@@ -89,11 +96,16 @@ cdef class Tree:
 
     @name.setter
     def name(self, value):
+        old = self.name
+
         if value is not None:
             self.props['name'] = str(value)
         else:
             self.props.pop('name', None)
 
+        if self._index is not None and self._index.valid:
+            self._index.rename(self, old, self.name)
+
     @property
     def dist(self):
         return float(self.props['dist']) if 'dist' in self.props else None
@@ -105,6 +117,13 @@ cdef class Tree:
         else:
             self.props.pop('dist', None)
 
+        if self._index is not None:
+            self._index.root_dists = None  # they have to be computed again
+            prop_changed(self, 'dist')
+
+        if self.up is not None and self.up._stats is not None:
+            stats.clear_stats(self.up)  # its branch is in the parent's stats
+
     @property
     def support(self):
         return float(self.props['support']) if 'support' in self.props else None
@@ -116,12 +135,18 @@ cdef class Tree:
         else:
             self.props.pop('support', None)
 
+        if self._index is not None:
+            prop_changed(self, 'support')
+
     @property
     def children(self):
         return self._children
 
     @children.setter
     def children(self, children):
+        if self._index is not None or self._stats is not None:
+            invalidate(self)
+
         self._children = []
         self.add_children(children)
 
@@ -146,6 +171,10 @@ cdef class Tree:
     @property
     def id(self):
         """Return node_id (list of relative hops from root to node)."""
+        index = get_index(self)
+        if index is not None:
+            return index.node_id(index.numbers[self])
+
         reversed_id = []
         node = self
         while node.up is not None:
@@ -156,6 +185,10 @@ cdef class Tree:
     @property
     def level(self):
         """Return the number of nodes between this node and the root."""
+        index = get_index(self)
+        if index is not None:
+            return index.depths[index.numbers[self]]
+
         n = 0
         node = self.up
         while node is not None:
@@ -174,12 +207,19 @@ cdef class Tree:
 
     def __len__(self):
         """Return the number of leaves."""
-        return sum(1 for _ in self.leaves())
+        return stats.get_stats(self).nleaves
 
     def __getitem__(self, node_id):
         """Return the node that matches the given node_id."""
         try:
             if type(node_id) == str:    # node_id can be the name of a node
+                index = get_index(self)
+                if index is not None:
+                    found = index.find(node_id, index.numbers[self])
+                    if not found:
+                        raise TreeError(f'No node found with name: {node_id}')
+                    return index.nodes[found[0]]
+
                 return next(n for n in self.traverse() if n.name == node_id)
             elif type(node_id) == int:  # or the index of a child
                 return self.children[node_id]
@@ -231,6 +271,13 @@ cdef class Tree:
 
         :param node: A Tree instance or a name (the name of a node).
         """
+        index = get_index(self)
+        if index is not None and type(node) == str:
+            return bool(index.find(node, index.numbers[self]))
+        elif index is not None and isinstance(node, self.__class__):
+            i = index.number(node)
+            return i is not None and index.is_under(i, index.numbers[self])
+
         if isinstance(node, self.__class__):
             return node in self.traverse()
         elif type(node) == str:
@@ -246,15 +293,33 @@ cdef class Tree:
         """Add or update node's property to the given value."""
         self.props[name] = value
 
+        if self._index is not None:
+            prop_changed(self, name)
+
+        if name == 'dist' and self.up is not None:
+            stats.clear_stats(self.up)
+
     def add_props(self, **props):
         """Add or update several properties."""
         for name, value in props.items():
             self.props[name] = value
 
+            if self._index is not None:
+                prop_changed(self, name)
+
+        if 'dist' in props and self.up is not None:
+            stats.clear_stats(self.up)
+
     def del_prop(self, name):
         """Delete a node's property."""
         self.props.pop(name, None)
 
+        if self._index is not None:
+            prop_changed(self, name)
+
+        if name == 'dist' and self.up is not None:
+            stats.clear_stats(self.up)
+
     # Topology management
     def add_child(self, child=None, name=None, dist=None, support=None):
         """Add a new child to this node and return it.
@@ -279,6 +344,11 @@ cdef class Tree:
         if support is not None:
             child.support = support
 
+        if self._index is not None or self._stats is not None:
+            invalidate(self)
+        if (<Tree>child)._index is not None:
+            (<Tree>child)._index.valid = False
+
         child.up = self
         self.children.append(child)
 
@@ -294,6 +364,8 @@ cdef class Tree:
         try:
             child = self.children.pop(child_idx)  # parent removes child
 
+            invalidate(self)
+
             if child.up is self:  # (it may point to another already!)
                 child.up = None  # child removes parent
 
@@ -313,6 +385,8 @@ cdef class Tree:
 
             self.children.remove(child)  # parent removes child
 
+            invalidate(self)
+
             if child.up == self:  # (it may point to another already!)
                 child.up = None  # child removes parent
 
@@ -406,6 +480,7 @@ cdef class Tree:
         function. This mechanism can be seen as a "cut and paste".
         """
         if self.up:
+            invalidate(self)
             self.up.children.remove(self)
             self.up = None
 
@@ -469,63 +544,93 @@ cdef class Tree:
           # ╴root╶╌╴H╶╌╴F╶┤
           #               ╰╴B
         """
-        def cmp_nodes(x, y):
-            # if several nodes are in the same path of two kept nodes,
-            # only one should be maintained. This prioritize internal
-            # nodes that are already in the to_keep list and then
-            # deeper nodes (closer to the leaves).
-            if n2depth[x] > n2depth[y]:
-                return -1
-            elif n2depth[x] < n2depth[y]:
-                return 1
+        seeds = set(self._translate_nodes(nodes))  # nodes asked to keep
+
+        if not seeds:
+            raise TreeError('No common ancestor for nodes: []')
+
+        # Mark the seeds and their ancestors (up to self). The nodes that
+        # are not marked will go away with all their subtrees.
+        marked = {self}
+        for seed in seeds:
+            node = seed
+            while node not in marked:
+                marked.add(node)
+                node = node.up
+                if node is None:
+                    raise TreeError(f'No common ancestor for nodes: {list(seeds)}')
+
+        postorder = []  # marked nodes (in postorder, once reversed)
+        pending = [self]
+        while pending:
+            node = pending.pop()
+            postorder.append(node)
+            pending.extend(n for n in node.children if n in marked)
+        postorder.reverse()
+
+        # For every marked node, find how many seeds it has strictly under
+        # it, and which of its children are marked (have seeds or are seeds).
+        nseeds = {}  # node -> number of seeds under it
+        seeded = {}  # node -> marked children
+        for node in postorder:
+            seeded[node] = [n for n in node.children if n in marked]
+            nseeds[node] = sum(nseeds[n] + (n in seeds) for n in seeded[node])
+
+        # Nodes with the same seeds under them form a chain. We keep the
+        # deepest node of each chain with at least 2 seeds, unless the chain
+        # already contains a kept node. So for every node, see if its chain
+        # has a kept node above it, going from the root to the leaves.
+        to_keep = seeds | {self}
+        kept_above = {self: False}  # node -> is there a kept node in its chain above?
+        for node in reversed(postorder):  # parents before their children
+            if node is not self:
+                parent = node.up
+                kept_above[node] = (node not in seeds and
+                                    len(seeded[parent]) == 1 and
+                                    (parent in to_keep or kept_above[parent]))
+
+            is_deepest = (len(seeded[node]) > 1 or
+                          (len(seeded[node]) == 1 and seeded[node][0] in seeds))
+            if (node not in to_keep and nseeds[node] > 1 and is_deepest and
+                not kept_above[node]):
+                to_keep.add(node)
+
+        invalidate(self)  # before its descendants lose their stats
+
+        # Remove the other nodes, passing their children to their parents.
+        # The resulting order of the children, and of the sums of branch
+        # lengths, is the same as deleting them one by one in postorder.
+        final_children = {}  # node -> its children after pruning
+        for node in postorder:
+            children = [n for n in seeded[node] if n in to_keep]
+            for n in seeded[node]:
+                if n not in to_keep:
+                    children += final_children.pop(n)
+
+            for n in node.children:
+                if n not in marked:
+                    n.up = None  # the subtree goes away
+
+            if node in to_keep:
+                node.children[:] = children  # update list in place
+                for child in children:
+                    child.up = node
             else:
-                return 0
-
-        to_keep = set(self._translate_nodes(nodes))
-        start = self.common_ancestor(to_keep)
-        node2path = {n: n.lineage() for n in to_keep}
-        to_keep.add(self)
-
-        # Calculate which kept nodes are visiting the same nodes in
-        # their path to the common ancestor.
-        n2count = {}
-        n2depth = {}
-        for seed, path in node2path.items():
-            for visited_node in path:
-                if visited_node not in n2depth:
-                    depth = visited_node.get_distance(visited_node, start,
-                                                      topological=True)
-                    n2depth[visited_node] = depth
-                if visited_node is not seed:
-                    n2count.setdefault(visited_node, set()).add(seed)
-
-        # if several internal nodes are in the path of exactly the same kept
-        # nodes, only one (the deepest) should be maintain.
-        visitors2nodes = {}
-        for node, visitors in n2count.items():
-            # keep nodes connection at least two other nodes
-            if len(visitors)>1:
-                visitor_key = frozenset(visitors)
-                visitors2nodes.setdefault(visitor_key, set()).add(node)
-
-        for visitors, nodes in visitors2nodes.items():
-            if not (to_keep & nodes):
-                sorted_nodes = sorted(nodes, key=cmp_to_key(cmp_nodes))
-                to_keep.add(sorted_nodes[0])
-
-        for n in self.descendants('postorder'):
-            if n not in to_keep:
-                if preserve_branch_length and n.dist is not None:
-                    if len(n.children) == 1:
-                        if n.children[0].dist is not None:
-                            n.children[0].dist += n.dist
-                    elif len(n.children) > 1 and n.up and n.up.dist is not None:
-                        n.up.dist += n.dist
-
-                n.delete(prevent_nondicotomic=False)
+                if preserve_branch_length and node.dist is not None:
+                    if len(children) == 1:
+                        if children[0].dist is not None:
+                            children[0].dist += node.dist
+                    elif len(children) > 1 and node.up and node.up.dist is not None:
+                        node.up.dist += node.dist
+
+                final_children[node] = children
+                node.up = None
+
+            node._stats = None  # its subtree changed
 
     def reverse_children(self):
         """Reverse current children order."""
+        invalidate(self)
         self.children.reverse()
 
     def swap_children(self):
@@ -533,6 +638,7 @@ cdef class Tree:
         n = len(self.children)
         assert n == 2, f'Node has {n} children. Use reverse_children() instead?'
 
+        invalidate(self)
         self.children.reverse()
 
     def get_children(self):
@@ -635,6 +741,17 @@ cdef class Tree:
         if not names:
             return list(nodes)  # avoid traversing tree if no names to translate
 
+        index = get_index(self)
+        if index is not None:
+            name2node = {}
+            for name in names:
+                found = index.find(name, index.numbers[self])
+                assert len(found) < 2, f'Ambiguous node name: {name}'
+                if found:
+                    name2node[name] = index.nodes[found[0]]
+
+            return [name2node[n] if type(n) == str else n for n in nodes]
+
         name2node = {}
         for node in self.traverse():
             if node.name in names:
@@ -643,6 +760,36 @@ cdef class Tree:
 
         return [name2node[n] if type(n) == str else n for n in nodes]
 
+    def build_index(self, lca=False):
+        """Index the nodes of the tree and return the index.
+
+        With the index, getting the id or level of a node, looking up
+        nodes by name (or by any property, in ``search_nodes()``) and
+        checking if a node is in a (sub)tree take constant time. It
+        is updated when the tree changes, on its next use after the
+        change.
+
+        :param lca: If True, the index will also find common ancestors
+            and distances between nodes in constant time (at the cost
+            of more memory, O(n log n)).
+        """
+        if self.up is not None:
+            raise TreeError('an index can only be built from the root')
+
+        if self._index is not None and self._index.root is self:
+            self._index.has_lca = lca
+            self._index.update()
+        else:
+            self._index = TreeIndex(self, lca)
+
+        return self._index
+
+    def remove_index(self):
+        """Stop using an index for the nodes of the tree (if it had one)."""
+        if self._index is not None:
+            self._index.clear()
+            self._index = None
+
     def describe(self):
         """Return a string with information on this node and its connections."""
         if len(self.root.children) == 2:
@@ -653,11 +800,11 @@ cdef class Tree:
             rooting = 'No children'
 
         max_node, max_dist = self.get_farthest_leaf()
-        cached_content = self.get_cached_content()
+        subtree_stats = stats.get_stats(self)
 
         return '\n'.join([
-            'Number of leaf nodes: %d' % len(cached_content[self]),
-            'Total number of nodes: %d' % len(cached_content),
+            'Number of leaf nodes: %d' % subtree_stats.nleaves,
+            'Total number of nodes: %d' % subtree_stats.nnodes,
             'Rooted: %s' % rooting,
             'Most distant node: %s' % (max_node.name or ''),
             'Max. distance: %g' % max_dist])
@@ -666,8 +813,10 @@ cdef class Tree:
               format_root_node=False, is_leaf_fn=None):
         """Return or write to file the newick representation.
 
-        :param str outfile: Name of the output file. If present, it will write
-            the newick to that file instad of returning it as a string.
+        :param outfile: Name of the output file (or a file object). If
+            present, it will write the newick to that file instad of
+            returning it as a string. The text is written as it is
+            produced, without building the full newick in memory.
         :param list props: Properties to write for all nodes using the Extended
             Newick Format. If None, write all available properties.
         :param parser: Parser used to encode the tree in newick format.
@@ -682,6 +831,8 @@ cdef class Tree:
 
         if not outfile:
             return newick.dumps(self, props, parser, format_root_node, is_leaf_fn)
+        elif hasattr(outfile, 'write'):
+            newick.dump(self, outfile, props, parser, format_root_node, is_leaf_fn)
         else:
             with open(outfile, 'w') as fp:
                 newick.dump(self, fp, props, parser, format_root_node, is_leaf_fn)
@@ -693,6 +844,17 @@ cdef class Tree:
         """
         nodes = self._translate_nodes(nodes)
 
+        index = get_index(self)
+        if index is not None and index.has_lca and nodes:
+            numbers = [index.number(n) for n in nodes]
+            if None not in numbers:
+                first = index.first[numbers]  # the extremes in the euler tour
+                n1, n2 = numbers[first.argmin()], numbers[first.argmax()]
+                i = int(index.lca_numbers([n1], [n2])[0])
+                if not index.is_under(i, index.numbers[self]):
+                    raise TreeError(f'No common ancestor for nodes: {nodes}')
+                return index.nodes[i]
+
         root = ops.common_ancestor(nodes)
 
         if root is None or self not in root.lineage():
@@ -707,7 +869,20 @@ cdef class Tree:
 
           for node in tree.search_nodes(dist=0.0, name='human'):
               print(node.prop['support'])
+
+        If the tree has an index (see ``build_index()``), it is used
+        to find the candidate nodes without traversing the tree.
         """
+        index = get_index(self)
+        if index is not None:
+            found = index.search(conditions, index.numbers[self])
+            if found is not None:
+                for i in found:
+                    node = index.nodes[i]
+                    if all(node.get_prop(k) == v for k, v in conditions.items()):
+                        yield node
+                return
+
         for node in self.traverse():
             if all(node.get_prop(k) == v for k, v in conditions.items()):
                 yield node
@@ -740,10 +915,17 @@ cdef class Tree:
         :param topological: If True, distance will refer to the number of
             nodes between target and target2.
         """
-        d = (lambda node: 1) if topological else (lambda node: node.dist)
-
         node1, node2 = self._translate_nodes([node1, node2])
 
+        index = get_index(self)
+        if (index is not None and index.has_lca and
+                node1 in index.numbers and node2 in index.numbers):
+            d = index.distance([(node1, node2)], topological)[0]
+            if not math.isnan(d):  # else a branch has no length, see below
+                return int(d) if topological else float(d)
+
+        d = (lambda node: 1) if topological else (lambda node: node.dist)
+
         root = self.root.common_ancestor([node1, node2])  # common root
 
         return (sum(d(n) for n in node1.lineage(root, include_root=False)) +
@@ -823,6 +1005,16 @@ cdef class Tree:
         :param topological: If True, the distance between nodes will be the
             number of nodes between them (instead of the sum of branch lenghts).
         """
+        if is_leaf_fn is None:  # use the cached statistics of the subtrees
+            if self.is_leaf:
+                return self, 0.0
+
+            leaf = stats.farthest_leaf(self, topological)  # may redo stats
+            subtree_stats = stats.get_stats(self)
+            max_dist = (float(subtree_stats.height_topo - 1) if topological else
+                        subtree_stats.height)
+            return leaf, max_dist
+
         min_node, min_dist, max_node, max_dist = \
             self._get_farthest_and_closest_leaves(topological=topological,
                                                   is_leaf_fn=is_leaf_fn)
@@ -1037,6 +1229,17 @@ cdef class Tree:
            copied based on the standard "copy" Python functionality
            (this is the slowest method but it allows to copy complex
            objects even if attributes point to lambda functions, etc.)
+        - "shallow": The nodes are created anew (keeping their class,
+           like PhyloTree), with shallow copies of their properties. It
+           is the fastest way to get an independent topology, but the
+           property values themselves (lists, etc.) are shared with
+           the original.
+        - "shared": Like "shallow", but the copied nodes share the
+           props dicts with the original ones, so changing a property
+           in one changes it in the other. Useful for copies that only
+           change the topology. The index of the original tree (if any)
+           is removed, since its properties can now change without it
+           knowing.
         """
         method = method.lower()
         if method=="newick":
@@ -1054,11 +1257,51 @@ cdef class Tree:
             self.up = None
             new_node = pickle.loads(pickle.dumps(self, 2))
             self.up = parent
+        elif method in ["shallow", "shared"]:
+            new_node = self._copy_nodes(share_props=(method == "shared"))
+            if method == "shared" and self._index is not None:
+                self._index.clear()  # changes in the copy would outdate it
         else:
             raise TreeError("Invalid copy method")
 
         return new_node
 
+    def _copy_nodes(self, share_props=False):
+        """Return a copy of the tree, made node by node (without recursion)."""
+        cdef Tree node, parent, new
+
+        gc_was_enabled = gc.isenabled()
+        gc.disable()  # like in newick.loads(), to not revisit the new nodes
+
+        try:
+            root = None
+            pending = [(self, None)]  # (node to copy, parent of its copy)
+            while pending:
+                node, parent = pending.pop()
+
+                new = node.__class__.__new__(node.__class__)  # no __init__()
+                new.props = node.props if share_props else node.props.copy()
+                new._children = []
+                new.size = node.size
+                new._stats = node._stats  # the same, since the subtree is too
+
+                attrs = getattr(node, '__dict__', None)  # for subclasses
+                if attrs:
+                    new.__dict__.update(attrs)
+
+                if parent is None:
+                    root = new
+                else:
+                    new.up = parent
+                    parent._children.append(new)
+
+                pending += [(n, new) for n in node._children[::-1]]
+
+            return root
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
     def ladderize(self, topological=False, reverse=False):
         """Sort branches according to the size of each partition."""
         ops.ladderize(self, topological, reverse)
@@ -1079,33 +1322,75 @@ cdef class Tree:
         ``container_type``). And instead of the leaves themselves, it
         can be any of their properties (like their names, with ``prop``).
 
+        When only the membership or the number of leaves is needed,
+        ``container_type`` can be ``'range'`` or ``'bits'``, which take
+        much less memory. The leaves under any node are contiguous in
+        ``list(self.leaves())``, and the node gets the range of their
+        positions in that list (so ``leaves[r.start:r.stop]`` are its
+        leaves), or an int with the bits of those positions set. With
+        ``leaves_only=False``, the positions refer instead to the list
+        of all the nodes in preorder, ``list(self.traverse('preorder'))``.
+
         :param prop: Node property that should be cached (i.e.
             name, distance, etc.). If None, it caches the node itself.
-        :param container_type: Type of container for the leaves (set, list).
+            It is not used with ranges and bits.
+        :param container_type: Type of container for the leaves (set,
+            list, 'range', 'bits').
         :param leaves_only: If False, for each node it stores all its
             descendant nodes, not only its leaves.
         """
-        def get_content():  # return the node itself, or its requested prop
-            return self if prop is None else self.get_prop(prop)
+        nodes = list(self.traverse('preorder'))
+
+        # All the nodes under a node are contiguous in preorder, and so are
+        # its leaves. Find the positions where they start and end.
+        starts = []  # starts[i] is the position where nodes[i] starts
+        count = 0
+        for node in nodes:
+            starts.append(count)
+            if node.is_leaf or not leaves_only:
+                count += 1
+
+        stops = {}  # stops[node] is the position after its last leaf (or node)
+        for node, start in zip(reversed(nodes), reversed(starts)):
+            if node.is_leaf:
+                stops[node] = start + 1
+            else:
+                stops[node] = stops[node.children[-1]]
 
-        # Leaves, or nodes, or just their requested property, for each node.
-        leaves = {self: container_type(
-            [get_content()] if self.is_leaf or not leaves_only else [])}
+        if container_type == 'range':
+            return {node: range(start, stops[node])
+                    for node, start in zip(nodes, starts)}
+        elif container_type == 'bits':
+            full = bipartitions.full
+            return {node: full(stops[node] - start) << start
+                    for node, start in zip(nodes, starts)}
 
-        for node in self.children:
-            node_leaves = node.get_cached_content(prop=prop,
-                                                  container_type=container_type,
-                                                  leaves_only=leaves_only)
-            # Update the leaves dictionary.
-            leaves.update(node_leaves)
+        # Leaves, or nodes, or just their requested property, in preorder.
+        contents = [node if prop is None else node.get_prop(prop)
+                    for node in nodes if node.is_leaf or not leaves_only]
 
-            # Update the leaves (or nodes, or their prop) assigned to self.
-            if container_type == set:
-                leaves[self].update(node_leaves[node])
-            elif container_type == list:
-                leaves[self].extend(node_leaves[node])
+        gc_was_enabled = gc.isenabled()
+        gc.disable()  # like in newick.loads(), to not revisit the new containers
 
-        return leaves
+        try:
+            if container_type == set:  # merging the children's is faster
+                sets = {}
+                for node, start in zip(reversed(nodes), reversed(starts)):
+                    if node.is_leaf:
+                        sets[node] = {contents[start]}
+                    else:
+                        node_set = sets[node] = set(sets[node.children[0]])
+                        if not leaves_only:
+                            node_set.add(contents[start])
+                        for child in node.children[1:]:
+                            node_set.update(sets[child])
+                return {node: sets[node] for node in nodes}
+
+            return {node: container_type(contents[start:stops[node]])
+                    for node, start in zip(nodes, starts)}
+        finally:
+            if gc_was_enabled:
+                gc.enable()
 
     def robinson_foulds(self, t2, prop_t1='name', prop_t2='name',
                         unrooted_trees=False, expand_polytomies=False,
@@ -1132,6 +1417,31 @@ cdef class Tree:
            calculated between all tree combinations and the minimum
            value will be returned. See also :func:`Tree.expand_polytomy`.
         """
+        comparison, decode = self._robinson_foulds_splits(
+            t2, prop_t1, prop_t2, unrooted_trees, expand_polytomies,
+            polytomy_size_limit, skip_large_polytomies,
+            correct_by_polytomy_size, min_support_t1, min_support_t2)
+
+        if comparison is None:
+            return None
+
+        rf, max_parts, common, *splits = comparison
+
+        # Edges as tuples of (sorted) values, instead of bitsets.
+        return [rf, max_parts, common] + [{decode(s) for s in edges}
+                                          for edges in splits]
+
+    def _robinson_foulds_splits(self, t2, prop_t1='name', prop_t2='name',
+                                unrooted_trees=False, expand_polytomies=False,
+                                polytomy_size_limit=5, skip_large_polytomies=False,
+                                correct_by_polytomy_size=False, min_support_t1=0.0,
+                                min_support_t2=0.0):
+        """Return the comparison made by robinson_foulds() with bitsets.
+
+        The edges are represented as bitsets of the common values (see
+        ``bipartitions.pyx``). Also return the function that decodes
+        them into tuples of values.
+        """
         # Give aliases for clarity.
         origin_t = self  # reference tree
         target_t = t2
@@ -1188,87 +1498,77 @@ cdef class Tree:
 
             polytomy_correction = max(corr1, corr2)
 
-        def from_common(nodes, prop):  # helper function
-            """Yield values (if existing in both trees) for property prop."""
-            for node in nodes:
-                if has_prop(node, prop):
-                    value = node.get_prop(prop)
-                    if value in common:
-                        yield value
+        bits = bipartitions.get_bits(common)  # bit for each common value
+        all_bits = bipartitions.full(len(bits))  # all the common values
 
-        min_comparison = None
-        for t1 in origin_trees:
-            t1_leaves = t1.get_cached_content()
-            t1_leaves_all = t1_leaves[t1]
-
-            if unrooted_trees:
-                edges1 = {  # set that looks like {((a, b, ...), (x, y, ...)), ...}
-                    tuple(sorted([
-                        tuple(sorted(from_common(leaves, prop_t1))),
-                        tuple(sorted(from_common(t1_leaves_all - leaves, prop_t1)))]))
-                    for leaves in t1_leaves.values()}
-                edges1.discard(((), ()))  # probably unnecessary
-            else:
-                edges1 = {tuple(sorted(from_common(leaves, prop_t1)))
-                          for leaves in t1_leaves.values()}
-                edges1.discard(())
+        def get_splits(tree, prop):
+            """Return dict {split: support} for all the nodes in tree.
 
-            if min_support_t1:
-                support_t1 = {tuple(sorted(from_common(leaves, prop_t1) for n in leaves)): branch.support or 0
-                              for branch, leaves in t1_leaves.items()}
+            Nodes without support are never discarded, so they count as
+            having an infinite one. A split keeps its highest support.
+            """
+            def leaf_bit(leaf):
+                return bits.get(leaf.get_prop(prop), 0) if has_prop(leaf, prop) else 0
 
-            for t2 in target_trees:
-                t2_leaves = t2.get_cached_content()
-                t2_leaves_all = t2_leaves[t2]
+            node_bits = bipartitions.get_node_bits(tree, leaf_bit)
 
+            if unrooted_trees and not all_bits:  # all edges look like ((), ())
+                return {}
+
+            splits = {}
+            for node, b in node_bits.items():
                 if unrooted_trees:
-                    edges2 = {
-                        tuple(sorted([
-                            tuple(sorted(from_common(leaves, prop_t2))),
-                            tuple(sorted(from_common(t2_leaves_all - leaves, prop_t2)))]))
-                        for leaves in t2_leaves.values()}
-                    edges2.discard(((), ()))
-                else:
-                    edges2 = {tuple(sorted(from_common(leaves, prop_t2)))
-                              for leaves in t2_leaves.values()}
-                    edges2.discard(())
-
-                if min_support_t2:
-                    support_t2 = {tuple(sorted(from_common(leaves, prop_t2) for n in leaves)): branch.support or 0
-                                  for branch, leaves in t2_leaves.items()}
-
-                # if a support value is passed as a constraint, discard lowly supported branches from the analysis
-                discard_t1, discard_t2 = set(), set()
-                if min_support_t1 and unrooted_trees:
-                    discard_t1 = {p for p in edges1 if support_t1.get(p[0], support_t1.get(p[1], math.inf)) < min_support_t1}
-                elif min_support_t1:
-                    discard_t1 = {p for p in edges1 if support_t1[p] is not None and support_t1[p] < min_support_t1}
-
-                if min_support_t2 and unrooted_trees:
-                    discard_t2 = {p for p in edges2 if support_t2.get(p[0], support_t2.get(p[1], math.inf)) < min_support_t2}
-                elif min_support_t2:
-                    discard_t2 = {p for p in edges2 if support_t2[p] is not None and support_t2[p] < min_support_t2}
+                    b = bipartitions.canonical(b, all_bits)
+                elif not b:
+                    continue
+
+                support = math.inf if node.support is None else node.support
+                splits[b] = max(support, splits.get(b, support))
+
+            return splits
+
+        def get_discarded(splits, min_support):
+            """Return the splits with a support lower than min_support."""
+            if not min_support:
+                return set()
+            return {s for s, support in splits.items() if support < min_support}
+
+        if unrooted_trees:
+            is_partition = lambda s: (bipartitions.count(s) > 1 and
+                                      bipartitions.count(all_bits ^ s) > 1)
+        else:
+            is_partition = lambda s: bipartitions.count(s) > 1
+
+        min_comparison = None
+        for t1 in origin_trees:
+            splits1 = get_splits(t1, prop_t1)
+            edges1 = set(splits1)
+            discard_t1 = get_discarded(splits1, min_support_t1)
+
+            for t2 in target_trees:
+                splits2 = get_splits(t2, prop_t2)
+                edges2 = set(splits2)
+                discard_t2 = get_discarded(splits2, min_support_t2)
 
                 # the two root edges are never counted here, as they are always
                 # present in both trees because of the common property filters
                 rf = len(((edges1 ^ edges2) - discard_t2) - discard_t1) - polytomy_correction
 
-                if unrooted_trees:
-                    max_parts = (
-                        sum(1 for p in edges1 - discard_t1 if len(p[0]) > 1 and len(p[1]) > 1) +
-                        sum(1 for p in edges2 - discard_t2 if len(p[0]) > 1 and len(p[1]) > 1))
-                else:
-                    # Otherwise we need to count the actual number of valid
-                    # partitions in each tree -2 is to avoid counting the root
-                    # partition of the two trees (only needed in rooted trees)
-                    max_parts = (
-                        sum(1 for p in edges1 - discard_t1 if len(p) > 1) +
-                        sum(1 for p in edges2 - discard_t2 if len(p) > 1)) - 2
+                max_parts = (sum(1 for s in edges1 - discard_t1 if is_partition(s)) +
+                             sum(1 for s in edges2 - discard_t2 if is_partition(s)))
+
+                if not unrooted_trees:
+                    # -2 is to avoid counting the root partition of the two
+                    # trees (only needed in rooted trees)
+                    max_parts -= 2
 
                 if not min_comparison or (min_comparison[0] is not None and min_comparison[0] > rf):
                     min_comparison = [rf, max_parts, common, edges1, edges2, discard_t1, discard_t2]
 
-        return min_comparison
+        decode = bipartitions.decoder(sorted(common),
+                                      all_bits if unrooted_trees else None)
+
+        return min_comparison, decode
 
     def compare(self, ref_tree, use_collateral=False, min_support_source=0.0, min_support_ref=0.0,
                 has_duplications=False, expand_polytomies=False, unrooted=False,
@@ -1290,26 +1590,34 @@ cdef class Tree:
 
         def _compare(src_tree, ref_tree):
             # calculate partitions and rf distances
-            rf, maxrf, common, ref_p, src_p, ref_disc, src_disc  = ref_tree.robinson_foulds(src_tree,
-                                                                                            expand_polytomies=expand_polytomies,
-                                                                                            unrooted_trees=unrooted,
-                                                                                            prop_t1=ref_tree_attr,
-                                                                                            prop_t2=source_tree_attr,
-                                                                                            min_support_t2=min_support_source,
-                                                                                            min_support_t1=min_support_ref)
+            comparison, decode = ref_tree._robinson_foulds_splits(src_tree,
+                                                                  expand_polytomies=expand_polytomies,
+                                                                  unrooted_trees=unrooted,
+                                                                  prop_t1=ref_tree_attr,
+                                                                  prop_t2=source_tree_attr,
+                                                                  min_support_t2=min_support_source,
+                                                                  min_support_t1=min_support_ref)
+            rf, maxrf, common, ref_p, src_p, ref_disc, src_disc = comparison
 
             # if trees share leaves, count their distances
             if len(common) > 0 and src_p and ref_p:
+                count = bipartitions.count
                 if unrooted:
-                    valid_ref_edges = set([p for p in (ref_p - ref_disc) if len(p[0])>1 and len(p[1])>0])
-                    valid_src_edges = set([p for p in (src_p - src_disc) if len(p[0])>1 and len(p[1])>0])
-                    common_edges = valid_ref_edges & valid_src_edges
+                    # Edges (a, b) with len(a) > 1 and len(b) > 0, with a the
+                    # side that has the first value (or empty), as in
+                    # bipartitions.decode_unrooted().
+                    all_bits = bipartitions.full(len(common))
+                    is_valid = lambda s: s != 0 and count(all_bits ^ s) > 1
                 else:
+                    is_valid = lambda s: count(s) > 1
 
-                    valid_ref_edges = set([p for p in (ref_p - ref_disc) if len(p)>1])
-                    valid_src_edges = set([p for p in (src_p - src_disc) if len(p)>1])
-                    common_edges = valid_ref_edges & valid_src_edges
+                valid_ref_edges = {s for s in ref_p - ref_disc if is_valid(s)}
+                valid_src_edges = {s for s in src_p - src_disc if is_valid(s)}
+                common_edges = valid_ref_edges & valid_src_edges
 
+                valid_ref_edges = {decode(s) for s in valid_ref_edges}
+                valid_src_edges = {decode(s) for s in valid_src_edges}
+                common_edges = {decode(s) for s in common_edges}
             else:
                 valid_ref_edges = set()
                 valid_src_edges = set()
@@ -1455,6 +1763,27 @@ cdef class Tree:
         else:
             raise TreeError(f'Unknown output for diff: {output}')
 
+    def map_support(self, trees, prop='support', unrooted=True,
+                    transfer=False, parser=None, processes=None):
+        """Set in prop the support of each branch in the given trees.
+
+        The support of a branch is the fraction of the trees that have
+        it (or its transfer bootstrap expectation, if transfer=True).
+        The trees (like the ones of a bootstrap) are read only once, and
+        they must have the same leaves as this tree.
+
+        :param trees: Iterable of trees, or of newicks.
+        :param prop: Property where the support is set.
+        :param unrooted: If True, treat the trees as unrooted.
+        :param transfer: If True, compute the transfer support (TBE).
+        :param parser: Parser used to read the newicks.
+        :param processes: If given, read the trees (which then have to
+            be newicks) by that number of worker processes (all cpus if 0).
+        """
+        from .consensus import map_support
+
+        map_support(self, trees, prop, unrooted, transfer, parser, processes)
+
     def edges(self, cached_content=None):
         """Yield a pair of sets of leafs for every partition of the tree.
 
@@ -1501,10 +1830,18 @@ cdef class Tree:
         binary or use the tree.unroot() function before generating the
         topology id.
         """
+        # Leaves get bits in the order of their values, so decoding the
+        # bitset of a node gives directly the sorted values of its leaves.
+        get_value = lambda e: e.props.get(prop, getattr(e, prop))
+        leaves = sorted(self.leaves(), key=get_value)
+        bits = bipartitions.get_bits(leaves, sort=False)
+        all_bits = bipartitions.full(len(leaves))
+        values = bipartitions.as_array([get_value(e) for e in leaves])
+
         edge_keys = []
-        for s1, s2 in self.edges():
-            k1 = sorted(e.props.get(prop, getattr(e, prop)) for e in s1)
-            k2 = sorted(e.props.get(prop, getattr(e, prop)) for e in s2)
+        for b in bipartitions.get_node_bits(self, bits.get).values():
+            k1 = list(bipartitions.decode(b, values))
+            k2 = list(bipartitions.decode(all_bits ^ b, values))
 
             edge_keys.append(sorted([k1, k2]))
 
@@ -1645,7 +1982,8 @@ cdef class Tree:
         """
         ops.resolve_polytomy(self, descendants)
 
-    def cophenetic_matrix(self):
+    def cophenetic_matrix(self, topological=False, dtype=np.float64,
+                          condensed=False, out=None):
         """Return a cophenetic distance matrix of the tree.
 
         The `cophenetic matrix
@@ -1673,26 +2011,12 @@ cdef class Tree:
           d(A,E) = d(z,A) + d(z,E)
                  = (d(z,y) + d(y,A)) + (d(z,x) + d(x,w) + d(w,E))
 
-        To compute it, we use an idea from
-        https://gist.github.com/jhcepas/279f9009f46bf675e3a890c19191158b
+        We compute it from the distance of each node to the root::
 
-        First, for each node we find its path to the root. For example::
+          d(A,E) = d(root,A) + d(root,E) - 2 * d(root,z)
 
-          A -> A, y, z
-          E -> E, w, x, z
-
-        and make these orderless sets. Then we XOR the two sets to
-        only find the elements that are in one or other sets but not
-        both. In this case A, E, y, x, w.
-
-        The distance between the two nodes is the sum of the distances
-        from each of those nodes to the parent
-
-        One more optimization: since the distances are symmetric, and
-        distance to itself is zero we user itertools.combinations
-        rather than itertools.permutations. This cuts our computes
-        from theta(n^2) 1/2n^2 - n (= O(n^2), which is still not
-        great, but in reality speeds things up for large trees).
+        where z is the common ancestor of A and E, which we find for
+        all the leaves at once (see ``operations.cophenetic_matrix()``).
 
         For this tree, we will return the two dimensional array::
 
@@ -1706,43 +2030,61 @@ cdef class Tree:
         We will also return the one dimensional array with the leaves
         in the order in which they appear in the matrix (i.e. the
         column and/or row headers).
+
+        :param topological: If True, the distance between leaves is the
+            number of branches between them.
+        :param dtype: Type of the numbers in the returned numpy array
+            (for example, use ``np.float32`` to save memory).
+        :param condensed: If True, return only the upper triangle of the
+            matrix, as a flat array (like scipy's ``pdist()``).
+        :param out: Array where to write the result, for example a
+            memory-mapped file for trees too big for the memory::
+
+              n = len(t)
+              out = np.lib.format.open_memmap('dists.npy', mode='w+',
+                                              dtype=np.float32, shape=(n, n))
+              dists, names = t.cophenetic_matrix(dtype=np.float32, out=out)
         """
-        leaves = list(self.leaves())
-        paths = {x: set() for x in leaves}
+        return ops.cophenetic_matrix(self, topological, dtype, condensed, out)
 
-        # get the paths going up the tree
-        # we get all the nodes up to the last one and store them in a set
+    def get_nodes_array(self, order='preorder'):
+        """Return the nodes of the tree and the positions of their parents.
 
-        for n in leaves:
-            if n.is_root:
-                continue
-            movingnode = n
-            while not movingnode.is_root:
-                paths[n].add(movingnode)
-                movingnode = movingnode.up
+        They are two numpy arrays, in the given traversal order (the
+        one used in ``get_props_array()`` and ``set_props_array()``).
+        The parent of this node appears as -1.
 
-        # now we want to get all pairs of nodes using itertools combinations. We need AB AC etc but don't need BA CA
+        :param order: Traversal strategy, as in ``traverse()``.
+        """
+        return ops.get_nodes_array(self, order)
 
-        leaf_distances = {x.name: {} for x in leaves}
+    def get_props_array(self, prop, order='preorder', default=np.nan,
+                        dtype=np.float64):
+        """Return a numpy array with the values of prop for all the nodes.
 
-        for (leaf1, leaf2) in itertools.combinations(leaves, 2):
-            # figure out the unique nodes in the path
-            uniquenodes = paths[leaf1] ^ paths[leaf2]
-            distance = sum(x.dist for x in uniquenodes)
-            leaf_distances[leaf1.name][leaf2.name] = leaf_distances[leaf2.name][leaf1.name] = distance
+        This allows to work with whole columns of properties, like::
 
-        allleaves = sorted(leaf_distances.keys()) # the leaves in order that we will return
+          dists = t.get_props_array('dist')
+          t.set_props_array('dist', dists / dists.sum())  # normalize
 
-        output = [] # the two dimensional array that we will return
+        :param prop: Name of the property (as in the node's props).
+        :param order: Traversal strategy, as in ``traverse()``.
+        :param default: Value for the nodes without the property.
+        :param dtype: Type of the values in the array (use ``object``
+            for properties that are not numbers).
+        """
+        return ops.get_props_array(self, prop, order, default, dtype)
 
-        for i, n in enumerate(allleaves):
-            output.append([])
-            for m in allleaves:
-                if m == n:
-                    output[i].append(0) # distance to ourself = 0
-                else:
-                    output[i].append(leaf_distances[n][m])
-        return output, allleaves
+    def set_props_array(self, prop, values, order='preorder'):
+        """Set the property prop of all the nodes to the given values.
+
+        A value of nan (or None) removes the property from its node.
+
+        :param prop: Name of the property.
+        :param values: Sequence with a value for each node.
+        :param order: Traversal strategy, as in ``traverse()``.
+        """
+        ops.set_props_array(self, prop, values, order)
 
     @staticmethod
     def from_parent_child_table(parent_child_table):
@@ -2,24 +2,26 @@
 
 import sys
 import os
+import time
 
-import pickle
-from collections import defaultdict, Counter
+from collections import defaultdict
 
 from hashlib import md5
 
 import sqlite3
-import math
 import tarfile
 import warnings
 import requests
 
 from ete4 import ETE_DATA_HOME, update_ete_data
+from ete4.ncbi_taxonomy.fuzzy import NameMatcher, get_matcher, SUFFIX as MATCHER_SUFFIX
+from ete4.ncbi_taxonomy.taxadb import (CHUNK_SIZE, execute_in, load_names,
+                                       load_nodes, iter_taxa, stage)
 
 
 __all__ = ["GTDBTaxa", "is_taxadb_up_to_date"]
 
-DB_VERSION = 2
+DB_VERSION = 3
 DEFAULT_GTDBTAXADB = ETE_DATA_HOME + '/gtdbtaxa.sqlite'
 DEFAULT_GTDBTAXADUMP = ETE_DATA_HOME + '/gtdbdump.tar.gz'
 
@@ -46,6 +48,8 @@ class GTDBTaxa:
     Local transparent connector to the GTDB taxonomy database.
     """
 
+    chunk_size = CHUNK_SIZE  # maximum number of values per query
+
     def __init__(self, dbfile=None, taxdump_file=None, memory=False):
 
         if not dbfile:
@@ -67,6 +71,7 @@ class GTDBTaxa:
         if not os.path.exists(self.dbfile):
             raise ValueError("Cannot open taxonomy database: %s" % self.dbfile)
 
+        self.memory = memory  # keep a copy of the database in memory
         self.db = None
         self._connect()
 
@@ -74,10 +79,7 @@ class GTDBTaxa:
             print('GTDB database format is outdated. Upgrading', file=sys.stderr)
             self.update_taxonomy_database(taxdump_file)
 
-        if memory:
-            filedb = self.db
-            self.db = sqlite3.connect(':memory:')
-            filedb.backup(self.db)
+        self._matcher = None  # index of names for fuzzy searches, when used
 
     def update_taxonomy_database(self, taxdump_file=None):
         """Update the GTDB taxonomy database.
@@ -89,61 +91,60 @@ class GTDBTaxa:
         """
         update_db(self.dbfile, targz_file=taxdump_file)
 
+        if getattr(self, 'db', None) is not None:
+            self._connect()  # to the new database file
+            self._matcher = None
+
     def _connect(self):
         self.db = sqlite3.connect(self.dbfile)
 
+        if self.memory:
+            filedb = self.db
+            self.db = sqlite3.connect(':memory:')
+            filedb.backup(self.db)
+            filedb.close()
+
+    def _execute_in(self, cmd, values):
+        """Yield the rows of cmd for all the values, in chunks."""
+        return execute_in(self.db, cmd, values, self.chunk_size)
+
     def _translate_merged(self, all_taxids):
         conv_all_taxids = set((list(map(int, all_taxids))))
-        cmd = 'select taxid_old, taxid_new FROM merged WHERE taxid_old IN (%s)' %','.join(map(str, all_taxids))
-
-        result = self.db.execute(cmd)
+        result = self._execute_in('select taxid_old, taxid_new FROM merged '
+                                  'WHERE taxid_old IN ({})', conv_all_taxids)
         conversion = {}
-        for old, new in result.fetchall():
+        for old, new in result:
             conv_all_taxids.discard(int(old))
             conv_all_taxids.add(int(new))
             conversion[int(old)] = int(new)
         return conv_all_taxids, conversion
 
 
-    # def get_fuzzy_name_translation(self, name, sim=0.9):
-    #     '''
-    #     Given an inexact species name, returns the best match in the NCBI database of taxa names.
-    #     :argument 0.9 sim: Min word similarity to report a match (from 0 to 1).
-    #     :return: taxid, species-name-match, match-score
-    #     '''
-
-
-    #     import sqlite3.dbapi2 as dbapi2
-    #     _db = dbapi2.connect(self.dbfile)
-    #     _db.enable_load_extension(True)
-    #     module_path = os.path.split(os.path.realpath(__file__))[0]
-    #     _db.execute("select load_extension('%s')" % os.path.join(module_path,
-    #                                                              "SQLite-Levenshtein/levenshtein.sqlext"))
-
-    #     print("Trying fuzzy search for %s" % name)
-    #     maxdiffs = math.ceil(len(name) * (1-sim))
-    #     cmd = 'SELECT taxid, spname, LEVENSHTEIN(spname, "%s") AS sim  FROM species WHERE sim<=%s ORDER BY sim LIMIT 1;' % (name, maxdiffs)
-    #     taxid, spname, score = None, None, len(name)
-    #     result = _db.execute(cmd)
-    #     try:
-    #         taxid, spname, score = result.fetchone()
-    #     except TypeError:
-    #         cmd = 'SELECT taxid, spname, LEVENSHTEIN(spname, "%s") AS sim  FROM synonym WHERE sim<=%s ORDER BY sim LIMIT 1;' % (name, maxdiffs)
-    #         result = _db.execute(cmd)
-    #         try:
-    #             taxid, spname, score = result.fetchone()
-    #         except:
-    #             pass
-    #         else:
-    #             taxid = int(taxid)
-    #     else:
-    #         taxid = int(taxid)
+    def get_fuzzy_name_translation(self, name, sim=0.9):
+        """Return the GTDB name most similar to the given one, and its score.
+
+        :param name: Taxon name (does not need to be exact).
+        :param 0.9 sim: Min word similarity to report a match (from 0 to 1).
+        :return: (name, score), or (None, 0.0) if there is no match.
+        """
+        matches = self.get_fuzzy_name_translator([name], k=1, sim=sim)
+        return matches[name][0] if matches else (None, 0.0)
+
+    def get_fuzzy_name_translator(self, names, k=1, sim=0.9):
+        """Return dict with the GTDB names most similar to the given names.
 
-    #     norm_score = 1 - (float(score)/len(name))
-    #     if taxid:
-    #         print("FOUND!    %s taxid:%s score:%s (%s)" %(spname, taxid, score, norm_score))
+        For each name found, it has a list of its (up to) k best matches
+        as (name, score), where the score is the word similarity (from 0
+        to 1, at least `sim`).
+        """
+        name2matches = self._get_matcher().search_many(names, k, sim)
+        return {name: [(match, score) for _, match, score in matches]
+                for name, matches in name2matches.items() if matches}
 
-    #     return taxid, spname, norm_score
+    def _get_matcher(self):
+        if self._matcher is None:
+            self._matcher = get_matcher(self.dbfile, self.db)
+        return self._matcher
 
     def _get_id2rank(self, internal_taxids):
         """Given a list of numeric ids (each one representing a taxa in GTDB), return a dictionary with their corresponding ranks.
@@ -153,9 +154,9 @@ class GTDBTaxa:
 
         Note: Numeric taxids are not recognized by the official GTDB taxonomy database, only for internal usage.
         """
-        ids = ','.join('"%s"' % v for v in set(internal_taxids) - {None, ''})
-        result = self.db.execute('SELECT taxid, rank FROM species WHERE taxid IN (%s)' % ids)
-        return {tax: spname for tax, spname in result.fetchall()}
+        result = self._execute_in('SELECT taxid, rank FROM species WHERE taxid IN ({})',
+                                  set(internal_taxids) - {None, ''})
+        return {tax: spname for tax, spname in result}
 
     def get_rank(self, taxids):
         """Give a list of GTDB string taxids, return a dictionary with their corresponding ranks.
@@ -169,10 +170,10 @@ class GTDBTaxa:
         name2ids = self._get_name_translator(taxids)
         overlap_ids = name2ids.values()
         taxids = [item for sublist in overlap_ids for item in sublist]
-        ids = ','.join('"%s"' % v for v in set(taxids) - {None, ''})
-        result = self.db.execute('SELECT taxid, rank FROM species WHERE taxid IN (%s)' % ids)
-        for tax, rank in result.fetchall():
-            taxid2rank[list(self._get_taxid_translator([tax]).values())[0]] = rank
+        id2rank = self._get_id2rank(taxids)
+        id2name = self._get_taxid_translator(id2rank)
+        for tax, rank in id2rank.items():
+            taxid2rank[id2name[tax]] = rank
 
         return taxid2rank
 
@@ -183,10 +184,10 @@ class GTDBTaxa:
         all_ids = set(taxids)
         all_ids.discard(None)
         all_ids.discard("")
-        query = ','.join(['"%s"' %v for v in all_ids])
-        result = self.db.execute('SELECT taxid, track FROM species WHERE taxid IN (%s);' %query)
+        result = self._execute_in('SELECT taxid, track FROM species WHERE taxid IN ({})',
+                                  all_ids)
         id2lineages = {}
-        for tax, track in result.fetchall():
+        for tax, track in result:
             id2lineages[tax] = list(map(int, reversed(track.split(","))))
         return id2lineages
 
@@ -210,13 +211,14 @@ class GTDBTaxa:
         if not taxid:
             return None
         taxid = int(taxid)
-        result = self.db.execute('SELECT track FROM species WHERE taxid=%s' %taxid)
+        result = self.db.execute('SELECT track FROM species WHERE taxid=?', (taxid,))
         raw_track = result.fetchone()
         if not raw_track:
             #perhaps is an obsolete taxid
             _, merged_conversion = self._translate_merged([taxid])
             if taxid in merged_conversion:
-                result = self.db.execute('SELECT track FROM species WHERE taxid=%s' %merged_conversion[taxid])
+                result = self.db.execute('SELECT track FROM species WHERE taxid=?',
+                                         (merged_conversion[taxid],))
                 raw_track = result.fetchone()
             # if not raise error
             if not raw_track:
@@ -229,11 +231,10 @@ class GTDBTaxa:
         return list(reversed(track))
 
     def get_common_names(self, taxids):
-        query = ','.join(['"%s"' %v for v in taxids])
-        cmd = "select taxid, common FROM species WHERE taxid IN (%s);" %query
-        result = self.db.execute(cmd)
+        result = self._execute_in('select taxid, common FROM species WHERE taxid IN ({})',
+                                  set(taxids))
         id2name = {}
-        for tax, common_name in result.fetchall():
+        for tax, common_name in result:
             if common_name:
                 id2name[tax] = common_name
         return id2name
@@ -246,11 +247,10 @@ class GTDBTaxa:
         all_ids = set(map(int, taxids))
         all_ids.discard(None)
         all_ids.discard("")
-        query = ','.join(['"%s"' %v for v in all_ids])
-        cmd = "select taxid, spname FROM species WHERE taxid IN (%s);" %query
-        result = self.db.execute(cmd)
+        result = self._execute_in('select taxid, spname FROM species WHERE taxid IN ({})',
+                                  all_ids)
         id2name = {}
-        for tax, spname in result.fetchall():
+        for tax, spname in result:
             id2name[tax] = spname
 
         # any taxid without translation? lets tray in the merged table
@@ -282,18 +282,17 @@ class GTDBTaxa:
 
         names = set(name2origname.keys())
 
-        query = ','.join(['"%s"' %n for n in name2origname.keys()])
-        cmd = 'select spname, taxid from species where spname IN (%s)' %query
-        result = self.db.execute('select spname, taxid from species where spname IN (%s)' %query)
-        for sp, taxid in result.fetchall():
+        result = self._execute_in('select spname, taxid from species where spname IN ({})',
+                                  names)
+        for sp, taxid in result:
             oname = name2origname[sp.lower()]
             name2id.setdefault(oname, []).append(taxid)
             #name2realname[oname] = sp
         missing =  names - set([n.lower() for n in name2id.keys()])
         if missing:
-            query = ','.join(['"%s"' %n for n in missing])
-            result = self.db.execute('select spname, taxid from synonym where spname IN (%s)' %query)
-            for sp, taxid in result.fetchall():
+            result = self._execute_in('select spname, taxid from synonym where spname IN ({})',
+                                      missing)
+            for sp, taxid in result:
                 oname = name2origname[sp.lower()]
                 name2id.setdefault(oname, []).append(taxid)
                 #name2realname[oname] = sp
@@ -310,40 +309,52 @@ class GTDBTaxa:
         return names
 
 
-    def get_descendant_taxa(self, parent, intermediate_nodes=False, rank_limit=None, collapse_subspecies=False, return_tree=False):
-        """
-        given a parent taxid or scientific species name, returns a list of all its descendants taxids.
-        If intermediate_nodes is set to True, internal nodes will also be dumped.
-        """
+    def _get_taxid(self, taxon):
+        """Return the internal taxid of taxon, given as taxid or name."""
         try:
-            taxid = int(parent)
+            taxid = int(taxon)
         except ValueError:
             try:
-                taxid = self._get_name_translator([parent])[parent][0]
+                taxid = self._get_name_translator([taxon])[taxon][0]
             except KeyError:
-                raise ValueError('%s not found!' %parent)
+                raise ValueError('%s not found!' %taxon)
 
         # checks if taxid is a deprecated one, and converts into the right one.
         _, conversion = self._translate_merged([taxid]) #try to find taxid in synonyms table
         if conversion:
             taxid = conversion[taxid]
 
-        with open(self.dbfile+".traverse.pkl", "rb") as CACHED_TRAVERSE:
-            prepostorder = pickle.load(CACHED_TRAVERSE)
-        descendants = {}
-        found = 0
-        for tid in prepostorder:
-            if tid == taxid:
-                found += 1
-            elif found == 1:
-                descendants[tid] = descendants.get(tid, 0) + 1
-            elif found == 2:
-                break
-
-        if not found:
+        return taxid
+
+    def _get_interval(self, taxid):
+        """Return the preorder positions of taxid and of its last descendant.
+
+        All its descendants are in between (a nested-set interval).
+        """
+        result = self.db.execute('SELECT entry, exit FROM species WHERE taxid=?',
+                                 (taxid,)).fetchone()
+        if result is None:
             raise ValueError("taxid not found:%s" %taxid)
-        elif found == 1:
+
+        return result
+
+    def get_descendant_taxa(self, parent, intermediate_nodes=False, rank_limit=None, collapse_subspecies=False, return_tree=False):
+        """
+        given a parent taxid or scientific species name, returns a list of all its descendants taxids.
+        If intermediate_nodes is set to True, internal nodes will also be dumped.
+        """
+        taxid = self._get_taxid(parent)
+
+        entry, exit = self._get_interval(taxid)
+        if entry == exit:
             return [taxid]
+
+        result = self.db.execute('SELECT taxid, entry, exit FROM species '
+                                 'WHERE entry > ? AND entry <= ? ORDER BY entry',
+                                 (entry, exit))
+        descendants = {tid: (1 if tentry == texit else 2)  # times in traversal
+                       for tid, tentry, texit in result.fetchall()}
+
         if rank_limit or collapse_subspecies or return_tree:
             descendants_spnames = self._get_taxid_translator(list(descendants.keys()))
             #tree = self.get_topology(list(descendants.keys()), intermediate_nodes=intermediate_nodes, collapse_subspecies=collapse_subspecies, rank_limit=rank_limit)
@@ -361,6 +372,29 @@ class GTDBTaxa:
             self._translate_to_names([tid for tid, count in descendants.items() if count == 1])
             return self._translate_to_names([tid for tid, count in descendants.items() if count == 1])
 
+    def count_descendant_taxa(self, parent, intermediate_nodes=False):
+        """Return the number of descendant taxa of the given parent.
+
+        It is len(get_descendant_taxa(parent, intermediate_nodes)), but
+        without having to read them all.
+        """
+        entry, exit = self._get_interval(self._get_taxid(parent))
+
+        if entry == exit:
+            return 1
+        elif intermediate_nodes:
+            return exit - entry
+        else:
+            return self.db.execute('SELECT count(*) FROM species '
+                                   'WHERE entry > ? AND entry <= ? AND entry = exit',
+                                   (entry, exit)).fetchone()[0]
+
+    def is_ancestor(self, ancestor, taxon):
+        """Return True if ancestor is an ancestor of taxon (names or taxids)."""
+        entry, exit = self._get_interval(self._get_taxid(ancestor))
+        taxon_entry, _ = self._get_interval(self._get_taxid(taxon))
+        return entry < taxon_entry <= exit
+
     def get_topology(self, taxnames, intermediate_nodes=False, rank_limit=None,
                      collapse_subspecies=False, annotate=True):
         """Return minimal pruned GTDB taxonomy tree containing all given taxids.
@@ -384,35 +418,17 @@ class GTDBTaxa:
 
         if len(taxids) == 1:
             root_taxid = int(list(taxids)[0])
-            with open(self.dbfile+".traverse.pkl", "rb") as CACHED_TRAVERSE:
-                prepostorder = pickle.load(CACHED_TRAVERSE)
-            descendants = {}
-            found = 0
-            nodes = {}
-            hit = 0
-            visited = set()
-            start = prepostorder.index(root_taxid)
-            try:
-            	end = prepostorder.index(root_taxid, start+1)
-            	subtree = prepostorder[start:end+1]
-            except ValueError:
-                # If root taxid is not found in postorder, must be a tip node
-            	subtree = [root_taxid]
-            leaves = set([v for v, count in Counter(subtree).items() if count == 1])
-            tax2name = self._get_taxid_translator(list(subtree))
+            entry, exit = self._get_interval(root_taxid)
+            result = self.db.execute('SELECT taxid, parent FROM species '
+                                     'WHERE entry >= ? AND entry <= ? ORDER BY entry',
+                                     (entry, exit))
+            subtree = result.fetchall()  # in preorder, starting with root_taxid
+            tax2name = self._get_taxid_translator([tid for tid, _ in subtree])
             name2tax ={spname:taxid for taxid,spname in tax2name.items()}
-            nodes[root_taxid] = PhyloTree({'name': str(root_taxid)})
-            current_parent = nodes[root_taxid]
-            for tid in subtree:
-                if tid in visited:
-                    current_parent = nodes[tid].up
-                else:
-                    visited.add(tid)
-                    nodes[tid] = PhyloTree({'name': tax2name.get(tid, '')})
-                    current_parent.add_child(nodes[tid])
-                    if tid not in leaves:
-                        current_parent = nodes[tid]
-            root = nodes[root_taxid]
+            root = PhyloTree({'name': tax2name.get(root_taxid, '')})
+            nodes = {root_taxid: root}
+            for tid, parent in subtree[1:]:
+                nodes[tid] = nodes[parent].add_child(name=tax2name.get(tid, ''))
         else:
             taxids = set(map(int, taxids))
             sp2track = {}
@@ -689,92 +705,6 @@ class GTDBTaxa:
     #     return self.annotate_tree(t, tax2name, tax2track, attr_name="taxid")
 
 
-def load_gtdb_tree_from_dump(tar):
-    from .. import Tree
-    # Download: gtdbdump/gtdbr202dump.tar.z
-    parent2child = {}
-    name2node = {}
-    node2taxname = {}
-    synonyms = set()
-    name2rank = {}
-    node2common = {}
-    print("Loading node names...")
-    unique_nocase_synonyms = set()
-    for line in tar.extractfile("names.dmp"):
-        line = str(line.decode())
-        fields =  [_f.strip() for _f in line.split("|")]
-        nodename = fields[0]
-        name_type = fields[3].lower()
-        taxname = fields[1]
-
-        # Clean up tax names so we make sure the don't include quotes. See https://github.com/etetoolkit/ete/issues/469
-        taxname = taxname.rstrip('"').lstrip('"')
-
-        if name_type == "scientific name":
-            node2taxname[nodename] = taxname
-        if name_type == "genbank common name":
-            node2common[nodename] = taxname
-        elif name_type in set(["synonym", "equivalent name", "genbank equivalent name",
-                               "anamorph", "genbank synonym", "genbank anamorph", "teleomorph"]):
-
-            # Keep track synonyms, but ignore duplicate case-insensitive names. See https://github.com/etetoolkit/ete/issues/469
-            synonym_key = (nodename, taxname.lower())
-            if synonym_key not in unique_nocase_synonyms:
-                unique_nocase_synonyms.add(synonym_key)
-                synonyms.add((nodename, taxname))
-
-    print(len(node2taxname), "names loaded.")
-    print(len(synonyms), "synonyms loaded.")
-
-    print("Loading nodes...")
-    for line in tar.extractfile("nodes.dmp"):
-        line = str(line.decode())
-        fields =  line.split("|")
-        nodename = fields[0].strip()
-        parentname = fields[1].strip()
-        try:
-            n = Tree()
-        except:
-            from .. import Tree
-            n = Tree()
-        n.name = nodename
-        #n.taxname = node2taxname[nodename]
-        n.add_prop('taxname', node2taxname[nodename])
-        if nodename in node2common:
-            n.add_prop('common_name', node2taxname[nodename])
-        n.add_prop('rank', fields[2].strip())
-        parent2child[nodename] = parentname
-        name2node[nodename] = n
-    print(len(name2node), "nodes loaded.")
-
-    print("Linking nodes...")
-    for node in name2node:
-       if node == "1":
-           t = name2node[node]
-       else:
-           parent = parent2child[node]
-           parent_node = name2node[parent]
-           parent_node.add_child(name2node[node])
-    print("Tree is loaded.")
-    return t, synonyms
-
-def generate_table(t):
-    OUT = open("taxa.tab", "w")
-    for j, n in enumerate(t.traverse()):
-        if j%1000 == 0:
-            print("\r",j,"generating entries...", end=' ')
-        temp_node = n
-        track = []
-        while temp_node:
-            track.append(temp_node.name)
-            temp_node = temp_node.up
-        if n.up:
-            print('\t'.join([n.name, n.up.name, n.props.get('taxname'), n.props.get("common_name", ''), n.props.get("rank"), ','.join(track)]), file=OUT)
-        else:
-            print('\t'.join([n.name, "", n.props.get('taxname'), n.props.get("common_name", ''), n.props.get("rank"), ','.join(track)]), file=OUT)
-    OUT.close()
-
-
 def update_db(dbfile, targz_file=None):
     basepath = os.path.split(dbfile)[0]
     if basepath and not os.path.exists(basepath):
@@ -785,20 +715,13 @@ def update_db(dbfile, targz_file=None):
         update_local_taxdump(DEFAULT_GTDBTAXADUMP)
         targz_file = DEFAULT_GTDBTAXADUMP
 
-    tar = tarfile.open(targz_file, 'r')
-    t, synonyms = load_gtdb_tree_from_dump(tar)
-
-    prepostorder = [int(node.name) for post, node in t.iter_prepostorder()]
-
-    with open(dbfile+'.traverse.pkl', 'wb') as fout:
-        pickle.dump(prepostorder, fout, 2)
-
     print("Updating database: %s ..." %dbfile)
-    generate_table(t)
+    t0 = time.perf_counter()
 
-    upload_data(dbfile)
+    with tarfile.open(targz_file, 'r') as tar:
+        upload_data(dbfile, tar)
 
-    os.system("rm taxa.tab")
+    print(f'Database updated in {time.perf_counter() - t0:.1f} s.')
 
 def update_local_taxdump(fname=DEFAULT_GTDBTAXADUMP):
     # latest version of gtdb taxonomy dump
@@ -819,62 +742,58 @@ def update_local_taxdump(fname=DEFAULT_GTDBTAXADUMP):
         else:
             print(f'File {fname} is already up-to-date with {url} .')
 
-def upload_data(dbfile):
-    print()
-    print('Uploading to', dbfile)
-    basepath = os.path.split(dbfile)[0]
-    if basepath and not os.path.exists(basepath):
-        os.mkdir(basepath)
+def upload_data(dbfile, tar):
+    """Create the database dbfile with the taxonomy dump in tar.
 
-    db = sqlite3.connect(dbfile)
+    It is built in a temporary file (without journal or syncing to disk,
+    which makes the inserts much faster) that replaces dbfile at the end.
+    """
+    tmpfile = dbfile + '.tmp'
+    if os.path.exists(tmpfile):
+        os.remove(tmpfile)
+
+    db = sqlite3.connect(tmpfile)
+    db.execute('PRAGMA journal_mode = OFF')
+    db.execute('PRAGMA synchronous = OFF')
 
-    create_cmd = """
-    DROP TABLE IF EXISTS stats;
-    DROP TABLE IF EXISTS species;
-    DROP TABLE IF EXISTS synonym;
-    DROP TABLE IF EXISTS merged;
+    db.executescript("""
     CREATE TABLE stats (version INT PRIMARY KEY);
-    CREATE TABLE species (taxid INT PRIMARY KEY, parent INT, spname VARCHAR(50) COLLATE NOCASE, common VARCHAR(50) COLLATE NOCASE, rank VARCHAR(50), track TEXT);
+    CREATE TABLE species (taxid INT PRIMARY KEY, parent INT, spname VARCHAR(50) COLLATE NOCASE, common VARCHAR(50) COLLATE NOCASE, rank VARCHAR(50), track TEXT, entry INT, exit INT);
     CREATE TABLE synonym (taxid INT,spname VARCHAR(50) COLLATE NOCASE, PRIMARY KEY (spname, taxid));
     CREATE TABLE merged (taxid_old INT, taxid_new INT);
-    CREATE INDEX spname1 ON species (spname COLLATE NOCASE);
-    CREATE INDEX spname2 ON synonym (spname COLLATE NOCASE);
-    """
-    for cmd in create_cmd.split(';'):
-        db.execute(cmd)
-    print()
+    """)
 
-    db.execute("INSERT INTO stats (version) VALUES (%d);" %DB_VERSION)
-    db.commit()
+    db.execute('INSERT INTO stats (version) VALUES (?)', (DB_VERSION,))
+
+    with stage('Loading names'):
+        taxid2name, taxid2common, _ = load_names(tar, with_synonyms=False)
+
+    with stage('Loading nodes'):
+        parents, ranks = load_nodes(tar)
+
+    with stage('Inserting taxids'):
+        db.executemany('INSERT INTO species (taxid, parent, spname, common, rank, track, entry, exit) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       iter_taxa(parents, ranks, taxid2name, taxid2common))
+
+    with stage('Creating indices'):
+        db.executescript("""
+        CREATE INDEX spname1 ON species (spname COLLATE NOCASE);
+        CREATE INDEX spname2 ON synonym (spname COLLATE NOCASE);
+        CREATE INDEX entry ON species (entry);
+        CREATE INDEX merged1 ON merged (taxid_old);
+        """)
 
-    # for i, line in enumerate(open("syn.tab")):
-    #     if i%5000 == 0 :
-    #         print('\rInserting synonyms:     % 6d' %i, end=' ', file=sys.stderr)
-    #         sys.stderr.flush()
-    #     taxid, spname = line.strip('\n').split('\t')
-    #     db.execute("INSERT INTO synonym (taxid, spname) VALUES (?, ?);", (taxid, spname))
-    # print()
-    # db.commit()
-    # for i, line in enumerate(open("merged.tab")):
-    #     if i%5000 == 0 :
-    #         print('\rInserting taxid merges: % 6d' %i, end=' ', file=sys.stderr)
-    #         sys.stderr.flush()
-    #     taxid_old, taxid_new = line.strip('\n').split('\t')
-    #     db.execute("INSERT INTO merged (taxid_old, taxid_new) VALUES (?, ?);", (taxid_old, taxid_new))
-    # print()
-    # db.commit()
-
-    with open('taxa.tab') as f_taxa:
-        for i, line in enumerate(f_taxa):
-            if i % 5000 == 0:
-                print('\rInserting taxids: %8d' % i, end=' ', file=sys.stderr)
-                sys.stderr.flush()
-            taxid, parentid, spname, common, rank, lineage = line.strip('\n').split('\t')
-            db.execute(('INSERT INTO species          (taxid, parent, spname, common, rank, track) '
-                        'VALUES (?, ?, ?, ?, ?, ?)'), (taxid, parentid, spname, common, rank, lineage))
-    print()
     db.commit()
 
+    with stage('Indexing names for fuzzy searches'):
+        matcher = NameMatcher.from_db(db)
+
+    db.close()
+
+    os.replace(tmpfile, dbfile)
+    matcher.save(dbfile + MATCHER_SUFFIX)  # after the database, so it is newer
+
 if __name__ == "__main__":
     #from .. import PhyloTree
     gtdb = GTDBTaxa()
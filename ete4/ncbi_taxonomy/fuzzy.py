@@ -0,0 +1,291 @@
+"""
+Fuzzy matching of taxa names, with an index of their trigrams.
+
+For every trigram (3 consecutive bytes of a lowercase name padded with
+spaces), the index has the sorted list of the names that contain it.
+To search a name, the names that share most of its (least common)
+trigrams are taken as candidates, and their edit distance to the name
+gives their score.
+
+The index is made when the taxonomy database is built, and saved in
+numpy arrays next to it.
+"""
+
+import os
+
+import numpy as np
+
+
+SUFFIX = '.names.npz'  # of the file with the index, after the database's name
+
+
+class NameMatcher:
+    """Index of taxa names, to find the most similar ones to a given name."""
+
+    def __init__(self, text, offsets, taxids, nspecies, grams, starts, postings):
+        self.text = text  # utf-8 bytes of all the names together
+        self.offsets = offsets  # where each name starts in text
+        self.taxids = taxids  # taxid of each name
+        self.nspecies = nspecies  # the first ones are scientific names
+        self.grams = grams  # sorted trigrams (3 bytes as an int)
+        self.starts = starts  # where the names with each trigram start
+        self.postings = postings  # positions of the names, for all trigrams
+
+    @classmethod
+    def from_names(cls, names, taxids, nspecies=None, chunk_size=100000):
+        """Return the index of the given names, which correspond to taxids.
+
+        The first nspecies names are the scientific ones (all by default),
+        which come before the synonyms when they are equally similar.
+        """
+        encoded = [name.encode() for name in names]
+        text = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        offsets = np.cumsum([0] + [len(x) for x in encoded], dtype=np.int64)
+        del encoded
+
+        padded = [b' ' + name.lower().encode() + b' ' for name in names]
+        grams, starts, postings = index_trigrams(padded, chunk_size)
+
+        return cls(text, offsets, np.array(taxids, dtype=np.int64),
+                   len(names) if nspecies is None else nspecies,
+                   grams, starts, postings)
+
+    @classmethod
+    def from_db(cls, db):
+        """Return the index of the names in the taxonomy database db."""
+        species = db.execute('SELECT taxid, spname FROM species').fetchall()
+        synonyms = db.execute('SELECT taxid, spname FROM synonym').fetchall()
+        taxids, names = zip(*(species + synonyms)) if species else ((), ())
+        return cls.from_names(names, taxids, len(species))
+
+    @classmethod
+    def load(cls, fname):
+        """Return the index saved in file fname."""
+        with np.load(fname) as arrays:
+            return cls(arrays['text'], arrays['offsets'], arrays['taxids'],
+                       int(arrays['nspecies']), arrays['grams'],
+                       arrays['starts'], arrays['postings'])
+
+    def save(self, fname):
+        """Save the index in file fname (which should end in .npz)."""
+        np.savez(fname, text=self.text, offsets=self.offsets,
+                 taxids=self.taxids, nspecies=self.nspecies, grams=self.grams,
+                 starts=self.starts, postings=self.postings)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def name(self, i):
+        """Return the name at position i."""
+        return self.text[self.offsets[i]:self.offsets[i+1]].tobytes().decode()
+
+    def search(self, name, k=10, sim=0, candidates=100, max_postings=200000):
+        """Return list of (taxid, name, score) with the most similar names.
+
+        The score is 1 - (edit distance) / (length of name), or 0 if that
+        is negative, and only the k best with a score >= sim are returned.
+
+        :param name: Name to search (not case-sensitive).
+        :param k: Maximum number of results.
+        :param sim: Minimum score of the results (from 0 to 1).
+        :param candidates: Number of names to compute the distance to.
+        :param max_postings: Approximate maximum number of occurrences
+            of trigrams to consider (the least common ones are used).
+        """
+        query = name.lower()
+        if not query:
+            return []
+
+        positions = self.get_candidates(query, candidates, max_postings)
+
+        peq = get_peq(query)
+        results = []
+        for i in positions:
+            match = self.name(i)
+            dist = levenshtein_peq(peq, len(query), match.lower())
+            score = max(0, 1 - dist / len(query))
+            if score >= sim:
+                results.append((dist, i, match, score))
+
+        results.sort()  # most similar first (and scientific names first)
+
+        return [(int(self.taxids[i]), match, score)
+                for dist, i, match, score in results[:k]]
+
+    def search_many(self, names, k=10, sim=0, **kwargs):
+        """Return dict name -> list of (taxid, name, score) for all names."""
+        return {name: self.search(name, k, sim, **kwargs) for name in names}
+
+    def get_candidates(self, query, n, max_postings):
+        """Return positions of the (up to) n names with most trigrams of query.
+
+        Only the least common trigrams are used, until their number of
+        occurrences reaches max_postings.
+        """
+        codes = np.array(sorted(get_trigrams(b' ' + query.encode() + b' ')),
+                         dtype=np.int32)
+
+        js = np.searchsorted(self.grams, codes)
+        found = js < len(self.grams)
+        found[found] = self.grams[js[found]] == codes[found]
+        js = js[found]
+
+        sizes = self.starts[js + 1] - self.starts[js]
+        order = np.argsort(sizes, kind='stable')  # least common first
+
+        lists = []
+        total = 0
+        for j, size in zip(js[order], sizes[order]):
+            if lists and total + size > max_postings:
+                break
+            lists.append(self.postings[self.starts[j]:self.starts[j+1]])
+            total += size
+
+        if not lists:
+            return []
+
+        positions, counts = np.unique(np.concatenate(lists), return_counts=True)
+
+        if len(positions) > n:
+            best = np.argpartition(-counts, n - 1)[:n]
+            positions = positions[best]
+
+        return positions.tolist()
+
+
+def get_matcher(dbfile, db):
+    """Return the NameMatcher saved next to dbfile, or build it from db.
+
+    If it has to be built (because it was missing or is older than the
+    database), it is also saved for the next time, if possible.
+    """
+    fname = dbfile + SUFFIX
+
+    if (os.path.exists(fname) and
+        os.path.getmtime(fname) >= os.path.getmtime(dbfile)):
+        return NameMatcher.load(fname)
+
+    matcher = NameMatcher.from_db(db)
+
+    try:
+        matcher.save(fname)
+    except OSError:
+        pass  # we can use it anyway
+
+    return matcher
+
+
+def get_trigrams(padded):
+    """Return set of the trigrams of the given bytes, as integers."""
+    return {(padded[i] << 16) | (padded[i+1] << 8) | padded[i+2]
+            for i in range(len(padded) - 2)}
+
+
+def get_name_trigrams(padded, first=0):
+    """Return arrays (codes, ids) with the trigrams of the padded names.
+
+    For each trigram in each name (once per name), codes has the trigram
+    and ids the position of the name (counting from first), sorted by id.
+    """
+    lengths = np.array([len(x) for x in padded], dtype=np.int64)
+    text = np.frombuffer(b''.join(padded), dtype=np.uint8).astype(np.int64)
+    ids = np.repeat(np.arange(first, first + len(padded)), lengths)
+
+    codes = (text[:-2] << 16) | (text[1:-1] << 8) | text[2:]
+    inside = ids[:-2] == ids[2:]  # trigrams that do not span two names
+
+    pairs = np.sort((ids[:-2][inside] << 24) | codes[inside])
+    pairs = pairs[np.append(True, pairs[1:] != pairs[:-1])]  # unique
+
+    return (pairs & 0xffffff).astype(np.int32), (pairs >> 24).astype(np.int32)
+
+
+def index_trigrams(padded, chunk_size=100000):
+    """Return arrays grams, starts, postings with the trigrams of the names.
+
+    The names with trigram grams[j] are postings[starts[j]:starts[j+1]].
+    The names are read in chunks twice (first to count the trigrams and
+    then to place them), which takes much less memory than sorting them
+    all at once.
+    """
+    chunks = range(0, len(padded), chunk_size)
+
+    grams = np.empty(0, dtype=np.int32)  # trigrams seen so far
+    counts = np.empty(0, dtype=np.int64)  # number of names with each of them
+    for first in chunks:
+        codes, _ = get_name_trigrams(padded[first:first+chunk_size], first)
+        grams, counts = merge_counts(grams, counts, *count_unique(codes))
+
+    starts = np.append(0, np.cumsum(counts))
+
+    postings = np.empty(starts[-1], dtype=np.int32)
+    filled = starts[:-1].copy()  # next place to fill for each trigram
+    for first in chunks:
+        codes, ids = get_name_trigrams(padded[first:first+chunk_size], first)
+        js = np.searchsorted(grams, codes)
+        order = np.argsort(js, kind='stable')  # keeps ids sorted
+        js, ids = js[order], ids[order]
+        rank = np.arange(len(js)) - np.searchsorted(js, js)
+        postings[filled[js] + rank] = ids
+        filled += np.bincount(js, minlength=len(grams))
+
+    return grams, starts, postings
+
+
+def count_unique(values):
+    """Return arrays with the sorted unique values and how many times they are."""
+    values = np.sort(values)
+    firsts = np.flatnonzero(np.diff(values, prepend=-1))  # values are >= 0
+    return values[firsts], np.diff(firsts, append=len(values))
+
+
+def merge_counts(values1, counts1, values2, counts2):
+    """Return arrays with the sorted unique values of both, and their counts."""
+    values = np.append(values1, values2)
+    order = np.argsort(values, kind='stable')
+    values, counts = values[order], np.append(counts1, counts2)[order]
+    firsts = np.flatnonzero(np.diff(values, prepend=-1))
+    return values[firsts], np.add.reduceat(counts, firsts)
+
+
+def get_peq(pattern):
+    """Return dict with the bitmask of the positions of each char in pattern."""
+    peq = {}
+    for i, c in enumerate(pattern):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    return peq
+
+
+def levenshtein_peq(peq, m, text):
+    """Return the edit distance between a pattern and text.
+
+    The pattern (of length m) is given by its bitmasks peq (from
+    get_peq()). It uses Myers' bit-parallel algorithm, which for short
+    strings like names takes about one step per character of text.
+    """
+    if m == 0:
+        return len(text)
+
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    for c in text:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+    return score
+
+
+def levenshtein(a, b):
+    """Return the edit distance between strings a and b."""
+    return levenshtein_peq(get_peq(a), len(a), b)
@@ -2,22 +2,25 @@
 
 import sys
 import os
-import pickle
-from collections import defaultdict, Counter
+import time
+from collections import defaultdict
 import requests
 from hashlib import md5
 
 import sqlite3
-import math
 import tarfile
 import warnings
 
 from ete4 import ETE_DATA_HOME, update_ete_data
+from .taxarrays import TaxaArrays
+from .fuzzy import NameMatcher, get_matcher, SUFFIX as MATCHER_SUFFIX
+from .taxadb import (CHUNK_SIZE, execute_in, read_dump, load_names,
+                     load_nodes, iter_taxa, stage)
 
 
 __all__ = ["NCBITaxa", "is_taxadb_up_to_date"]
 
-DB_VERSION = 2
+DB_VERSION = 3
 DEFAULT_TAXADB = ETE_DATA_HOME + '/taxa.sqlite'
 DEFAULT_TAXDUMP = ETE_DATA_HOME + '/taxdump.tar.gz'
 
@@ -44,13 +47,20 @@ class NCBITaxa:
     A local transparent connector to the NCBI taxonomy database.
     """
 
+    chunk_size = CHUNK_SIZE  # maximum number of values per query
+
     def __init__(self, dbfile=None, taxdump_file=None,
-                 memory=False, update=True):
+                 memory=False, update=True, preload=False):
         """Open and keep a connection to the NCBI taxonomy database.
 
         If it is not present in the system, it will download the
         database from the NCBI site first, and convert it to ete's
         format.
+
+        If preload=True, all the taxa are loaded in memory (in compact
+        arrays, which forked worker processes can share), and the queries
+        are answered from there instead of from the database. It takes a
+        few seconds at the start, but then the queries are much faster.
         """
         self.dbfile = dbfile or DEFAULT_TAXADB
 
@@ -65,6 +75,7 @@ class NCBITaxa:
         if not os.path.exists(self.dbfile):
             raise ValueError("Cannot open taxonomy database: %s" % self.dbfile)
 
+        self.memory = memory  # keep a copy of the database in memory
         self.db = None
         self._connect()
 
@@ -73,10 +84,8 @@ class NCBITaxa:
                   file=sys.stderr)
             self.update_taxonomy_database(taxdump_file)
 
-        if memory:
-            filedb = self.db
-            self.db = sqlite3.connect(':memory:')
-            filedb.backup(self.db)
+        self._taxa = TaxaArrays(self.db) if preload else None
+        self._matcher = None  # index of names for fuzzy searches, when used
 
     def update_taxonomy_database(self, taxdump_file=None):
         """Update the ncbi taxonomy database.
@@ -89,20 +98,37 @@ class NCBITaxa:
         """
         update_db(self.dbfile, taxdump_file)
 
+        if getattr(self, 'db', None) is not None:
+            self._connect()  # to the new database file
+            if getattr(self, '_taxa', None) is not None:
+                self._taxa = TaxaArrays(self.db)  # with the new data
+            self._matcher = None
+
     def _connect(self):
         self.db = sqlite3.connect(self.dbfile)
 
+        if self.memory:
+            filedb = self.db
+            self.db = sqlite3.connect(':memory:')
+            filedb.backup(self.db)
+            filedb.close()
+
+    def _execute_in(self, cmd, values):
+        """Yield the rows of cmd for all the values, in chunks."""
+        return execute_in(self.db, cmd, values, self.chunk_size)
+
     def _translate_merged(self, all_taxids):
-        conv_all_taxids = set((list(map(int, all_taxids))))
+        if self._taxa is not None:
+            return self._taxa.translate_merged(all_taxids)
 
-        cmd = ('SELECT taxid_old, taxid_new '
-               'FROM merged WHERE taxid_old IN (%s)' %
-               ','.join(map(str, all_taxids)))
+        conv_all_taxids = set((list(map(int, all_taxids))))
 
-        result = self.db.execute(cmd)
+        result = self._execute_in('SELECT taxid_old, taxid_new '
+                                  'FROM merged WHERE taxid_old IN ({})',
+                                  conv_all_taxids)
 
         conversion = {}
-        for old, new in result.fetchall():
+        for old, new in result:
             conv_all_taxids.discard(int(old))
             conv_all_taxids.add(int(new))
             conversion[int(old)] = int(new)
@@ -118,55 +144,42 @@ class NCBITaxa:
         :param name: Species name (does not need to be exact).
         :param 0.9 sim: Min word similarity to report a match (from 0 to 1).
         """
-        import sqlite3.dbapi2 as dbapi2
+        matches = self._get_matcher().search(name, k=1, sim=sim)
+        return matches[0] if matches else (None, None, 0.0)
 
-        _db = dbapi2.connect(self.dbfile)
-        _db.enable_load_extension(True)
-        module_path = os.path.split(os.path.realpath(__file__))[0]
-        _db.execute("SELECT load_extension('%s/%s')" %
-                    (module_path, "SQLite-Levenshtein/levenshtein.sqlext"))
+    def get_fuzzy_name_translator(self, names, k=1, sim=0.9):
+        """Return dict with the taxa names most similar to the given names.
 
-        print("Trying fuzzy search for %s" % name)
-        maxdiffs = math.ceil(len(name) * (1-sim))
-        cmd = (f'SELECT taxid, spname, LEVENSHTEIN(spname, "{name}") AS sim '
-               f'FROM species WHERE sim <= {maxdiffs} ORDER BY sim LIMIT 1;')
+        For each name found, it has a list of its (up to) k best matches
+        as (taxid, species name, score), where the score is the word
+        similarity (from 0 to 1, at least `sim`).
 
-        taxid, spname, score = None, None, len(name)
-        result = _db.execute(cmd)
-        try:
-            taxid, spname, score = result.fetchone()
-        except TypeError:
-            cmd = (
-                f'SELECT taxid, spname, LEVENSHTEIN(spname, "{name}") AS sim '
-                f'FROM synonym WHERE sim <= {maxdiffs} ORDER BY sim LIMIT 1;')
-            result = _db.execute(cmd)
-            try:
-                taxid, spname, score = result.fetchone()
-            except:
-                pass
-            else:
-                taxid = int(taxid)
-        else:
-            taxid = int(taxid)
-
-        norm_score = 1 - (float(score) / len(name))
-        if taxid:
-            print(f'FOUND! {spname} taxid:{taxid} score:{score} ({norm_score})')
+        The names are searched in an index of all the scientific names
+        and synonyms, saved next to the database.
+        """
+        name2matches = self._get_matcher().search_many(names, k, sim)
+        return {name: matches for name, matches in name2matches.items()
+                if matches}
 
-        return taxid, spname, norm_score
+    def _get_matcher(self):
+        if self._matcher is None:
+            self._matcher = get_matcher(self.dbfile, self.db)
+        return self._matcher
 
     def get_rank(self, taxids):
         """Return dict with NCBI taxonomy ranks for each list of taxids."""
+        if self._taxa is not None:
+            return self._taxa.get_rank(taxids)
+
         all_ids = set(taxids)
         all_ids.discard(None)
         all_ids.discard("")
 
-        query = ','.join('"%s"' % v for v in all_ids)
-        cmd = 'SELECT taxid, rank FROM species WHERE taxid IN (%s);' % query
-        result = self.db.execute(cmd)
+        result = self._execute_in('SELECT taxid, rank FROM species '
+                                  'WHERE taxid IN ({})', all_ids)
 
         id2rank = {}
-        for tax, spname in result.fetchall():
+        for tax, spname in result:
             id2rank[tax] = spname
 
         return id2rank
@@ -176,16 +189,18 @@ class NCBITaxa:
 
         The lineage tracks are a hierarchically sorted list of parent taxids.
         """
+        if self._taxa is not None:
+            return self._taxa.get_lineage_translator(taxids)
+
         all_ids = set(taxids)
         all_ids.discard(None)
         all_ids.discard("")
 
-        query = ','.join('"%s"' % v for v in all_ids)
-        cmd = 'SELECT taxid, track FROM species WHERE taxid IN (%s);' % query
-        result = self.db.execute(cmd)
+        result = self._execute_in('SELECT taxid, track FROM species '
+                                  'WHERE taxid IN ({})', all_ids)
 
         id2lineages = {}
-        for tax, track in result.fetchall():
+        for tax, track in result:
             id2lineages[tax] = list(map(int, reversed(track.split(','))))
 
         return id2lineages
@@ -195,19 +210,23 @@ class NCBITaxa:
 
         The lineage track is a hierarchically sorted list of parent taxids.
         """
+        if self._taxa is not None:
+            return self._taxa.get_lineage(taxid)
+
         if not taxid:
             return None
 
         taxid = int(taxid)
-        result = self.db.execute(f'SELECT track FROM species WHERE taxid={taxid}')
+        result = self.db.execute('SELECT track FROM species WHERE taxid=?',
+                                 (taxid,))
         raw_track = result.fetchone()
         if not raw_track:
             #perhaps is an obsolete taxid
             _, merged_conversion = self._translate_merged([taxid])
             if taxid in merged_conversion:
                 result = self.db.execute(
-                    'SELECT track FROM species WHERE taxid=%s' %
-                    merged_conversion[taxid])
+                    'SELECT track FROM species WHERE taxid=?',
+                    (merged_conversion[taxid],))
                 raw_track = result.fetchone()
 
             if not raw_track:
@@ -220,12 +239,14 @@ class NCBITaxa:
         return list(reversed(track))
 
     def get_common_names(self, taxids):
-        query = ','.join('"%s"' % v for v in taxids)
-        cmd = 'SELECT taxid, common FROM species WHERE taxid IN (%s);' % query
-        result = self.db.execute(cmd)
+        if self._taxa is not None:
+            return self._taxa.get_common_names(taxids)
+
+        result = self._execute_in('SELECT taxid, common FROM species '
+                                  'WHERE taxid IN ({})', set(taxids))
 
         id2name = {}
-        for tax, common_name in result.fetchall():
+        for tax, common_name in result:
             if common_name:
                 id2name[tax] = common_name
 
@@ -233,16 +254,18 @@ class NCBITaxa:
 
     def get_taxid_translator(self, taxids, try_synonyms=True):
         """Return dict with the scientific names corresponding to the taxids."""
+        if self._taxa is not None:
+            return self._taxa.get_taxid_translator(taxids, try_synonyms)
+
         all_ids = set(map(int, taxids))
         all_ids.discard(None)
         all_ids.discard("")
 
-        query = ','.join('"%s"' % v for v in all_ids)
-        cmd = 'SELECT taxid, spname FROM species WHERE taxid IN (%s);' % query
-        result = self.db.execute(cmd)
+        result = self._execute_in('SELECT taxid, spname FROM species '
+                                  'WHERE taxid IN ({})', all_ids)
 
         id2name = {}
-        for tax, spname in result.fetchall():
+        for tax, spname in result:
             id2name[tax] = spname
 
         # Any taxid without translation? Let's try in the merged table.
@@ -252,10 +275,9 @@ class NCBITaxa:
             new2old = {v: k for k,v in old2new.items()}
 
             if old2new:
-                query = ','.join('"%s"' % v for v in new2old)
-                cmd = 'SELECT taxid, spname FROM species WHERE taxid IN (%s);' % query
-                result = self.db.execute(cmd)
-                for tax, spname in result.fetchall():
+                result = self._execute_in('SELECT taxid, spname FROM species '
+                                          'WHERE taxid IN ({})', new2old)
+                for tax, spname in result:
                     id2name[new2old[tax]] = spname
 
         return id2name
@@ -265,6 +287,9 @@ class NCBITaxa:
 
         Exact name match is required for translation.
         """
+        if self._taxa is not None:
+            return self._taxa.get_name_translator(names)
+
         name2id = {}
         #name2realname = {}
         name2origname = {}
@@ -273,19 +298,17 @@ class NCBITaxa:
 
         names = set(name2origname.keys())
 
-        query = ','.join('"%s"' % n for n in name2origname.keys())
-        cmd = 'SELECT spname, taxid FROM species WHERE spname IN (%s)' % query
-        result = self.db.execute('SELECT spname, taxid FROM species WHERE spname IN (%s)' % query)
-        for sp, taxid in result.fetchall():
+        result = self._execute_in('SELECT spname, taxid FROM species '
+                                  'WHERE spname IN ({})', names)
+        for sp, taxid in result:
             oname = name2origname[sp.lower()]
             name2id.setdefault(oname, []).append(taxid)
             #name2realname[oname] = sp
         missing =  names - set([n.lower() for n in name2id.keys()])
         if missing:
-            query = ','.join('"%s"' % n for n in missing)
-            result = self.db.execute('SELECT spname, taxid FROM synonym '
-                                     'WHERE spname IN (%s)' % query)
-            for sp, taxid in result.fetchall():
+            result = self._execute_in('SELECT spname, taxid FROM synonym '
+                                      'WHERE spname IN ({})', missing)
+            for sp, taxid in result:
                 oname = name2origname[sp.lower()]
                 name2id.setdefault(oname, []).append(taxid)
                 #name2realname[oname] = sp
@@ -299,45 +322,69 @@ class NCBITaxa:
             names.append(id2name.get(sp, sp))
         return names
 
-    def get_descendant_taxa(self, parent, intermediate_nodes=False,
-                            rank_limit=None, collapse_subspecies=False,
-                            return_tree=False):
-        """Return list of descendant taxids of the given parent.
-
-        Parent can be given as taxid or scientific species name.
-
-        If intermediate_nodes=True, the list will also have the internal nodes.
-        """
+    def _get_taxid(self, taxon):
+        """Return the (current) taxid of taxon, given as taxid or name."""
         try:
-            taxid = int(parent)
+            taxid = int(taxon)
         except ValueError:
             try:
-                taxid = self.get_name_translator([parent])[parent][0]
+                taxid = self.get_name_translator([taxon])[taxon][0]
             except KeyError:
-                raise ValueError('%s not found!' %parent)
+                raise ValueError('%s not found!' % taxon)
 
         # checks if taxid is a deprecated one, and converts into the right one.
         _, conversion = self._translate_merged([taxid]) #try to find taxid in synonyms table
         if conversion:
             taxid = conversion[taxid]
 
-        with open(self.dbfile+".traverse.pkl", "rb") as CACHED_TRAVERSE:
-            prepostorder = pickle.load(CACHED_TRAVERSE)
-        descendants = {}
-        found = 0
-        for tid in prepostorder:
-            if tid == taxid:
-                found += 1
-            elif found == 1:
-                descendants[tid] = descendants.get(tid, 0) + 1
-            elif found == 2:
-                break
-
-        if not found:
-            raise ValueError("taxid not found:%s" %taxid)
-        elif found == 1:
+        return taxid
+
+    def _get_interval(self, taxid):
+        """Return the preorder positions of taxid and of its last descendant.
+
+        All its descendants are in between (a nested-set interval).
+        """
+        if self._taxa is not None:
+            return self._taxa.get_interval(taxid)
+
+        result = self.db.execute('SELECT entry, exit FROM species WHERE taxid=?',
+                                 (taxid,)).fetchone()
+        if result is None:
+            raise ValueError("taxid not found:%s" % taxid)
+
+        return result
+
+    def _get_descendants(self, entry, exit):
+        """Return list of (taxid, parent, is_leaf) of the taxa in the interval.
+
+        They are in preorder, excluding the taxon that starts the interval.
+        """
+        if self._taxa is not None:
+            return self._taxa.get_descendants(entry, exit)
+
+        result = self.db.execute('SELECT taxid, parent, entry = exit FROM species '
+                                 'WHERE entry > ? AND entry <= ? ORDER BY entry',
+                                 (entry, exit))
+        return result.fetchall()
+
+    def get_descendant_taxa(self, parent, intermediate_nodes=False,
+                            rank_limit=None, collapse_subspecies=False,
+                            return_tree=False):
+        """Return list of descendant taxids of the given parent.
+
+        Parent can be given as taxid or scientific species name.
+
+        If intermediate_nodes=True, the list will also have the internal nodes.
+        """
+        taxid = self._get_taxid(parent)
+
+        entry, exit = self._get_interval(taxid)
+        if entry == exit:
             return [taxid]
 
+        descendants = {tid: (1 if is_leaf else 2)  # times in traversal
+                       for tid, _, is_leaf in self._get_descendants(entry, exit)}
+
         if rank_limit or collapse_subspecies or return_tree:
             tree = self.get_topology(list(descendants.keys()), intermediate_nodes=intermediate_nodes, collapse_subspecies=collapse_subspecies, rank_limit=rank_limit)
             if return_tree:
@@ -352,6 +399,31 @@ class NCBITaxa:
         else:
             return [tid for tid, count in descendants.items() if count == 1]
 
+    def count_descendant_taxa(self, parent, intermediate_nodes=False):
+        """Return the number of descendant taxids of the given parent.
+
+        It is len(get_descendant_taxa(parent, intermediate_nodes)), but
+        without having to read them all.
+        """
+        entry, exit = self._get_interval(self._get_taxid(parent))
+
+        if entry == exit:
+            return 1
+        elif intermediate_nodes:
+            return exit - entry
+        elif self._taxa is not None:
+            return sum(is_leaf for _, _, is_leaf in self._get_descendants(entry, exit))
+        else:
+            return self.db.execute('SELECT count(*) FROM species '
+                                   'WHERE entry > ? AND entry <= ? AND entry = exit',
+                                   (entry, exit)).fetchone()[0]
+
+    def is_ancestor(self, ancestor, taxon):
+        """Return True if ancestor is an ancestor of taxon (taxids or names)."""
+        entry, exit = self._get_interval(self._get_taxid(ancestor))
+        taxon_entry, _ = self._get_interval(self._get_taxid(taxon))
+        return entry < taxon_entry <= exit
+
     def get_topology(self, taxids, intermediate_nodes=False, rank_limit=None,
                      collapse_subspecies=False, annotate=True):
         """Return the minimal pruned NCBI taxonomy tree containing taxids.
@@ -372,33 +444,11 @@ class NCBITaxa:
         taxids, merged_conversion = self._translate_merged(taxids)
         if len(taxids) == 1:
             root_taxid = int(list(taxids)[0])
-            with open(self.dbfile+".traverse.pkl", "rb") as CACHED_TRAVERSE:
-                prepostorder = pickle.load(CACHED_TRAVERSE)
-            descendants = {}
-            found = 0
-            nodes = {}
-            hit = 0
-            visited = set()
-            start = prepostorder.index(root_taxid)
-            try:
-                end = prepostorder.index(root_taxid, start+1)
-                subtree = prepostorder[start:end+1]
-            except ValueError:
-                # If root taxid is not found in postorder, must be a tip node
-                subtree = [root_taxid]
-            leaves = set(v for v, count in Counter(subtree).items() if count == 1)
-            nodes[root_taxid] = PhyloTree({'name': str(root_taxid)})
-            current_parent = nodes[root_taxid]
-            for tid in subtree:
-                if tid in visited:
-                    current_parent = nodes[tid].up
-                else:
-                    visited.add(tid)
-                    nodes[tid] = PhyloTree({'name': str(tid)})
-                    current_parent.add_child(nodes[tid])
-                    if tid not in leaves:
-                        current_parent = nodes[tid]
-            root = nodes[root_taxid]
+            entry, exit = self._get_interval(root_taxid)
+            root = PhyloTree({'name': str(root_taxid)})
+            nodes = {root_taxid: root}
+            for tid, parent, _ in self._get_descendants(entry, exit):
+                nodes[tid] = nodes[parent].add_child(name=str(tid))
         else:
             taxids = set(map(int, taxids))
             sp2track = {}
@@ -587,89 +637,6 @@ class NCBITaxa:
         return broken_branches, broken_clades, broken_clade_sizes
 
 
-def load_ncbi_tree_from_dump(tar):
-    from .. import Tree
-    parent2child = {}
-    name2node = {}
-    node2taxname = {}
-    synonyms = set()
-    name2rank = {}
-    node2common = {}
-    print("Loading node names...")
-    unique_nocase_synonyms = set()
-    for line in tar.extractfile("names.dmp"):
-        line = str(line.decode())
-        fields =  [_f.strip() for _f in line.split("|")]
-        nodename = fields[0]
-        name_type = fields[3].lower()
-        taxname = fields[1]
-
-        # Clean up tax names so we make sure the don't include quotes. See https://github.com/etetoolkit/ete/issues/469
-        taxname = taxname.rstrip('"').lstrip('"')
-
-        if name_type == "scientific name":
-            node2taxname[nodename] = taxname
-        if name_type == "genbank common name":
-            node2common[nodename] = taxname
-        elif name_type in set(["synonym", "equivalent name", "genbank equivalent name",
-                               "anamorph", "genbank synonym", "genbank anamorph", "teleomorph"]):
-
-            # Keep track synonyms, but ignore duplicate case-insensitive names. See https://github.com/etetoolkit/ete/issues/469
-            synonym_key = (nodename, taxname.lower())
-            if synonym_key not in unique_nocase_synonyms:
-                unique_nocase_synonyms.add(synonym_key)
-                synonyms.add((nodename, taxname))
-
-    print(len(node2taxname), "names loaded.")
-    print(len(synonyms), "synonyms loaded.")
-
-    print("Loading nodes...")
-    for line in tar.extractfile("nodes.dmp"):
-        line = str(line.decode())
-        fields =  line.split("|")
-        nodename = fields[0].strip()
-        parentname = fields[1].strip()
-        n = Tree()
-        n.name = nodename
-        #n.taxname = node2taxname[nodename]
-        n.add_prop('taxname', node2taxname[nodename])
-        if nodename in node2common:
-            n.add_prop('common_name', node2taxname[nodename])
-        n.add_prop('rank', fields[2].strip())
-        parent2child[nodename] = parentname
-        name2node[nodename] = n
-    print(len(name2node), "nodes loaded.")
-
-    print("Linking nodes...")
-    for node in name2node:
-       if node == "1":
-           t = name2node[node]
-       else:
-           parent = parent2child[node]
-           parent_node = name2node[parent]
-           parent_node.add_child(name2node[node])
-    print("Tree is loaded.")
-    return t, synonyms
-
-def generate_table(t):
-    with open("taxa.tab", "w") as out:
-        for j, n in enumerate(t.traverse()):
-            if j % 1000 == 0:
-                print("\r",j,"generating entries...", end=' ')
-            temp_node = n
-            track = []
-            while temp_node:
-                track.append(temp_node.name)
-                temp_node = temp_node.up
-
-            n_up_name = n.up.name if n.up else ""
-
-            row = '\t'.join([n.name, n_up_name, n.props.get('taxname'),
-                             n.props.get("common_name", ''), n.props.get("rank"),
-                             ','.join(track)])
-
-            print(row, file=out)
-
 def update_db(dbfile, targz_file=None):
     basepath = os.path.split(dbfile)[0]
     if basepath and not os.path.exists(basepath):
@@ -679,26 +646,13 @@ def update_db(dbfile, targz_file=None):
         update_local_taxdump(DEFAULT_TAXDUMP)
         targz_file = DEFAULT_TAXDUMP
 
-    tar = tarfile.open(targz_file, 'r')
-    t, synonyms = load_ncbi_tree_from_dump(tar)
-    prepostorder = [int(node.name) for post, node in t.iter_prepostorder()]
-    pickle.dump(prepostorder, open(dbfile+'.traverse.pkl', "wb"), 2)
-
     print("Updating database: %s ..." %dbfile)
-    generate_table(t)
-
-    with open("syn.tab", "w") as SYN:
-        SYN.write('\n'.join(["%s\t%s" %(v[0],v[1]) for v in synonyms]))
-
-    with open("merged.tab", "w") as merged:
-        for line in tar.extractfile("merged.dmp"):
-            line = str(line.decode())
-            out_line = '\t'.join([_f.strip() for _f in line.split('|')[:2]])
-            merged.write(out_line+'\n')
+    t0 = time.perf_counter()
 
-    upload_data(dbfile)
+    with tarfile.open(targz_file, 'r') as tar:
+        upload_data(dbfile, tar)
 
-    os.system("rm syn.tab merged.tab taxa.tab")
+    print(f'Database updated in {time.perf_counter() - t0:.1f} s.')
 
 
 def update_local_taxdump(fname=DEFAULT_TAXDUMP):
@@ -721,63 +675,66 @@ def update_local_taxdump(fname=DEFAULT_TAXDUMP):
             print(f'File {fname} is already up-to-date with {url} .')
 
 
-def upload_data(dbfile):
-    print()
-    print('Uploading to', dbfile)
-    basepath = os.path.split(dbfile)[0]
-    if basepath and not os.path.exists(basepath):
-        os.mkdir(basepath)
+def upload_data(dbfile, tar):
+    """Create the database dbfile with the taxonomy dump in tar.
 
-    db = sqlite3.connect(dbfile)
+    It is built in a temporary file (without journal or syncing to disk,
+    which makes the inserts much faster) that replaces dbfile at the end.
+    """
+    tmpfile = dbfile + '.tmp'
+    if os.path.exists(tmpfile):
+        os.remove(tmpfile)
+
+    db = sqlite3.connect(tmpfile)
+    db.execute('PRAGMA journal_mode = OFF')
+    db.execute('PRAGMA synchronous = OFF')
 
-    create_cmd = """
-    DROP TABLE IF EXISTS stats;
-    DROP TABLE IF EXISTS species;
-    DROP TABLE IF EXISTS synonym;
-    DROP TABLE IF EXISTS merged;
+    db.executescript("""
     CREATE TABLE stats (version INT PRIMARY KEY);
-    CREATE TABLE species (taxid INT PRIMARY KEY, parent INT, spname VARCHAR(50) COLLATE NOCASE, common VARCHAR(50) COLLATE NOCASE, rank VARCHAR(50), track TEXT);
+    CREATE TABLE species (taxid INT PRIMARY KEY, parent INT, spname VARCHAR(50) COLLATE NOCASE, common VARCHAR(50) COLLATE NOCASE, rank VARCHAR(50), track TEXT, entry INT, exit INT);
     CREATE TABLE synonym (taxid INT,spname VARCHAR(50) COLLATE NOCASE, PRIMARY KEY (spname, taxid));
     CREATE TABLE merged (taxid_old INT, taxid_new INT);
-    CREATE INDEX spname1 ON species (spname COLLATE NOCASE);
-    CREATE INDEX spname2 ON synonym (spname COLLATE NOCASE);
-    """
-    for cmd in create_cmd.split(';'):
-        db.execute(cmd)
-    print()
+    """)
 
-    db.execute("INSERT INTO stats (version) VALUES (%d);" %DB_VERSION)
-    db.commit()
+    db.execute('INSERT INTO stats (version) VALUES (?)', (DB_VERSION,))
+
+    with stage('Loading names'):
+        taxid2name, taxid2common, synonyms = load_names(tar)
+
+    with stage('Loading nodes'):
+        parents, ranks = load_nodes(tar)
+
+    with stage('Inserting synonyms'):
+        db.executemany('INSERT INTO synonym (taxid, spname) VALUES (?, ?)',
+                       synonyms)
+
+    with stage('Inserting taxid merges'):
+        db.executemany('INSERT INTO merged (taxid_old, taxid_new) VALUES (?, ?)',
+                       (fields[:2] for fields in read_dump(tar, 'merged.dmp')))
+
+    with stage('Inserting taxids'):
+        db.executemany('INSERT INTO species (taxid, parent, spname, common, rank, track, entry, exit) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       iter_taxa(parents, ranks, taxid2name, taxid2common))
+
+    with stage('Creating indices'):
+        db.executescript("""
+        CREATE INDEX spname1 ON species (spname COLLATE NOCASE);
+        CREATE INDEX spname2 ON synonym (spname COLLATE NOCASE);
+        CREATE INDEX entry ON species (entry);
+        CREATE INDEX merged1 ON merged (taxid_old);
+        """)
 
-    for i, line in enumerate(open("syn.tab")):
-        if i % 5000 == 0 :
-            print('\rInserting synonyms:     %6d' % i, end=' ', file=sys.stderr)
-            sys.stderr.flush()
-        taxid, spname = line.strip('\n').split('\t')
-        db.execute("INSERT INTO synonym (taxid, spname) VALUES (?, ?);",
-                   (taxid, spname))
-    print()
-    db.commit()
-    for i, line in enumerate(open("merged.tab")):
-        if i % 5000 == 0 :
-            print('\rInserting taxid merges: %6d' % i, end=' ', file=sys.stderr)
-            sys.stderr.flush()
-        taxid_old, taxid_new = line.strip('\n').split('\t')
-        db.execute("INSERT INTO merged (taxid_old, taxid_new) VALUES (?, ?);",
-                   (taxid_old, taxid_new))
-    print()
-    db.commit()
-    for i, line in enumerate(open("taxa.tab")):
-        if i % 5000 == 0 :
-            print('\rInserting taxids:      %6d' % i, end=' ', file=sys.stderr)
-            sys.stderr.flush()
-        taxid, parentid, spname, common, rank, lineage = line.strip('\n').split('\t')
-        db.execute('INSERT INTO species (taxid, parent, spname, common, rank, track) '
-                   'VALUES (?, ?, ?, ?, ?, ?);',
-                   (taxid, parentid, spname, common, rank, lineage))
-    print()
     db.commit()
 
+    with stage('Indexing names for fuzzy searches'):
+        matcher = NameMatcher.from_db(db)
+
+    db.close()
+
+    os.replace(tmpfile, dbfile)
+    matcher.save(dbfile + MATCHER_SUFFIX)  # after the database, so it is newer
+
 
 if __name__ == "__main__":
     ncbi = NCBITaxa()
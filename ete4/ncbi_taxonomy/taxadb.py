@@ -0,0 +1,151 @@
+"""
+Parts common to the NCBI and GTDB taxonomy databases: queries with many
+values, and the reading of the taxonomy dumps that they are built from.
+"""
+
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+CHUNK_SIZE = 500  # maximum number of values in each "IN (...)" of a query
+
+SYNONYM_TYPES = {'synonym', 'equivalent name', 'genbank equivalent name',
+                 'anamorph', 'genbank synonym', 'genbank anamorph', 'teleomorph'}
+
+
+def execute_in(db, cmd, values, chunk_size=CHUNK_SIZE):
+    """Yield the rows that result from running cmd for all the values.
+
+    The command has "{}" where the values go, as in
+    'SELECT taxid, rank FROM species WHERE taxid IN ({})', and they are
+    passed as parameters in chunks. All the chunks have the same size
+    (the last one is padded by repeating a value), so the statement is
+    prepared only once and reused.
+    """
+    values = list(values)
+    if not values:
+        return
+
+    chunk_size = min(chunk_size, len(values))
+    cmd = cmd.format(','.join(['?'] * chunk_size))
+
+    for i in range(0, len(values), chunk_size):
+        chunk = values[i:i+chunk_size]
+        chunk += [chunk[-1]] * (chunk_size - len(chunk))
+        yield from db.execute(cmd, chunk)
+
+
+def read_dump(tar, fname):
+    """Yield the list of fields of each line of the .dmp file fname in tar."""
+    for line in tar.extractfile(fname):
+        yield [field.strip() for field in line.decode().split('|')]
+
+
+def load_names(tar, with_synonyms=True):
+    """Return the scientific names, common names and synonyms of names.dmp.
+
+    The names are dicts taxid -> name, and the synonyms a list of
+    (taxid, name), with no name repeated (case-insensitively) in a taxid
+    (or empty if with_synonyms is False).
+    """
+    taxid2name = {}
+    taxid2common = {}
+    synonyms = {}  # (taxid, lowercase name) -> name
+    for taxid, name, _, name_type, *_ in read_dump(tar, 'names.dmp'):
+        name_type = name_type.lower()
+
+        # Clean up tax names so we make sure the don't include quotes. See https://github.com/etetoolkit/ete/issues/469
+        name = name.strip('"')
+
+        if name_type == 'scientific name':
+            taxid2name[taxid] = name
+        if name_type == 'genbank common name':
+            taxid2common[taxid] = name
+        elif with_synonyms and name_type in SYNONYM_TYPES:
+            # Ignore duplicate case-insensitive names. See https://github.com/etetoolkit/ete/issues/469
+            synonyms.setdefault((taxid, name.lower()), name)
+
+    synonyms = [(taxid, name) for (taxid, _), name in synonyms.items()]
+
+    return taxid2name, taxid2common, synonyms
+
+
+def load_nodes(tar):
+    """Return dicts taxid -> parent and taxid -> rank, from nodes.dmp."""
+    parents = {}
+    ranks = {}
+    for taxid, parent, rank, *_ in read_dump(tar, 'nodes.dmp'):
+        parents[taxid] = parent
+        ranks[taxid] = rank
+    return parents, ranks
+
+
+def get_intervals(root, children):
+    """Return dict taxid -> (entry, exit), the nested-set interval of taxid.
+
+    They are the preorder positions of the taxon and of its last descendant.
+    """
+    preorder = []
+    pending = [root]
+    while pending:
+        taxid = pending.pop()
+        preorder.append(taxid)
+        pending.extend(reversed(children.get(taxid, [])))
+
+    entries = {taxid: i for i, taxid in enumerate(preorder)}
+
+    intervals = {}
+    for taxid in reversed(preorder):  # so children come before parents
+        entry = entries[taxid]
+        last_children = children.get(taxid)
+        exit = intervals[last_children[-1]][1] if last_children else entry
+        intervals[taxid] = (entry, exit)
+
+    return intervals
+
+
+def iter_taxa(parents, ranks, taxid2name, taxid2common, root='1'):
+    """Yield the rows of the species table, in levelorder from the root.
+
+    The rows are (taxid, parent, spname, common, rank, track, entry, exit).
+    The track (taxon, parent, ..., root) is made from the parent's one,
+    going down the tree one level at a time.
+    """
+    children = defaultdict(list)
+    for taxid, parent in parents.items():
+        if taxid != root:
+            children[parent].append(taxid)
+
+    intervals = get_intervals(root, children)
+
+    level = [root]
+    tracks = {root: root}
+    while level:
+        next_level = []
+        next_tracks = {}
+        for taxid in level:
+            track = tracks[taxid]
+
+            # The common name is the scientific one, as in older databases.
+            common = taxid2name[taxid] if taxid in taxid2common else ''
+
+            yield (taxid, parents[taxid] if taxid != root else '',
+                   taxid2name[taxid], common, ranks[taxid], track,
+                   *intervals[taxid])
+
+            for child in children.get(taxid, []):
+                next_level.append(child)
+                next_tracks[child] = child + ',' + track
+
+        level = next_level
+        tracks = next_tracks
+
+
+@contextmanager
+def stage(name):
+    """Print the name of a stage of the database build and how long it takes."""
+    print(f'{name} ...', end=' ', flush=True)
+    t0 = time.perf_counter()
+    yield
+    print(f'{time.perf_counter() - t0:.1f} s')
@@ -0,0 +1,244 @@
+"""
+Taxonomy database loaded in memory, for fast repeated queries.
+
+The taxa are kept in numpy arrays sorted by taxid (with the position of
+their parents, their ranks, and their nested-set intervals), and their
+names in single strings with the offsets where each name starts. That
+makes them compact, and also shareable with forked worker processes:
+reading them does not touch the reference counts of millions of python
+objects, so their memory pages are not copied.
+
+Lineages are computed by following the parents, and the most recently
+used ones are remembered.
+"""
+
+import warnings
+from bisect import bisect_left
+from functools import lru_cache
+
+import numpy as np
+
+
+class TaxaArrays:
+    """All the taxa of a taxonomy database, with the same queries as NCBITaxa."""
+
+    def __init__(self, db, cache_size=100000):
+        """
+        :param db: Connection to the sqlite database with the taxonomy.
+        :param cache_size: Number of lineages to remember.
+        """
+        rows = db.execute('SELECT taxid, parent, spname, common, rank, entry, exit '
+                          'FROM species ORDER BY taxid').fetchall()
+        taxids, parents, spnames, commons, ranks, entries, exits = zip(*rows)
+
+        self.taxids = np.array(taxids, dtype=np.int64)
+
+        # Position of the parent of each taxon (-1 for the root).
+        parents = np.array([p if p != '' else -1 for p in parents], dtype=np.int64)
+        self.parents = np.searchsorted(self.taxids, parents)
+        self.parents[parents == -1] = -1
+
+        self.rank_names = sorted(set(ranks))
+        rank_code = {rank: i for i, rank in enumerate(self.rank_names)}
+        self.ranks = np.array([rank_code[r] for r in ranks], dtype=np.int16)
+
+        self.spnames = Strings(spnames)
+        self.commons = Strings(commons)
+
+        self.entries = np.array(entries, dtype=np.int64)
+        self.exits = np.array(exits, dtype=np.int64)
+        self.preorder = np.argsort(self.entries)  # position of taxon at entry
+
+        # Names sorted case-insensitively, to find them by bisection.
+        self.spname_order = sort_names(spnames)
+
+        rows = db.execute('SELECT taxid, spname FROM synonym ORDER BY taxid').fetchall()
+        syn_taxids, syn_names = zip(*rows) if rows else ((), ())
+        order = sort_names(syn_names)
+        self.synonyms = Strings([syn_names[i] for i in order])
+        self.synonym_taxids = np.array(syn_taxids, dtype=np.int64)[order]
+
+        rows = db.execute('SELECT taxid_old, taxid_new FROM merged '
+                          'ORDER BY taxid_old').fetchall()
+        self.merged_old = np.array([old for old, new in rows], dtype=np.int64)
+        self.merged_new = np.array([new for old, new in rows], dtype=np.int64)
+
+        self.get_lineage_at = lru_cache(maxsize=cache_size)(self._get_lineage_at)
+
+    def position(self, taxid):
+        """Return the position of the given taxid (an int), or None."""
+        i = int(self.taxids.searchsorted(taxid))
+        return i if i < len(self.taxids) and self.taxids[i] == taxid else None
+
+    def positions(self, taxids):
+        """Return dict with the position of each of the taxids that exist."""
+        ids = set()
+        for taxid in taxids:
+            try:
+                ids.add(int(taxid))
+            except (ValueError, TypeError):
+                pass  # like sqlite, which would not find it either
+
+        if len(ids) < 10:  # faster than using arrays
+            positions = {taxid: self.position(taxid) for taxid in ids}
+            return {taxid: i for taxid, i in positions.items() if i is not None}
+
+        ids = np.array(sorted(ids), dtype=np.int64)
+        pos = np.searchsorted(self.taxids, ids)
+        pos[pos == len(self.taxids)] = 0
+        found = self.taxids[pos] == ids
+
+        return dict(zip(ids[found].tolist(), pos[found].tolist()))
+
+    def _get_lineage_at(self, i):
+        """Return tuple with the lineage of the taxon at position i."""
+        parent = int(self.parents[i])
+        taxid = int(self.taxids[i])
+        return (self.get_lineage_at(parent) + (taxid,)) if parent != -1 else (taxid,)
+
+    def translate_merged(self, all_taxids):
+        conv_all_taxids = set(map(int, all_taxids))
+
+        conversion = {}
+        if len(self.merged_old) == 0:
+            return conv_all_taxids, conversion
+
+        ids = np.array(sorted(conv_all_taxids), dtype=np.int64)
+        pos = np.searchsorted(self.merged_old, ids)
+        pos[pos == len(self.merged_old)] = 0
+        found = self.merged_old[pos] == ids
+
+        for old, new in zip(ids[found].tolist(), self.merged_new[pos[found]].tolist()):
+            conv_all_taxids.discard(old)
+            conv_all_taxids.add(new)
+            conversion[old] = new
+
+        return conv_all_taxids, conversion
+
+    def get_rank(self, taxids):
+        return {taxid: self.rank_names[self.ranks[i]]
+                for taxid, i in self.positions(set(taxids) - {None, ''}).items()}
+
+    def get_lineage_translator(self, taxids):
+        return {taxid: list(self.get_lineage_at(i))
+                for taxid, i in self.positions(set(taxids) - {None, ''}).items()}
+
+    def get_lineage(self, taxid):
+        if not taxid:
+            return None
+
+        taxid = int(taxid)
+        i = self.position(taxid)
+        if i is None:
+            #perhaps is an obsolete taxid
+            _, merged_conversion = self.translate_merged([taxid])
+            if taxid in merged_conversion:
+                i = self.position(merged_conversion[taxid])
+
+            if i is None:
+                raise ValueError(f'Could not find taxid: {taxid}')
+            else:
+                warnings.warn('taxid %s was translated into %s' %
+                              (taxid, merged_conversion[taxid]))
+
+        return list(self.get_lineage_at(i))
+
+    def get_common_names(self, taxids):
+        id2name = {}
+        for taxid, i in self.positions(taxids).items():
+            common_name = self.commons[i]
+            if common_name:
+                id2name[taxid] = common_name
+        return id2name
+
+    def get_taxid_translator(self, taxids, try_synonyms=True):
+        all_ids = set(map(int, taxids))
+
+        id2name = {taxid: self.spnames[i]
+                   for taxid, i in self.positions(all_ids).items()}
+
+        # Any taxid without translation? Let's try in the merged table.
+        if len(all_ids) != len(id2name) and try_synonyms:
+            not_found_taxids = all_ids - set(id2name.keys())
+            _, old2new = self.translate_merged(not_found_taxids)
+            new2old = {v: k for k,v in old2new.items()}
+
+            for tax, i in self.positions(new2old).items():
+                id2name[new2old[tax]] = self.spnames[i]
+
+        return id2name
+
+    def get_name_translator(self, names):
+        name2id = {}
+        name2origname = {n.lower(): n for n in names}
+
+        spnames = Lowered(self.spnames, self.spname_order)
+        synonyms = Lowered(self.synonyms, range(len(self.synonyms)))
+
+        for name, oname in name2origname.items():
+            found = [int(self.taxids[self.spname_order[k]])
+                     for k in find(spnames, name)]
+            if not found:
+                found = [int(self.synonym_taxids[k])
+                         for k in find(synonyms, name)]
+            if found:
+                name2id[oname] = found
+
+        return name2id
+
+    def get_interval(self, taxid):
+        i = self.position(taxid)
+        if i is None:
+            raise ValueError("taxid not found:%s" % taxid)
+
+        return int(self.entries[i]), int(self.exits[i])
+
+    def get_descendants(self, entry, exit):
+        """Return list of (taxid, parent, is_leaf) for the given interval."""
+        pos = self.preorder[entry + 1:exit + 1]
+        taxids = self.taxids[pos].tolist()
+        parents = self.taxids[self.parents[pos]].tolist()
+        leaves = (self.entries[pos] == self.exits[pos]).tolist()
+        return list(zip(taxids, parents, leaves))
+
+
+class Strings:
+    """Sequence of strings stored as a single string and their offsets."""
+
+    def __init__(self, values):
+        self.text = ''.join(values)
+        self.offsets = np.cumsum([0] + [len(v) for v in values], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.text[self.offsets[i]:self.offsets[i+1]]
+
+
+class Lowered:
+    """View of the lowercase strings in the given order (to bisect it)."""
+
+    def __init__(self, strings, order):
+        self.strings = strings
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, k):
+        return self.strings[self.order[k]].lower()
+
+
+def sort_names(names):
+    """Return array with the positions of the names, sorted case-insensitively."""
+    return np.array(sorted(range(len(names)), key=lambda i: names[i].lower()),
+                    dtype=np.int64)
+
+
+def find(lowered, name):
+    """Yield the positions in lowered (sorted) with the given (lowercase) name."""
+    k = bisect_left(lowered, name)
+    while k < len(lowered) and lowered[k] == name:
+        yield k
+        k += 1
@@ -0,0 +1,193 @@
+"""
+Binary format to store trees, that can be memory-mapped and opened instantly.
+
+The file has a small header, followed by a json description of its
+contents, and then the arrays of a CompactTree (the topology and a
+column for every property), each one aligned in the file so it can be
+used directly from a memory map::
+
+  ETE4TREE | version | metadata size | metadata (json) | arrays...
+
+Strings (and other python objects, pickled) are kept in a table with
+all their bytes together, and an array of offsets to find each one.
+
+Opening a file only reads its header, so it is almost immediate, and
+the operating system shares the (read-only) mapped pages among all the
+processes that open the same file. Tree nodes are created only when
+asked for, with ``to_tree(node)`` on the returned CompactTree.
+"""
+
+import json
+import pickle
+import struct
+
+import numpy as np
+
+from ..core.compact import CompactTree, TOPOLOGY
+
+
+MAGIC = b'ETE4TREE'
+VERSION = 1
+
+HEADER = struct.Struct('<8sII')  # magic, version, size of the metadata
+ALIGNMENT = 64  # arrays start at positions multiple of this
+
+
+class EteBinaryError(Exception):
+    pass
+
+
+def dump(tree, path):
+    """Write to file path the given tree (a Tree or a CompactTree)."""
+    ct = tree if isinstance(tree, CompactTree) else CompactTree.from_tree(tree)
+
+    arrays = {name: getattr(ct, name) for name in TOPOLOGY}
+
+    columns = {}  # kind of each property column
+    for pname, values in ct.props.items():
+        kind, parts = encode_column(values)
+        columns[pname] = kind
+        arrays.update((f'props/{pname}/{part}', array)
+                      for part, array in parts.items())
+
+    # Describe where each array goes (relative to the start of the data).
+    descriptions = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        descriptions[name] = [array.dtype.str, offset, len(array)]
+        offset = aligned(offset + array.nbytes)
+
+    metadata = json.dumps({'nnodes': ct.nnodes,
+                           'columns': columns,
+                           'arrays': descriptions}).encode()
+
+    start = aligned(HEADER.size + len(metadata))  # where the data starts
+
+    with open(path, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, len(metadata)))
+        fp.write(metadata)
+        for name, array in arrays.items():
+            fp.seek(start + descriptions[name][1])
+            fp.write(memoryview(array).cast('B'))
+        fp.truncate(start + offset)  # so all the (aligned) arrays fit
+
+
+def load(path):
+    """Return a CompactTree with the tree in the file, memory-mapped."""
+    data = np.memmap(path, mode='r')
+
+    magic, version, metadata_size = read_header(data)
+
+    try:
+        metadata = json.loads(bytes(data[HEADER.size:
+                                         HEADER.size + metadata_size]))
+        start = aligned(HEADER.size + metadata_size)
+
+        arrays = {name: np.frombuffer(data, dtype=np.dtype(dtype),
+                                      count=count, offset=start + offset)
+                  for name, (dtype, offset, count) in metadata['arrays'].items()}
+
+        props = {pname: decode_column(kind, arrays, f'props/{pname}')
+                 for pname, kind in metadata['columns'].items()}
+
+        if len(arrays['parent']) != metadata['nnodes']:
+            raise ValueError('wrong number of nodes')
+
+        return CompactTree.from_arrays(arrays, props)
+    except (ValueError, KeyError) as e:
+        raise EteBinaryError(f'corrupted file {path}: {e}')
+
+
+def read_header(data):
+    """Return the magic, version and metadata size, checking they are valid."""
+    if len(data) < HEADER.size:
+        raise EteBinaryError('file too small to contain a tree')
+
+    magic, version, metadata_size = HEADER.unpack(bytes(data[:HEADER.size]))
+
+    if magic != MAGIC:
+        raise EteBinaryError('not an ete binary tree file')
+
+    if version > VERSION:
+        raise EteBinaryError(f'unsupported version {version} (max {VERSION})')
+
+    return magic, version, metadata_size
+
+
+def aligned(position):
+    """Return the first position, from the given one, that is aligned."""
+    return -(-position // ALIGNMENT) * ALIGNMENT
+
+
+# Columns of properties.
+
+def encode_column(values):
+    """Return the kind of column and a dict with the arrays to store it."""
+    kind = values.dtype.kind
+
+    if kind == 'f':
+        return 'float', {'values': values.astype('<f8')}
+    elif kind in 'iu':
+        return 'int', {'values': values.astype('<i8')}
+
+    if all(v is None or type(v) is str for v in values):
+        kind, encode = 'str', str.encode
+    else:
+        kind, encode = 'pickle', pickle.dumps
+
+    blobs = [b'' if v is None else encode(v) for v in values]
+
+    offsets = np.zeros(len(blobs) + 1, dtype='<i8')
+    np.cumsum([len(b) for b in blobs], out=offsets[1:])
+
+    return kind, {'offsets': offsets,
+                  'bytes': np.frombuffer(b''.join(blobs), dtype='u1'),
+                  'missing': np.array([v is None for v in values], dtype='u1')}
+
+
+def decode_column(kind, arrays, prefix):
+    """Return the column of the given kind, made from arrays with prefix."""
+    if kind in ['float', 'int']:
+        return arrays[prefix + '/values']
+    elif kind in ['str', 'pickle']:
+        return BlobColumn(arrays[prefix + '/offsets'], arrays[prefix + '/bytes'],
+                          arrays[prefix + '/missing'],
+                          bytes.decode if kind == 'str' else pickle.loads)
+    else:
+        raise EteBinaryError(f'unknown kind of column: {kind}')
+
+
+class BlobColumn:
+    """Column of python objects that are decoded from bytes when accessed."""
+
+    dtype = np.dtype(object)  # so it looks like a column of objects
+
+    def __init__(self, offsets, blob, missing, decode):
+        self.offsets = offsets  # values[i] is in blob[offsets[i]:offsets[i+1]]
+        self.blob = blob
+        self.missing = missing
+        self.decode = decode
+
+    def __len__(self):
+        return len(self.missing)
+
+    def __getitem__(self, i):
+        if type(i) is slice:
+            start, stop, step = i.indices(len(self))
+            assert step == 1, 'only contiguous slices are supported'
+            return BlobColumn(self.offsets[start:stop+1], self.blob,
+                              self.missing[start:stop], self.decode)
+
+        if i < 0:
+            i += len(self)
+
+        if self.missing[i]:
+            return None
+
+        return self.decode(self.blob[self.offsets[i]:self.offsets[i+1]].tobytes())
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.blob.nbytes + self.missing.nbytes
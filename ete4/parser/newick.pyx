@@ -4,6 +4,12 @@ Parser for trees represented in newick format.
 
 # See https://en.wikipedia.org/wiki/Newick_format
 
+import gc
+import pickle
+import multiprocessing as mp
+from collections import deque
+from itertools import islice
+
 from ..core.tree import Tree
 
 
@@ -55,6 +61,12 @@ PARSER_DEFAULT = {
     'internal': [SUPPORT, DIST],  # ((x:y)support:dist);
 }
 
+# A parser dict can also have an 'nhx' entry, with the functions to read
+# some of the extended properties. For example, with:
+#   {'leaf': [...], 'internal': [...], 'nhx': {'taxid': int, 'rate': float}}
+# the properties "taxid" and "rate" in [&&NHX:taxid=9606:rate=0.5] are
+# converted to numbers. The rest of the extended properties stay strings.
+
 # This part is used for parsers referred by name (or old-fashioned integers).
 
 NAME_REQ = dict(NAME, req=True)  # value required
@@ -98,7 +110,8 @@ def make_parser(parser=None, name='%s', dist='%g', support='%g'):
         return [p0, p1]
 
     parser = parser if type(parser) is dict else PARSERS[parser]
-    return {'leaf': copy(parser['leaf']), 'internal': copy(parser['internal'])}
+    return dict(parser, leaf=copy(parser['leaf']),
+                internal=copy(parser['internal']))
 
 
 # Interpret and represent the content of a node in newick format.
@@ -149,6 +162,8 @@ def read_props(str text, long pos, is_leaf, dict parser, check_req):
     Example (for the default format of a leaf node):
       'abc:123[&&NHX:x=foo]'  ->  {'name': 'abc', 'dist': 123, 'x': 'foo'}
     """
+    cdef long n = len(text)
+
     prop0, prop1 = parser['leaf' if is_leaf else 'internal']
 
     # Shortcuts.
@@ -157,7 +172,7 @@ def read_props(str text, long pos, is_leaf, dict parser, check_req):
 
     props = {}  # will contain the properties extracted from the content string
 
-    p0_str, pos = read_content(text, pos, endings=':[,);')
+    p0_str, pos = read_content(text, pos, ':[,);')
 
     try:
         assert not check_req or not p0_req or p0_str, 'missing required value'
@@ -166,10 +181,11 @@ def read_props(str text, long pos, is_leaf, dict parser, check_req):
     except (AssertionError, ValueError) as e:
         raise NewickError('parsing %r: %s' % (p0_str, e))
 
+    p1_str = ''
     try:
-        if pos < len(text) and text[pos] == ':':
+        if pos < n and text[pos] == ':':
             pos = skip_spaces_and_comments(text, pos+1)
-            p1_str, pos = read_content(text, pos, endings='[ ,);')
+            p1_str, pos = read_content(text, pos, '[ ,);')
             props[p1_name] = p1_read(p1_str)
         elif check_req and p1_req:
             raise AssertionError('missing required value')
@@ -178,27 +194,49 @@ def read_props(str text, long pos, is_leaf, dict parser, check_req):
 
     pos = skip_spaces_and_comments(text, pos)
 
-    if text[pos] == '[':  # this can't be a comment since we just skipped those
+    if pos < n and text[pos] == '[':  # can't be a comment since we skipped them
         start = pos + 1
         pos = text.find(']', start)
         assert pos >= 0, 'unfinished extended props'
-        props.update(get_extended_props(text[start:pos]))
+        props.update(get_extended_props(text[start:pos], parser.get('nhx')))
         pos = skip_spaces_and_comments(text, pos + 1)  # after the "]"
 
     return props, pos
 
 
-def get_extended_props(str text):
+def get_extended_props(str text, dict readers=None):
     """Return a dict with the properties extracted from the text in NHX format.
 
     Example: '&&NHX:x=foo:y=bar'  ->  {'x': 'foo', 'y': 'bar'}
+
+    :param readers: Dict with the functions to apply to the text value
+        of some properties, like {'taxid': int}.
     """
-    try:
-        assert text.startswith('&&NHX:'), 'unknown annotation -- not "&&NHX"'
-        return dict(pair.split('=') for pair in text[len('&&NHX:'):].split(':'))
-    except (AssertionError, ValueError) as e:
-        raise NewickError('invalid NHX format (%s) in text %s' %
-                          (e, repr_short(text)))
+    cdef Py_ssize_t i
+    cdef str pair
+
+    if not text.startswith('&&NHX:'):
+        raise NewickError('invalid NHX format (unknown annotation -- '
+                          'not "&&NHX") in text %s' % repr_short(text))
+
+    props = {}
+    for pair in text[len('&&NHX:'):].split(':'):
+        i = pair.find('=')
+        if i < 0 or pair.find('=', i + 1) >= 0:
+            raise NewickError('invalid NHX format (bad pair %r) in text %s' %
+                              (pair, repr_short(text)))
+        props[pair[:i]] = pair[i+1:]
+
+    if readers:
+        for pname, read in readers.items():
+            if pname in props:
+                try:
+                    props[pname] = read(props[pname])
+                except ValueError as e:
+                    raise NewickError('invalid NHX value for %s (%s) in '
+                                      'text %s' % (pname, e, repr_short(text)))
+
+    return props
 
 
 def repr_short(obj, max_len=50):
@@ -216,6 +254,11 @@ def load(fp, parser=None):
 
 def loads(str text, parser=None, tree_class=Tree):
     """Return tree from its newick representation."""
+    # The garbage collector is paused while creating the nodes. Otherwise
+    # it runs again and again over all the new (non-garbage) nodes.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+
     try:
         assert text.endswith(';'), 'text ends with no ";"'
 
@@ -231,90 +274,265 @@ def loads(str text, parser=None, tree_class=Tree):
 
     except AssertionError as e:
         raise NewickError(str(e))
+    finally:
+        if gc_was_enabled:
+            gc.enable()
 
 
 def read_node(str text, long pos, dict parser, tree_class=Tree, check_req=True):
-    """Return a node and the position in the text where it ends."""
+    """Return a node and the position in the text where it ends.
+
+    The nodes are read in a single pass with an explicit stack of open
+    nodes (instead of recursion), so trees of any depth can be parsed.
+    """
+    # text looks like '(a,(b,c)d)e', where any element can be a list of nodes
+    cdef long n = len(text)
+
+    open_nodes = []  # children read so far for each node whose "(" we entered
+
     pos = skip_spaces_and_comments(text, pos)
 
-    if text[pos] == '(':  # node has children
-        children, pos = read_nodes(text, pos, parser, tree_class)
-    else:  # node is a leaf
-        children = []
+    while True:
+        # Descend to the next leaf, opening all the nodes in the way.
+        while pos < n and text[pos] == '(':
+            open_nodes.append([])
+            pos = skip_spaces_and_comments(text, pos + 1)
+
+        props, pos = read_props(text, pos, True, parser,
+                                check_req or bool(open_nodes))
+        node = tree_class(props)
+
+        # Go up, closing all the nodes that end here.
+        while open_nodes:
+            open_nodes[-1].append(node)
+
+            assert pos < n and text[pos] in ',)', \
+                'nodes text ends missing a matching ")"'
+
+            if text[pos] == ',':
+                pos = skip_spaces_and_comments(text, pos + 1)
+                break  # the next sibling is read in the outer loop
+
+            children = open_nodes.pop()
+            props, pos = read_props(text, pos + 1, False, parser,
+                                    check_req or bool(open_nodes))
+            node = tree_class(props, children)
+        else:
+            return node, pos  # we closed the last open node (or had a leaf)
+
+
+# Reading files with many trees.
+
+cdef class NewickSplitter:
+    """Finds where each newick ends in a text that is given in blocks.
+
+    A newick ends at its first ";" that is not quoted or in a comment.
+    The state is kept between blocks, so a file can be read in pieces.
+    """
+
+    cdef Py_UCS4 quote  # quoting character we are in (or 0 if not quoted)
+    cdef bint in_comment  # are we inside a [comment]?
+
+    def __init__(self):
+        self.quote = 0
+        self.in_comment = False
+
+    def ends(self, str text):
+        """Return a list with the positions of the newick endings in text."""
+        cdef Py_ssize_t i
+        cdef Py_UCS4 c
+
+        positions = []
+        for i in range(len(text)):
+            c = text[i]
+            if self.quote:
+                if c == self.quote:
+                    self.quote = 0  # an escaped quote ('') just reopens it
+            elif self.in_comment:
+                if c == ']':
+                    self.in_comment = False
+            elif c == "'" or c == '"':
+                self.quote = c
+            elif c == '[':
+                self.in_comment = True
+            elif c == ';':
+                positions.append(i)
+
+        return positions
+
+
+def iter_newicks(fp, long skip=0, long block_size=1048576):
+    """Yield the newicks (texts ending in ";") read from file object fp.
+
+    Trees are separated by their final ";" and not by lines, so a
+    newick can span several lines and a line can have several newicks.
+
+    :param skip: Number of newicks to skip (without building them).
+    :param block_size: Number of characters to read from fp at a time.
+    """
+    splitter = NewickSplitter()
+    pending = []  # pieces of the current newick that come from previous blocks
+
+    while True:
+        block = fp.read(block_size)
+        if not block:
+            break
+
+        start = 0
+        for end in splitter.ends(block):
+            if skip > 0:  # fast path: just advance without building the text
+                skip -= 1
+            else:
+                pending.append(block[start:end+1])
+                yield ''.join(pending).strip()
+            pending = []
+            start = end + 1
+
+        if skip == 0:
+            pending.append(block[start:])
+        elif block[start:].strip():
+            pending = [block[start:]]  # will be skipped, but is not finished
+
+    if ''.join(pending).strip():
+        raise NewickError('text ends with no ";"')
+
+
+def count_newicks(fp, long block_size=1048576):
+    """Return the number of newicks in file object fp, without reading them."""
+    splitter = NewickSplitter()
+
+    n = 0
+    while True:
+        block = fp.read(block_size)
+        if not block:
+            return n
+        n += len(splitter.ends(block))
+
+
+def iter_load(fp, parser=None, tree_class=Tree, long skip=0,
+              processes=None, long chunk_size=100, pickled=False):
+    """Yield the trees read from a file object with many newicks.
+
+    The trees are parsed lazily, as they are requested. If processes
+    is given, they are parsed in chunks by that number of worker
+    processes (or by as many as cpus if processes=0), but they are
+    still yielded in the same order as they appear in the file.
+
+    :param fp: File object with the newicks, ending each one with ";".
+    :param parser: Parser used to read the newicks. If using processes,
+        it has to be the name of one of the predefined PARSERS.
+    :param tree_class: Class of the trees that are created.
+    :param skip: Number of trees to skip at the beginning of the file.
+    :param processes: Number of worker processes to use. If None, parse
+        all the trees in the current process.
+    :param chunk_size: Number of newicks sent to a worker at a time.
+    :param pickled: If True, yield the trees pickled (as bytes) instead.
+    """
+    newicks = iter_newicks(fp, skip)
 
-    props, pos = read_props(text, pos, not children, parser, check_req)
+    if processes is None:
+        for text in newicks:
+            yield load_chunk([text], parser, tree_class, pickled)[0]
+        return
 
-    return tree_class(props, children), pos
+    assert type(parser) is not dict, 'processes need a named parser'
 
+    processes = processes or None  # 0 means as many as cpus for mp.Pool
 
-def read_nodes(str text, long pos, dict parser, tree_class=Tree):
-    """Return a list of nodes and the position in the text where they end."""
-    # text looks like '(a,b,c)', where any element can be a list of nodes
-    nodes = []
-    while pos < len(text) and text[pos] != ')':
-        pos += 1  # advance from the separator: "(" or ","
+    with mp.Pool(processes) as pool:
+        max_pending = 2 * (processes or mp.cpu_count())
+        pending = deque()  # results that we will yield (in order)
 
-        node, pos = read_node(text, pos, parser, tree_class)
+        while True:
+            chunk = list(islice(newicks, chunk_size))
+            if chunk:
+                pending.append(pool.apply_async(load_chunk,
+                    (chunk, parser, tree_class, pickled)))
 
-        nodes.append(node)
+            if pending and (not chunk or len(pending) >= max_pending):
+                yield from pending.popleft().get()
+            elif not chunk:
+                break
 
-    assert pos < len(text), 'nodes text ends missing a matching ")"'
 
-    return nodes, pos+1  # it is +1 to advance from the closing ")"
+def load_chunk(newicks, parser=None, tree_class=Tree, pickled=False):
+    """Return a list of trees (or their pickles) from a list of newicks."""
+    parser = parser if type(parser) is dict else PARSERS[parser]
+    trees = [loads(text, parser, tree_class) for text in newicks]
+    return trees if not pickled else [pickle.dumps(t) for t in trees]
 
 
-def skip_spaces_and_comments(str text, long pos):
+cpdef long skip_spaces_and_comments(str text, long pos) except -1:
     """Return position in text after pos and all whitespaces and comments."""
     # text = '...  [this is a comment] node1...'
     #            ^-- pos               ^-- pos (returned)
-    while pos < len(text) and text[pos] in ' \t\r\n[':
-        if text[pos] == '[':
-            start = pos
-            if text[pos+1] == '&':  # special annotation
+    cdef long start, n = len(text)
+    cdef Py_UCS4 c
+
+    while pos < n:
+        c = text[pos]
+        if c == '[':
+            if pos + 1 < n and text[pos+1] == '&':  # special annotation
                 return pos
-            else:
-                pos = text.find(']', pos+1)  # skip comment
-                assert pos >= 0, f'unfinished comment at position {start}'
+            start = pos
+            pos = text.find(']', pos+1)  # skip comment
+            assert pos >= 0, f'unfinished comment at position {start}'
+        elif c != ' ' and c != '\t' and c != '\r' and c != '\n':
+            break
         pos += 1  # skip whitespace and comment endings
 
     return pos
 
 
-def skip_content(str text, long pos, endings=',);'):
+cdef inline bint is_in(Py_UCS4 c, str chars):
+    """Return True if character c is one of chars."""
+    cdef Py_UCS4 x
+    for x in chars:
+        if c == x:
+            return True
+    return False
+
+
+cpdef long skip_content(str text, long pos, str endings=',);') except -1:
     """Return the position where the content ends."""
+    cdef long n = len(text)
+    cdef Py_UCS4 c
+
     pos = skip_spaces_and_comments(text, pos)
 
-    if pos < len(text) and text[pos] in ["'", '"']:
-        pos = skip_quoted_name(text, pos)
+    if pos < n:
+        c = text[pos]
+        if c == "'" or c == '"':
+            pos = skip_quoted_name(text, pos)
 
-    while pos < len(text) and text[pos] not in endings:
+    while pos < n and not is_in(text[pos], endings):
         pos += 1
 
     return pos
 
 
-def read_content(str text, long pos, endings=',);'):
+cpdef tuple read_content(str text, long pos, str endings=',);'):
     """Return content starting at position pos in text, and where it ends."""
     # text = '...(node_1:0.5[&&NHX:p=a],...'  ->  'node_1:0.5[&&NHX:p=a]'
     #             ^-- pos              ^-- pos (returned)
-    start = pos
+    cdef long start = pos
     pos = skip_content(text, pos, endings)
     return text[start:pos], pos
 
 
-def skip_quoted_name(str text, long pos):
+cpdef long skip_quoted_name(str text, long pos) except -1:
     """Return the position where a quoted name ends."""
     # text = "... 'node ''2'' in tree' ..."
     #             ^-- pos             ^-- pos (returned)
-    start = pos
-    q = text[start]  # quoting character (can be ' or ")
+    cdef long start = pos, n = len(text)
+    cdef Py_UCS4 q = text[start]  # quoting character (can be ' or ")
 
-    while pos+1 < len(text):
+    while pos+1 < n:
         pos += 1
 
         if text[pos] == q:
             # Newick format escapes ' as '' (and we generalize to q -> qq)
-            if pos+1 >= len(text) or text[pos+1] != q:
+            if pos+1 >= n or text[pos+1] != q:
                 return pos+1  # that was the closing quote
             else:
                 pos += 1  # that was an escaped quote - skip
@@ -324,18 +542,66 @@ def skip_quoted_name(str text, long pos):
 
 def dumps(tree, props=None, parser=None, format_root_node=True, is_leaf_fn=None):
     """Return newick representation of the given tree."""
-    node_str = ('' if tree.is_root and not format_root_node else
-                content_repr(tree, props, parser))
-
-    if tree.children and (not is_leaf_fn or not is_leaf_fn(tree)):
-        children_str = ','.join(dumps(node, props, parser,
-                                      format_root_node, is_leaf_fn).rstrip(';')
-                                for node in tree.children)
-        return f'({children_str}){node_str};'
-    else:
-        return f'{node_str};'
+    return ''.join(iter_dumps(tree, props, parser, format_root_node, is_leaf_fn))
 
 
 def dump(tree, fp, props=None, parser=None, format_root_node=True, is_leaf_fn=None):
-    fp.write(dumps(tree, props, parser, format_root_node, is_leaf_fn))
+    """Write the newick representation of the given tree to file object fp."""
+    for chunk in iter_dumps(tree, props, parser, format_root_node, is_leaf_fn):
+        fp.write(chunk)
     fp.write('\n')
+
+
+def iter_dumps(tree, props=None, parser=None, format_root_node=True,
+               is_leaf_fn=None, long chunk_size=4096):
+    """Yield chunks of text that form the newick representation of the tree.
+
+    The tree is traversed iteratively and the text is yielded as soon as
+    it is ready, so it can go to a file, a socket, a gzip stream, etc.
+    without building the full newick (or the one of any subtree) in memory.
+
+    :param chunk_size: Number of pieces of text (one or two per node)
+        that are joined together in each chunk.
+    """
+    parser = parser if type(parser) is dict else PARSERS[parser]
+
+    def content(node):
+        return ('' if node.is_root and not format_root_node else
+                content_repr(node, props, parser))
+
+    def is_leaf(node):
+        return not node.children or (is_leaf_fn and is_leaf_fn(node))
+
+    if is_leaf(tree):
+        yield content(tree) + ';'
+        return
+
+    parts = ['(']  # pieces of text that we have not yielded yet
+    visiting = [(tree, iter(tree.children))]  # open nodes, and their children
+    needs_comma = False  # does the next node need a "," before it?
+    while visiting:
+        node, children = visiting[-1]
+        child = next(children, None)
+
+        if child is None:  # all its children are written: close the node
+            visiting.pop()
+            parts.append(')' + content(node))
+            needs_comma = True
+        else:
+            if needs_comma:
+                parts.append(',')
+
+            if is_leaf(child):
+                parts.append(content(child))
+                needs_comma = True
+            else:
+                parts.append('(')
+                visiting.append((child, iter(child.children)))
+                needs_comma = False
+
+        if len(parts) >= chunk_size:
+            yield ''.join(parts)
+            parts = []
+
+    parts.append(';')
+    yield ''.join(parts)
@@ -4,6 +4,7 @@ Read trees from a file in nexus format.
 
 # See https://en.wikipedia.org/wiki/Nexus_file
 
+import io
 import re
 
 from . import newick as newick_parser
@@ -15,41 +16,155 @@ class NexusError(Exception):
 
 
 def load(fp, parser=None):
-    return loads(fp.read(), parser=parser)
+    return dict(iter_trees(fp, parser=parser))
 
 
 def loads(text, parser=None):
-    return {name: newick_parser.loads(newick, parser=parser)
-            for name, newick in get_trees(text, parser=parser).items()}
+    return load(io.StringIO(text), parser=parser)
+
+
+def iter_trees(fp, parser=None, burnin=0, thin=1):
+    """Yield (name, tree) for the trees in a file object in nexus format.
+
+    The file is read as the trees are requested, so neither its full
+    text nor all its trees have to be in memory at once. The node names
+    in the TRANSLATE command are applied to the leaves of the trees
+    as they are parsed.
+
+    :param fp: File object (or any iterable of lines) with the contents
+        in nexus format.
+    :param parser: Parser used to read the newicks.
+    :param burnin: Number of trees to skip at the beginning (they are
+        not even parsed).
+    :param thin: Yield only one of every `thin` trees after the burn-in.
+    """
+    for name, newick, translate in iter_tree_commands(fp, burnin, thin):
+        tree = newick_parser.loads(newick, parser=parser)
+
+        if translate:
+            for node in tree.leaves():
+                if node.name in translate:
+                    node.name = translate[node.name]
+
+        yield name, tree
 
 
 def get_trees(text, parser=None):
     """Return trees as {name: newick} with all the name transformations done."""
-    if not re.match(r'^#NEXUS\s*\n', text, flags=re.I):
-        raise NexusError('text does not start with "#NEXUS"')
+    return {name: apply_translations(translate, newick, parser)
+            for name, newick, translate
+            in iter_tree_commands(io.StringIO(text))}
 
-    commands = get_section(text, 'TREES')
 
-    translate = {}
-    if 'TRANSLATE' in commands:
-        if len(commands['TRANSLATE']) != 1:
-            raise NexusError('multiple TRANSLATE commands')
-        pairs = commands['TRANSLATE'][0].split(',')
-        translate.update(pair.split(maxsplit=1) for pair in pairs)
+def iter_tree_commands(fp, burnin=0, thin=1):
+    """Yield (name, newick, translate) for the trees in a nexus file object.
 
-    trees = {}
-    for command in commands.get('TREE', []):
-        name_ugly, newick_ugly = command.split('=', maxsplit=1)
+    Here translate is the dict {name_in_newick: name} of the TREES block
+    where the tree is, and the newick is the original one (untranslated).
 
-        name = name_ugly.strip('\t\r\n "\'')
-        newick = newick_ugly.strip() + ';'
+    :param burnin: Number of trees to skip at the beginning.
+    :param thin: Yield only one of every `thin` trees after the burn-in.
+    """
+    lines = iter(fp)
 
-        if newick.startswith('['):  # remove possible [&U] or comment
-            newick = newick[newick.find(']')+1:].strip()
+    if not re.match(r'^#NEXUS\s*$', next(lines, ''), flags=re.I):
+        raise NexusError('text does not start with "#NEXUS"')
 
-        trees[name] = apply_translations(translate, newick, parser)
+    if burnin < 0 or thin < 1:
+        raise NexusError(f'invalid burnin ({burnin}) or thin ({thin})')
 
-    return trees
+    block = None  # name of the block (section) where we are
+    translate = {}
+    ntrees = 0  # number of tree commands seen
+    for statement in iter_statements(lines):
+        name, _, args = statement.partition(' ')  # command name and arguments
+        name, args = name.upper(), args.strip()
+
+        if name == 'BEGIN':
+            block = args.strip().upper()
+            translate = {}
+        elif name in ['END', 'ENDBLOCK']:
+            block = None
+        elif block != 'TREES':
+            continue
+        elif name == 'TRANSLATE':
+            if translate:
+                raise NexusError('multiple TRANSLATE commands')
+            unquote = newick_parser.unquote  # the names may be quoted
+            for pair in args.split(','):
+                key, value = pair.split(maxsplit=1)
+                translate[unquote(key)] = unquote(value)
+        elif name == 'TREE':
+            ntrees += 1
+            if ntrees > burnin and (ntrees - burnin - 1) % thin == 0:
+                yield get_name_and_newick(args) + (translate,)
+
+
+def get_name_and_newick(args):
+    """Return the name and newick of the tree given in the tree command args."""
+    # args looks like: 'tree1 = [&U] ((A,B),C)' or 'tree1 [&lnP=-5] = ...'
+    match = NAME.match(args)
+    if not match:
+        raise NexusError(f'missing "=" in tree command: {args[:50]}')
+
+    name_ugly, newick_ugly = match.group(1), args[match.end():]
+
+    name = COMMENTS.sub('', name_ugly).strip('\t\r\n "\'')
+    newick = newick_ugly.strip() + ';'
+
+    if newick.startswith('['):  # remove possible [&U] or comment
+        newick = newick[newick.find(']')+1:].strip()
+
+    return name, newick
+
+
+def iter_statements(lines):
+    """Yield the statements (text before each ";") in the given lines.
+
+    The leading comments and spaces are removed, and newlines and tabs
+    become spaces. A ";" in a comment ([...]) or quoted text does not
+    end a statement. An unfinished statement at the end is ignored.
+    """
+    parts = []  # pieces of the current statement
+    inside = None  # we may be inside a comment ("[") or a quote ("'" or '"')
+
+    for line in lines:
+        pos = 0
+        while True:
+            if inside:  # look for its end
+                end = line.find(']' if inside == '[' else inside, pos)
+            else:  # look for a ";" or the start of a comment or quote
+                match = SPECIAL.search(line, pos)
+                end = match.start() if match else -1
+
+            if end == -1:
+                parts.append(line[pos:])
+                break
+
+            if not inside and line[end] == ';':
+                parts.append(line[pos:end])
+                yield clean_statement(''.join(parts))
+                parts = []
+            else:
+                parts.append(line[pos:end+1])
+                inside = None if inside else line[end]
+
+            pos = end + 1
+
+
+NAME = re.compile(r'((?:[^=\[]|\[[^\]]*\])*)=')  # name (and comments) before "="
+
+COMMENTS = re.compile(r'\[[^\]]*\]')
+
+SPECIAL = re.compile(r'[;\[\'"]')  # characters that may change the context
+
+LEADING = re.compile(r'(\s|\[[^\]]*\])*')  # spaces and comments
+
+
+def clean_statement(statement):
+    """Return the statement without leading comments and with spaces only."""
+    statement = statement[LEADING.match(statement).end():]
+    return statement.replace('\n', ' ').replace('\r', ' ').replace('\t', ' ')
 
 
 def apply_translations(translate, newick, parser=None):
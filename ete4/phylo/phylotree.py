@@ -10,6 +10,7 @@ import warnings
 import itertools
 from collections import defaultdict
 from ete4 import Tree, SeqGroup, NCBITaxa, GTDBTaxa
+from ete4.core.index import prop_changed
 from .reconciliation import get_reconciled_tree
 from . import spoverlap
 
@@ -315,6 +316,7 @@ class PhyloTree(Tree):
             ('Species naming function present, cannot set species manually. '
              'Maybe call set_species_naming_function() first?')
         self.props['species'] = value
+        prop_changed(self, 'species')
 
     def __repr__(self):
         return "PhyloTree '%s' (%s)" % (self.name, hex(self.__hash__()))
@@ -343,6 +345,8 @@ class PhyloTree(Tree):
             else:
                 n.props.pop('_speciesFunction', None)
 
+        prop_changed(self, '_speciesFunction')  # and so "species" too
+
     def link_to_alignment(self, alignment, alg_format="fasta", **kwargs):
         missing_leaves = []
         missing_internal = []
@@ -548,7 +552,7 @@ class PhyloTree(Tree):
             for node in n2content:
                 sp_subtotal = sum([len(n2species[_ch]) for _ch in node.children])
                 if len(n2species[node]) > 1 and len(n2species[node]) != sp_subtotal:
-                    node.props['evoltype'] = 'D'
+                    node.add_prop('evoltype', 'D')
 
         sp_trees = get_subtrees(t, properties=map_properties, newick_only=newick_only)
 
@@ -566,7 +570,7 @@ class PhyloTree(Tree):
             for node in n2content:
                 sp_subtotal = sum([len(n2species[_ch]) for _ch in node.children])
                 if  len(n2species[node]) > 1 and len(n2species[node]) != sp_subtotal:
-                    node.props['evoltype'] = 'D'
+                    node.add_prop('evoltype', 'D')
                     dups += 1
                 elif node.is_leaf:
                     node._leaf = True
@@ -587,10 +591,7 @@ class PhyloTree(Tree):
             duplication nodes within the original tree are expected to
             contain the feature "evoltype=D".
         """
-        try:
-            t = self.copy()
-        except Exception:
-            t = self.copy("deepcopy")
+        t = self.copy("shallow")  # we only change its topology and props
 
         if autodetect_duplications:
             dups = 0
@@ -601,7 +602,7 @@ class PhyloTree(Tree):
             for node in n2content:
                 sp_subtotal = sum([len(n2species[_ch]) for _ch in node.children])
                 if  len(n2species[node]) > 1 and len(n2species[node]) != sp_subtotal:
-                    node.props['evoltype'] = 'D'
+                    node.add_prop('evoltype', 'D')
                     dups += 1
                 elif node.is_leaf:
                     node._leaf = True
@@ -625,7 +626,7 @@ class PhyloTree(Tree):
         elif species and (not isinstance(species, (set, frozenset))):
             raise TypeError("species argument should be a set (preferred), list or tuple")
 
-        prunned = self.copy("deepcopy") if return_copy else self
+        prunned = self.copy("shallow") if return_copy else self
         n2sp = prunned.get_cached_content('species')
         n2leaves = prunned.get_cached_content()
         is_expansion = lambda n: (len(n2sp[n])==1 and len(n2leaves[n])>1
@@ -30,6 +30,7 @@ DIR_BIN = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.dirname(DIR_BIN))  # so we can import ete w/o install
 
 from ete4 import newick, nexus, indent, operations as ops, treematcher as tm
+from ete4.core.index import invalidate
 from . import draw
 from .layout import Layout, BASIC_LAYOUT, update_style
 
@@ -288,6 +289,7 @@ def callback(tree_id):
         node_id, content = req_json()
         node = t[node_id]
         node.props = newick.get_props(content, is_leaf=True)
+        invalidate(node)  # its name may have changed
         ops.update_sizes_all(t)
         return {'message': 'ok'}
     except (AssertionError, newick.NewickError) as e:
@@ -579,6 +581,7 @@ def add_trees_from_request():
         for tree in trees:
             t = loads(tree['newick'], parser)
             ops.update_sizes_all(t)
+            t.build_index()  # to quickly find nodes and their ids
             name = tree['name'].replace(',', '_')  # "," is used for subtrees
             names[name] = name  # tree ids are already equal to their names...
             g_trees[name] = t
@@ -691,6 +694,9 @@ def add_tree(tree, name=None, layouts=None, extra_style=None):
 
     ops.update_sizes_all(tree)  # update all internal sizes (ready to draw!)
 
+    if tree.is_root:
+        tree.build_index()  # to quickly find nodes and their ids
+
     g_trees[name] = tree  # add tree to the global dict of trees
 
     g_layouts[name] = layouts if layouts is not None else [BASIC_LAYOUT]
@@ -790,6 +796,7 @@ if __name__ == '__main__':
         for tree in get_trees_from_file(args.FILE):
             t = loads(tree['newick'], args.parser)
             ops.update_sizes_all(t)
+            t.build_index()  # to quickly find nodes and their ids
             name = tree['name'].replace(',', '_')  # "," is used for subtrees
             g_trees[name] = t
             g_layouts[name] = [BASIC_LAYOUT]
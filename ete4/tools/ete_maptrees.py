@@ -52,6 +52,20 @@ def populate_args(maptrees_args_p):
                                action="store_true",
                                help=(""))
 
+    maptrees_args.add_argument("--support", choices=["standard", "transfer"],
+                               help=("only map the support of the reference branches, "
+                                     "reading the source files (each can have many trees) "
+                                     "once: 'standard' for the fraction of trees with the "
+                                     "branch, 'transfer' for the transfer bootstrap expectation"))
+
+    maptrees_args.add_argument("--rooted", dest="rooted",
+                               action="store_true",
+                               help=("with --support, consider the trees as rooted"))
+
+    maptrees_args.add_argument("--cpu", dest="cpu",
+                               type=int,
+                               help=("with --support, number of processes reading the source trees"))
+
 def get_splits(tree, min_support=None, target_attr="name", discard_root=False, ignore_multifurcations=False, target_species=None):
     branches = []
     node2content = tree.get_cached_content()
@@ -128,7 +142,42 @@ def map_dup_and_losses(reftree, source_branches, ref_leaves):
         #     raw_input()
         yield srcnode, refnode, isdup
 
+def run_support(args):
+    """Map the support of the source trees onto the reference trees."""
+    from .. import Tree
+    from ..parser import newick
+
+    def iter_src_newicks():
+        for fname in src_tree_iterator(args):
+            with open(fname) as fp:
+                yield from newick.iter_newicks(fp)
+
+    for rtree_nw in ref_tree_iterator(args):
+        rtree = Tree(open(rtree_nw), parser=args.ref_newick_format)
+
+        for node in rtree.traverse():
+            node.del_prop('support')  # so only the mapped supports remain
+
+        rtree.map_support(
+            iter_src_newicks(), unrooted=not args.rooted,
+            transfer=(args.support == 'transfer'),
+            parser=args.src_newick_format, processes=args.cpu)
+
+        if args.taboutput:
+            print('#%s\t%s' % ("ref branch", "support"))
+            for node in rtree.traverse():
+                if 'support' in node.props and not node.is_leaf:
+                    print('%s\t%s' % (node.write(parser=9), node.support))
+
+        if args.outtree:
+            rtree.write(outfile=args.outtree)
+        elif not args.taboutput:
+            print(rtree.write())
+
 def run(args):
+    if args.support:
+        return run_support(args)
+
     if args.treeko:
         from .. import PhyloTree
         tree_class = PhyloTree
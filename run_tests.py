@@ -12,13 +12,14 @@ from argparse import ArgumentParser
 # Test files to run.
 tests = {
     'fast': [
-        'test_tree.py',
-        'test_ncbiquery.py', 'test_gtdbquery.py',
+        'test_tree.py', 'test_compact.py', 'test_consensus.py',
+        'test_ncbiquery.py', 'test_gtdbquery.py', 'test_fuzzy.py',
         'test_interop.py', 'test_phylotree.py',
         'test_nexus.py', 'test_indent.py',
         'test_treematcher.py',
         'test_seqgroup.py', 'test_treediff.py',
-        'test_orthologs_group_delineation.py'],
+        'test_orthologs_group_delineation.py',
+        'test_import.py'],
     'interactive': [
         'test_treeview/test_all_treeview.py'],
     'slow': [
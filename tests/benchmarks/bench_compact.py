@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the compact (array-based) tree against the object tree.
+
+It compares the memory used and the time to traverse, iterate over
+the leaves, and compute common ancestors and distances. It also
+compares saving and opening the tree with the ete (pickle) format and
+the memory-mapped binary format::
+
+  python tests/benchmarks/bench_compact.py --leaves 1000000
+"""
+
+import gc
+import os
+import random
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from tempfile import TemporaryDirectory
+
+from ete4 import Tree
+from ete4.core.compact import CompactTree
+from ete4.parser import ete_format, ete_binary
+
+
+def measure(fn, *args):
+    """Return time and memory (MiB) that it takes to run fn(*args), and result."""
+    gc.collect()
+    t0 = time.perf_counter()
+    fn(*args)  # just to time it (tracemalloc slows things down a lot)
+    dt = time.perf_counter() - t0
+
+    gc.collect()
+    tracemalloc.start()
+    result = fn(*args)
+    mem = tracemalloc.get_traced_memory()[0] / 2**20
+    tracemalloc.stop()
+    return dt, mem, result
+
+
+def timeit(fn, *args):
+    """Return the time it takes to run fn(*args)."""
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+
+def main():
+    args = get_args()
+
+    random.seed(args.seed)
+
+    t = Tree()
+    t.populate(args.leaves, dist_fn=random.random)
+    nw = t.write()
+    del t
+
+    print(f'Tree with {args.leaves} leaves.\n')
+
+    dt, mem_t, t = measure(Tree, nw)
+    print(f'Tree from newick:                {dt:8.3f} s  {mem_t:9.1f} MiB')
+
+    dt, mem_ct, ct = measure(CompactTree.from_newick, nw)
+    print(f'CompactTree from newick:         {dt:8.3f} s  {mem_ct:9.1f} MiB')
+    print(f'  (arrays: {ct.nbytes / 2**20:.1f} MiB)')
+
+    print(f'CompactTree from Tree:           {timeit(CompactTree.from_tree, t):8.3f} s')
+    print(f'Tree from CompactTree:           {timeit(ct.to_tree):8.3f} s')
+
+    print()
+    print(f'Tree traverse (preorder):        {timeit(lambda: sum(1 for _ in t.traverse("preorder"))):8.3f} s')
+    print(f'CompactTree traverse (preorder): {timeit(lambda: sum(1 for _ in ct.traverse("preorder"))):8.3f} s')
+    print(f'Tree leaves:                     {timeit(lambda: list(t.leaves())):8.3f} s')
+    print(f'CompactTree leaves:              {timeit(ct.leaves):8.3f} s')
+
+    leaves_t = list(t.leaves())
+    leaves_ct = list(ct.leaves())
+    pairs = [random.sample(range(len(leaves_t)), 2) for _ in range(args.pairs)]
+
+    print()
+    dt = timeit(lambda: [t.get_distance(leaves_t[i], leaves_t[j]) for i, j in pairs])
+    print(f'Tree distances ({args.pairs} pairs):     {dt:8.3f} s')
+    dt = timeit(lambda: [ct.distance(leaves_ct[i], leaves_ct[j]) for i, j in pairs])
+    print(f'CompactTree distances:           {dt:8.3f} s')
+
+    print()
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'tree.etb')
+        print(f'ete format dumps:                {timeit(ete_format.dumps, t):8.3f} s')
+        text = ete_format.dumps(t)
+        print(f'ete format loads:                {timeit(ete_format.loads, text):8.3f} s')
+        print(f'binary dump:                     {timeit(ete_binary.dump, ct, path):8.3f} s')
+        print(f'binary load:                     {timeit(ete_binary.load, path):8.3f} s')
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--leaves', type=int, default=1_000_000, help='number of leaves')
+    add('--pairs', type=int, default=1000, help='pairs of leaves for distances')
+    add('--seed', type=int, default=1, help='random seed')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the different methods to copy a tree (and a PhyloTree)::
+
+  python tests/benchmarks/bench_copy.py --leaves 50000
+"""
+
+import random
+import time
+from argparse import ArgumentParser
+
+from ete4 import Tree, PhyloTree
+
+
+METHODS = ['shared', 'shallow', 'cpickle', 'newick', 'deepcopy']
+
+
+def timeit(fn, *args, **kwargs):
+    """Return the time it takes to run fn(*args, **kwargs)."""
+    t0 = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - t0
+
+
+def main():
+    args = get_args()
+
+    random.seed(args.seed)
+
+    t = Tree()
+    t.populate(args.leaves, dist_fn=random.random, support_fn=random.random)
+
+    pt = PhyloTree(t.write(), sp_naming_function=lambda name: name[:3])
+
+    print(f'Trees with {args.leaves} leaves.\n')
+    print('  method          Tree (s)   PhyloTree (s)')
+
+    for method in METHODS:
+        if method in args.skip:
+            continue
+        dt = timeit(t.copy, method)
+        dt_phylo = (timeit(pt.copy, method) if method != 'cpickle' else
+                    float('nan'))  # cannot pickle its species function
+        print(f'  {method:12}  {dt:10.3f}  {dt_phylo:10.3f}')
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--leaves', type=int, default=50000, help='number of leaves')
+    add('--seed', type=int, default=1, help='random seed')
+    add('--skip', nargs='*', default=[], choices=METHODS,
+        help='copy methods not to time')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
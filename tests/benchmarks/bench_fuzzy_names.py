@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the fuzzy search of taxa names::
+
+  python tests/benchmarks/bench_fuzzy_names.py --names 1000000
+  python tests/benchmarks/bench_fuzzy_names.py --dbfile ~/.local/share/ete/taxa.sqlite
+"""
+
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from ete4.ncbi_taxonomy.fuzzy import NameMatcher, get_peq, levenshtein_peq
+
+
+def timeit(fn, *args, **kwargs):
+    """Return the time it takes to run fn(*args, **kwargs)."""
+    t0 = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - t0
+
+
+def random_names(n):
+    """Return list of n random names that look a bit like taxa names."""
+    syllables = ['ba', 'ca', 'ci', 'co', 'la', 'li', 'ma', 'mi', 'na', 'ne',
+                 'ra', 'ri', 'sa', 'ta', 'ti', 'us', 'um', 'ae', 'ia', 'ph',
+                 'th', 'str', 'bac', 'ter', 'coc', 'myc', 'vir', 'spir']
+
+    def word(nmin, nmax):
+        return ''.join(random.choices(syllables, k=random.randint(nmin, nmax)))
+
+    genera = [word(2, 4).capitalize() for _ in range(max(10, n // 20))]
+
+    names = []
+    for _ in range(n):
+        genus = random.choice(genera)
+        if random.random() < 0.7:
+            names.append(f'{genus} {word(2, 4)}')
+        else:
+            names.append(f'{genus} sp. {word(1, 2).upper()}{random.randint(1, 9999)}')
+    return names
+
+
+def add_typos(name):
+    """Return name with one or two random edits."""
+    chars = list(name)
+    for _ in range(random.randint(1, 2)):
+        i = random.randrange(len(chars))
+        op = random.choice(['replace', 'delete', 'insert'])
+        if op == 'replace':
+            chars[i] = random.choice('abcdefghijklmnopqrstuvwxyz')
+        elif op == 'delete':
+            del chars[i]
+        else:
+            chars.insert(i, random.choice('abcdefghijklmnopqrstuvwxyz'))
+    return ''.join(chars)
+
+
+def search_all(names, query):
+    """Return the name most similar to query, comparing with all the names."""
+    peq = get_peq(query.lower())
+    return min(names, key=lambda name: levenshtein_peq(peq, len(query),
+                                                       name.lower()))
+
+
+def main():
+    args = get_args()
+
+    random.seed(args.seed)
+
+    t0 = time.perf_counter()
+    if args.dbfile:
+        db = sqlite3.connect(args.dbfile)
+        matcher = NameMatcher.from_db(db)
+        names = [name for name, in db.execute('SELECT spname FROM species')]
+    else:
+        names = random_names(args.names)
+        matcher = NameMatcher.from_names(names, range(len(names)))
+    dt = time.perf_counter() - t0
+
+    print(f'Index of {len(matcher)} names built in {dt:.2f} s.')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, 'names.npz')
+        print(f'  saving:  {timeit(matcher.save, fname):.3f} s '
+              f'({os.path.getsize(fname) / 1e6:.0f} MB)')
+        print(f'  loading: {timeit(NameMatcher.load, fname):.3f} s\n')
+
+    queries = [add_typos(name) for name in random.sample(names, args.queries)]
+
+    for k in [1, 10]:
+        dt = timeit(matcher.search_many, queries, k=k)
+        print(f'Search (k={k:2}):      {1000 * dt / len(queries):8.2f} ms per name')
+
+    if not args.no_old:
+        few = queries[:5]
+        dt = timeit(lambda: [search_all(names, query) for query in few])
+        print(f'Search (all names): {1000 * dt / len(few):8.2f} ms per name')
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--names', type=int, default=1000000, help='number of random names')
+    add('--dbfile', help='taxonomy database to take the names from')
+    add('--queries', type=int, default=200, help='number of names to search')
+    add('--seed', type=int, default=1, help='random seed')
+    add('--no-old', action='store_true',
+        help='do not time the search comparing with all the names')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
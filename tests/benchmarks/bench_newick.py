@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the newick parser and writer on big balanced and deep trees.
+
+Run it with the ete4 version to measure in the python path, for example::
+
+  python tests/benchmarks/bench_newick.py --leaves 1000000 --depth 100000
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from ete4.parser import newick
+
+
+def balanced_newick(nleaves):
+    """Return the newick of a balanced binary tree with nleaves leaves."""
+    nodes = [f'n{i}:1' for i in range(nleaves)]
+    while len(nodes) > 1:
+        pairs = [f'({a},{b}):1' for a, b in zip(nodes[::2], nodes[1::2])]
+        nodes = pairs + ([nodes[-1]] if len(nodes) % 2 else [])
+    return nodes[0] + ';'
+
+
+def annotated_newick(nleaves, nkeys):
+    """Return the newick of a balanced tree with nkeys NHX props per node."""
+    nhx = '[&&NHX:' + ':'.join(f'key{i}={i * 1.5}' for i in range(nkeys)) + ']'
+    return balanced_newick(nleaves).replace(':1', ':1' + nhx)
+
+
+def caterpillar_newick(depth):
+    """Return the newick of a ladder-like tree with the given depth."""
+    return ('(' * depth + 'n0:1,n1:1):1' +
+            ''.join(f',n{i}:1):1' for i in range(2, depth + 1)) + ';')
+
+
+def timeit(fn, *args):
+    """Return the time it takes to run fn(*args) and the result."""
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - t0, result
+
+
+def main():
+    args = get_args()
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10 * args.depth))
+
+    for name, text in [(f'balanced ({args.leaves} leaves)',
+                        balanced_newick(args.leaves)),
+                       (f'caterpillar (depth {args.depth})',
+                        caterpillar_newick(args.depth)),
+                       (f'annotated ({args.leaves // 10} leaves, NHX)',
+                        annotated_newick(args.leaves // 10, args.nhx_keys))]:
+        try:
+            dt, t = timeit(newick.loads, text)
+            print(f'{name:30s}  loads: {dt:8.3f} s  ({len(text)} chars)')
+        except (RecursionError, newick.NewickError) as e:
+            print(f'{name:30s}  loads: failed ({e.__class__.__name__})')
+            continue
+
+        try:
+            tracemalloc.start()
+            with open(os.devnull, 'w') as fp:
+                dt, _ = timeit(newick.dump, t, fp)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f'{"":30s}  dump:  {dt:8.3f} s  (peak {peak/2**20:.1f} MiB)')
+        except RecursionError as e:
+            tracemalloc.stop()
+            print(f'{"":30s}  dump:  failed ({e.__class__.__name__})')
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--leaves', type=int, default=1_000_000, help='leaves of the balanced tree')
+    add('--depth', type=int, default=100_000, help='depth of the caterpillar tree')
+    add('--nhx-keys', type=int, default=10, help='NHX props per annotated node')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark pruning a tree to keep small, medium and near-complete sets
+of its leaves, comparing Tree.prune() with the previous algorithm::
+
+  python tests/benchmarks/bench_prune.py --leaves 5000
+"""
+
+import random
+import time
+from argparse import ArgumentParser
+from functools import cmp_to_key
+
+from ete4 import Tree
+
+
+def timeit(fn, *args, **kwargs):
+    """Return the time it takes to run fn(*args, **kwargs)."""
+    t0 = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - t0
+
+
+def prune_old(tree, nodes, preserve_branch_length=False):
+    """Prune tree like Tree.prune() did before (for comparison)."""
+    def cmp_nodes(x, y):
+        if n2depth[x] > n2depth[y]:
+            return -1
+        elif n2depth[x] < n2depth[y]:
+            return 1
+        else:
+            return 0
+
+    to_keep = set(tree._translate_nodes(nodes))
+    start = tree.common_ancestor(to_keep)
+    node2path = {n: n.lineage() for n in to_keep}
+    to_keep.add(tree)
+
+    n2count = {}
+    n2depth = {}
+    for seed, path in node2path.items():
+        for visited_node in path:
+            if visited_node not in n2depth:
+                depth = visited_node.get_distance(visited_node, start,
+                                                  topological=True)
+                n2depth[visited_node] = depth
+            if visited_node is not seed:
+                n2count.setdefault(visited_node, set()).add(seed)
+
+    visitors2nodes = {}
+    for node, visitors in n2count.items():
+        if len(visitors)>1:
+            visitor_key = frozenset(visitors)
+            visitors2nodes.setdefault(visitor_key, set()).add(node)
+
+    for visitors, nodes in visitors2nodes.items():
+        if not (to_keep & nodes):
+            sorted_nodes = sorted(nodes, key=cmp_to_key(cmp_nodes))
+            to_keep.add(sorted_nodes[0])
+
+    for n in tree.descendants('postorder'):
+        if n not in to_keep:
+            if preserve_branch_length and n.dist is not None:
+                if len(n.children) == 1:
+                    if n.children[0].dist is not None:
+                        n.children[0].dist += n.dist
+                elif len(n.children) > 1 and n.up and n.up.dist is not None:
+                    n.up.dist += n.dist
+
+            n.delete(prevent_nondicotomic=False)
+
+
+def main():
+    args = get_args()
+
+    random.seed(args.seed)
+
+    t = Tree()
+    t.populate(args.leaves, names=[f'leaf{i}' for i in range(args.leaves)],
+               dist_fn=random.random)
+    names = list(t.leaf_names())
+
+    print(f'Tree with {args.leaves} leaves.\n')
+    print('  keep       new (s)' + ('' if args.no_old else '    old (s)'))
+
+    for fraction in [0.01, 0.5, 0.99]:
+        keep = random.sample(names, max(2, int(fraction * len(names))))
+
+        t_new = t.copy()
+        dt_new = timeit(t_new.prune, keep, preserve_branch_length=True)
+
+        if not args.no_old:
+            t_old = t.copy()
+            dt_old = timeit(prune_old, t_old, keep, preserve_branch_length=True)
+            assert t_old.write() == t_new.write(), 'different results'
+            print(f'  {len(keep):7}  {dt_new:8.3f}   {dt_old:8.3f}')
+        else:
+            print(f'  {len(keep):7}  {dt_new:8.3f}')
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--leaves', type=int, default=5000, help='number of leaves')
+    add('--seed', type=int, default=1, help='random seed')
+    add('--no-old', action='store_true', help='do not time the old algorithm')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the comparison of trees based on their bipartitions.
+
+It times the Robinson-Foulds distance (rooted and unrooted), the
+comparison of trees, their edges and their topology ids::
+
+  python tests/benchmarks/bench_rf.py --leaves 5000
+"""
+
+import random
+import time
+from argparse import ArgumentParser
+
+from ete4 import Tree
+
+
+def timeit(fn, *args, **kwargs):
+    """Return the time it takes to run fn(*args, **kwargs)."""
+    t0 = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - t0
+
+
+def main():
+    args = get_args()
+
+    random.seed(args.seed)
+
+    names = [f'leaf{i}' for i in range(args.leaves)]
+    t1, t2 = Tree(), Tree()
+    t1.populate(args.leaves, names=names, dist_fn=random.random,
+                support_fn=random.random)
+    t2.populate(args.leaves, names=names, dist_fn=random.random,
+                support_fn=random.random)
+
+    print(f'Trees with {args.leaves} leaves.\n')
+
+    dt = timeit(t1.robinson_foulds, t2)
+    print(f'Robinson-Foulds (rooted):   {dt:8.3f} s')
+    dt = timeit(t1.robinson_foulds, t2, unrooted_trees=True)
+    print(f'Robinson-Foulds (unrooted): {dt:8.3f} s')
+    dt = timeit(t1.robinson_foulds, t2, min_support_t1=0.5, min_support_t2=0.5)
+    print(f'Robinson-Foulds (support):  {dt:8.3f} s')
+    dt = timeit(t1.compare, t2, unrooted=True)
+    print(f'compare (unrooted):         {dt:8.3f} s')
+
+    print()
+    print(f'edges:                      {timeit(lambda: list(t1.edges())):8.3f} s')
+    print(f'topology id:                {timeit(t1.get_topology_id):8.3f} s')
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--leaves', type=int, default=5000, help='number of leaves')
+    add('--seed', type=int, default=1, help='random seed')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the mapping of the support of many trees onto a reference tree::
+
+  python tests/benchmarks/bench_support.py --leaves 2000 --trees 20
+"""
+
+import random
+import time
+from argparse import ArgumentParser
+
+from ete4 import Tree
+from ete4.tools.ete_maptrees import get_splits, map_branches
+
+
+def timeit(fn, *args, **kwargs):
+    """Return the time it takes to run fn(*args, **kwargs)."""
+    t0 = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - t0
+
+
+def map_support_sets(tree, trees):
+    """Map support like ete_maptrees does without --support (sets of names)."""
+    ref_species, ref_branches = get_splits(tree, ignore_multifurcations=True)
+    for t in trees:
+        src_species, src_branches = get_splits(t, target_species=ref_species)
+        for refnode, matches in map_branches(ref_branches, src_branches,
+                                             ref_species, src_species):
+            pass
+
+
+def main():
+    args = get_args()
+
+    random.seed(args.seed)
+
+    names = [f'n{i}' for i in range(args.leaves)]
+
+    tree = Tree()
+    tree.populate(args.leaves, names=names)
+
+    trees = []
+    for _ in range(args.trees):
+        t = Tree()
+        t.populate(args.leaves, names=names)
+        trees.append(t)
+
+    print(f'Mapping {args.trees} trees onto a tree with {args.leaves} leaves.\n')
+
+    dt = timeit(tree.map_support, trees)
+    print(f'  standard support:  {dt:.3f} s')
+
+    dt = timeit(tree.map_support, trees, transfer=True)
+    print(f'  transfer support:  {dt:.3f} s')
+
+    if not args.no_old:
+        dt = timeit(map_support_sets, tree, trees)
+        print(f'  with sets:         {dt:.3f} s')
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--leaves', type=int, default=2000, help='number of leaves')
+    add('--trees', type=int, default=20, help='number of trees to map')
+    add('--seed', type=int, default=1, help='random seed')
+    add('--no-old', action='store_true',
+        help='do not time the old mapping (with sets of names)')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the batch queries to the NCBI and GTDB taxonomy databases::
+
+  python tests/benchmarks/bench_taxa_queries.py --sizes 1000 100000 1000000
+"""
+
+import random
+import sqlite3
+import time
+from argparse import ArgumentParser
+
+from ete4.ncbi_taxonomy import ncbiquery
+from ete4.gtdb_taxonomy import gtdbquery
+
+
+def timeit(fn, *args, **kwargs):
+    """Return the time it takes to run fn(*args, **kwargs)."""
+    t0 = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - t0
+
+
+def get_rank_single_query(db, taxids):
+    """Return dict taxid -> rank, like before, with a single "IN (...)"."""
+    query = ','.join('"%s"' % v for v in set(taxids))
+    cmd = 'SELECT taxid, rank FROM species WHERE taxid IN (%s);' % query
+    return dict(db.execute(cmd).fetchall())
+
+
+def bench(name, queries, size, chunk_sizes):
+    """Print the times of the given queries for each chunk size."""
+    print(f'{name} with {size} values:')
+    for qname, taxa, fn, args in queries:
+        times = []
+        for chunk_size in chunk_sizes:
+            taxa.chunk_size = chunk_size
+            times.append(f'{timeit(fn, *args):8.3f} s')
+        print(f'  {qname:26} ' + '  '.join(times))
+
+
+def main():
+    args = get_args()
+
+    random.seed(args.seed)
+
+    chunk_sizes = args.chunk_sizes
+    print('Chunk sizes: ' + '  '.join(f'{c:>10}' for c in chunk_sizes) + '\n')
+
+    ncbi = ncbiquery.NCBITaxa(args.ncbi_dbfile, update=False)
+    ncbi_taxids = [t for t, in ncbi.db.execute('SELECT taxid FROM species')]
+
+    gtdb = gtdbquery.GTDBTaxa(args.gtdb_dbfile)
+    gtdb_taxids = [t for t, in gtdb.db.execute('SELECT taxid FROM species')]
+
+    for size in args.sizes:
+        taxids = random.choices(ncbi_taxids, k=size)
+        names = list(ncbi.get_taxid_translator(taxids).values())
+
+        bench('NCBI', [
+            ('get_rank', ncbi, ncbi.get_rank, [taxids]),
+            ('get_lineage_translator', ncbi, ncbi.get_lineage_translator, [taxids]),
+            ('get_taxid_translator', ncbi, ncbi.get_taxid_translator, [taxids]),
+            ('get_name_translator', ncbi, ncbi.get_name_translator, [names]),
+            ('_translate_merged', ncbi, ncbi._translate_merged, [taxids])],
+              size, chunk_sizes)
+
+        if not args.no_old:
+            try:
+                dt = f'{timeit(get_rank_single_query, ncbi.db, taxids):8.3f} s'
+            except sqlite3.OperationalError as e:
+                dt = f'fails ({e})'
+            print(f'  {"get_rank (single query)":26} {dt}')
+
+        taxids = random.choices(gtdb_taxids, k=size)
+        names = list(gtdb._get_taxid_translator(taxids).values())
+
+        bench('GTDB', [
+            ('get_rank', gtdb, gtdb.get_rank, [names]),
+            ('_get_lineage_translator', gtdb, gtdb._get_lineage_translator, [taxids]),
+            ('_get_taxid_translator', gtdb, gtdb._get_taxid_translator, [taxids]),
+            ('_get_name_translator', gtdb, gtdb._get_name_translator, [names])],
+              size, chunk_sizes)
+
+        print()
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--ncbi-dbfile', default=ncbiquery.DEFAULT_TAXADB,
+        help='NCBI taxonomy database')
+    add('--gtdb-dbfile', default=gtdbquery.DEFAULT_GTDBTAXADB,
+        help='GTDB taxonomy database')
+    add('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000],
+        help='number of values to query')
+    add('--chunk-sizes', type=int, nargs='+', default=[100, 500, 5000],
+        help='maximum number of values per sql query')
+    add('--seed', type=int, default=1, help='random seed')
+    add('--no-old', action='store_true',
+        help='do not time the old query (with all the values at once)')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Tests for the compact (array-based) representation of trees.
+"""
+
+import random
+import unittest
+from tempfile import NamedTemporaryFile
+
+import numpy as np
+
+from ete4 import Tree, PhyloTree
+from ete4.core.compact import CompactTree, TOPOLOGY
+from ete4.parser import ete_binary
+from ete4.parser.newick import NewickError
+
+
+class TestCompactTree(unittest.TestCase):
+
+    def setUp(self):
+        self.nw = '((a:1,b:2[&&NHX:x=3])c:3,(d:4,e)f:1)r;'
+        self.t = Tree(self.nw, parser=1)
+        self.ct = CompactTree.from_tree(self.t)
+
+    def test_topology(self):
+        ct = self.ct
+        self.assertEqual(ct.nnodes, 7)
+        self.assertEqual(len(ct), 4)
+        self.assertEqual(list(ct.parent), [-1, 0, 1, 1, 0, 4, 4])
+        self.assertEqual(list(ct.size), [7, 3, 1, 1, 3, 1, 1])
+        self.assertEqual(list(ct.depth), [0, 1, 2, 2, 1, 2, 2])
+        self.assertEqual(ct.children(0), [1, 4])
+        self.assertEqual(ct.children(2), [])
+        self.assertEqual(list(ct.ancestors(5)), [4, 0])
+        self.assertTrue(ct.is_ancestor(1, 3))
+        self.assertFalse(ct.is_ancestor(1, 5))
+        self.assertEqual(list(ct.leaves()), [2, 3, 5, 6])
+        self.assertEqual(list(ct.descendants(1)), [2, 3])
+        self.assertEqual(ct.leaf_names(), ['a', 'b', 'd', 'e'])
+        self.assertEqual(ct.leaf_names(4), ['d', 'e'])
+
+        with self.assertRaises(ValueError):
+            ct.parent[1] = 3  # it is read-only
+
+        # The arrays given to make a compact tree stay writeable.
+        parent = np.array([-1, 0, 0])
+        dist = np.array([np.nan, 1.0, 2.0])
+        ct = CompactTree(parent, {'dist': dist})
+        arrays = {name: getattr(ct, name).copy() for name in TOPOLOGY}
+        ct2 = CompactTree.from_arrays(arrays, ct.props)
+        parent[1] = dist[1] = arrays['root_dist'][1] = 0
+        self.assertFalse(ct.parent.flags.writeable)
+        self.assertFalse(ct.dist.flags.writeable)
+        self.assertFalse(ct2.root_dist.flags.writeable)
+
+    def test_traverse(self):
+        names = lambda nodes: [self.ct.props['name'][i] for i in nodes]
+        for strategy in ['preorder', 'postorder', 'levelorder']:
+            self.assertEqual(names(self.ct.traverse(strategy)),
+                             [n.name for n in self.t.traverse(strategy)])
+        self.assertEqual(names(self.ct.traverse('postorder', 4)), ['d', 'e', 'f'])
+
+    def test_props(self):
+        ct = self.ct
+        self.assertTrue(np.isnan(ct.dist[0]))
+        self.assertEqual(ct.dist[1], 3)
+        self.assertEqual(ct.get_prop(3, 'x'), '3')
+        self.assertEqual(ct.get_prop(2, 'x'), None)
+        self.assertEqual(ct.get_prop(6, 'dist', 'missing'), 'missing')
+        self.assertEqual(list(ct.root_dist), [0, 3, 4, 5, 1, 5, 1])
+
+    def test_distances(self):
+        t, ct = self.t, self.ct
+        for n1, n2 in [(2, 3), (2, 5), (1, 5), (0, 3), (5, 5)]:
+            name1, name2 = ct.props['name'][n1], ct.props['name'][n2]
+            self.assertEqual(ct.distance(n1, n2),
+                             t.get_distance(name1, name2))
+            self.assertEqual(ct.distance(n1, n2, topological=True),
+                             t.get_distance(name1, name2, topological=True))
+        self.assertEqual(ct.common_ancestor(2, 3), 1)
+        self.assertEqual(ct.common_ancestor(3, 5), 0)
+        self.assertEqual(ct.common_ancestor(1, 3), 1)
+
+    def test_conversions(self):
+        nw = self.t.write(props=None, parser=1, format_root_node=True)
+
+        self.assertEqual(self.ct.to_tree().write(props=None, parser=1,
+                                                 format_root_node=True), nw)
+        self.assertEqual(self.ct.to_tree(4).write(parser=1), '(d:4,e);')
+        self.assertEqual(type(self.ct.to_tree(tree_class=PhyloTree)), PhyloTree)
+
+        ct = CompactTree.from_newick(self.nw, parser=1)
+        for pname in ['name', 'dist', 'x']:
+            self.assertEqual(list(ct.props[pname].astype(str)),
+                             list(self.ct.props[pname].astype(str)))
+
+        self.assertRaises(NewickError, CompactTree.from_newick, '((a,b);')
+
+        # Typed columns.
+        t = Tree(self.nw, parser=1)
+        for i, node in enumerate(t.traverse()):
+            node.props['i'] = i
+        ct = CompactTree.from_tree(t)
+        self.assertEqual(ct.props['i'].dtype, np.int64)
+        self.assertEqual(ct.to_tree()['f'].props['i'], 2)
+
+    def test_random_trees(self):
+        random.seed(1)
+        for _ in range(5):
+            t = Tree()
+            t.populate(50, dist_fn=random.random)
+            ct = CompactTree.from_tree(t)
+            self.assertEqual(ct.to_tree().write(), t.write())
+            leaves = list(t.leaves())
+            i1, i2 = random.sample(list(ct.leaves()), 2)
+            n1 = t[ct.props['name'][i1]]
+            n2 = t[ct.props['name'][i2]]
+            self.assertAlmostEqual(ct.distance(i1, i2), t.get_distance(n1, n2))
+
+
+class TestEteBinary(unittest.TestCase):
+
+    def test_dump_and_load(self):
+        t = Tree('((a:1,b:2[&&NHX:x=3])c:3,(d:4,e)f:1)r;', parser=1)
+        t['a'].props['lst'] = [1, 'two']
+        for i, node in enumerate(t.traverse()):
+            node.props['i'] = i
+
+        with NamedTemporaryFile() as fp:
+            ete_binary.dump(t, fp.name)
+            ct = ete_binary.load(fp.name)
+
+            self.assertEqual(ct.nnodes, 7)
+            self.assertEqual(ct.leaf_names(), ['a', 'b', 'd', 'e'])
+            self.assertEqual(ct.props['i'].dtype, np.int64)
+            self.assertEqual(ct.get_prop(2, 'lst'), [1, 'two'])
+            self.assertEqual(ct.get_prop(2, 'x'), None)
+            self.assertEqual(ct.get_prop(3, 'x'), '3')
+            self.assertEqual(ct.props['name'][-1], 'e')
+            self.assertEqual(ct.distance(2, 5), t.get_distance('a', 'd'))
+
+            self.assertEqual(ct.to_tree().write(props=None, parser=1),
+                             t.write(props=None, parser=1))
+            self.assertEqual(ct.to_tree(4).write(props=['i'], parser=1),
+                             '(d:4[&&NHX:i=5],e[&&NHX:i=6]);')
+
+            # It can be saved again (with the memory-mapped columns).
+            with NamedTemporaryFile() as fp2:
+                ete_binary.dump(ct, fp2.name)
+                ct2 = ete_binary.load(fp2.name)
+                self.assertEqual(ct2.to_tree().write(props=None),
+                                 t.write(props=None))
+
+    def test_bad_files(self):
+        with NamedTemporaryFile() as fp:
+            fp.write(b'(a,b);' * 10)
+            fp.flush()
+            self.assertRaises(ete_binary.EteBinaryError,
+                              ete_binary.load, fp.name)
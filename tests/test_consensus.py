@@ -0,0 +1,239 @@
+"""
+Tests for the consensus of many trees.
+"""
+
+import random
+import unittest
+
+from ete4 import Tree
+from ete4.core import consensus as cs
+from ete4.core.consensus import ConsensusError
+
+
+NEWICKS = [
+    '((((a:1,b:1):1,c:1):1,d:1):1,e:1);',
+    '((((a:2,b:2):2,c:2):2,e:2):2,d:2);',
+    '((((a:3,c:3):3,b:3):3,d:3):3,e:3);',
+    '(((a:1,b:1):1,(c:1,d:1):1):1,e:1);']
+
+
+def get_trees():
+    return [Tree(nw) for nw in NEWICKS]
+
+
+def clusters(tree):
+    """Return the set of (non-trivial) clusters of the given tree."""
+    return {frozenset(node.leaf_names()) for node in tree.traverse()
+            if not node.is_leaf and not node.is_root}
+
+
+class TestConsensus(unittest.TestCase):
+
+    def test_counts(self):
+        counts = cs.count_splits(get_trees(), unrooted=False)
+
+        self.assertEqual(counts.ntrees, 4)
+        self.assertEqual(counts.names, ['a', 'b', 'c', 'd', 'e'])
+
+        bits = {name: 1 << i for i, name in enumerate(counts.names)}
+        ab = bits['a'] | bits['b']
+        abc = ab | bits['c']
+        self.assertEqual(counts.counts[ab], 3)
+        self.assertEqual(counts.counts[abc], 3)
+        self.assertEqual(counts.support(ab), 0.75)
+        self.assertEqual(counts.lengths[ab], 1 + 2 + 1)
+
+    def test_rooted(self):
+        t_strict = cs.consensus(get_trees(), mode='strict', unrooted=False)
+        self.assertEqual(clusters(t_strict), set())
+
+        t_major = cs.consensus(get_trees(), mode='majority', unrooted=False)
+        self.assertEqual(clusters(t_major), {frozenset('ab'),
+                                             frozenset('abc'),
+                                             frozenset('abcd')})
+
+        supports = {frozenset(node.leaf_names()): node.support
+                    for node in t_major.traverse() if not node.is_leaf}
+        self.assertEqual(supports[frozenset('ab')], 0.75)
+        self.assertEqual(supports[frozenset('abcd')], 0.75)
+
+        node_ab = t_major.common_ancestor(['a', 'b'])
+        self.assertEqual(node_ab.dist, (1 + 2 + 1) / 3)  # mean length
+
+    def test_unrooted(self):
+        # Unrooted, "de" (same as "abc") is in all the trees but one.
+        t = cs.consensus(get_trees(), mode='strict')
+        self.assertEqual(clusters(t), set())
+
+        t = cs.consensus(get_trees(), mode='majority')
+        self.assertEqual(set(t.leaf_names()), set('abcde'))
+        self.assertEqual(len(clusters(t)), 2)  # splits ab|cde and de|abc
+
+    def test_greedy(self):
+        counts = cs.count_splits(get_trees(), unrooted=False)
+
+        majority = set(cs.select_splits(counts, 'majority'))
+        greedy = cs.select_splits(counts, 'greedy')
+        self.assertTrue(majority <= set(greedy))
+
+        for s1 in greedy:
+            for s2 in greedy:
+                self.assertTrue(cs.compatible(s1, s2))
+
+        t = cs.build_tree(counts, greedy)
+        self.assertEqual(len(clusters(t)), 3)  # fully resolved rooted tree
+
+    def test_same_trees(self):
+        random.seed(1)
+        t0 = Tree()
+        t0.populate(50, dist_fn=random.random)
+
+        for unrooted in [True, False]:
+            for mode in ['strict', 'majority', 'greedy']:
+                trees = (t0.copy() for _ in range(5))  # a generator
+                t = cs.consensus(trees, mode, unrooted=unrooted)
+                rf, rf_max, *_ = t.robinson_foulds(t0, unrooted_trees=unrooted)
+                self.assertEqual(rf, 0)
+                self.assertTrue(all(n.support == 1 for n in t.traverse()
+                                    if not n.is_leaf and not n.is_root))
+
+    def test_newicks(self):
+        counts = cs.count_splits(get_trees())
+
+        counts_serial = cs.count_splits_newicks(NEWICKS)
+        counts_parallel = cs.count_splits_newicks(NEWICKS * 3,
+                                                  processes=2, chunk_size=2)
+
+        self.assertEqual(counts_serial.counts, counts.counts)
+        self.assertEqual(counts_parallel.ntrees, 12)
+        self.assertEqual(counts_parallel.counts,
+                         {split: 3 * n for split, n in counts.counts.items()})
+
+    def test_max_splits(self):
+        random.seed(2)
+        trees = []
+        for _ in range(20):
+            t = Tree()
+            t.populate(20, names=[f'n{i}' for i in range(20)])
+            trees.append(t)
+
+        counts = cs.count_splits(trees, max_splits=10)
+        self.assertLessEqual(len(counts.counts), 10)
+        self.assertEqual(counts.ntrees, 20)
+
+    def test_errors(self):
+        with self.assertRaises(ConsensusError):
+            cs.consensus([Tree('((a,b),c);'), Tree('((a,b),d);')])
+
+        with self.assertRaises(ConsensusError):
+            cs.consensus([Tree('((a,b),c);'), Tree('((a,b),(c,d));')])
+
+        with self.assertRaises(ConsensusError):
+            cs.consensus(get_trees(), mode='wrong')
+
+        with self.assertRaises(ConsensusError):
+            cs.consensus(get_trees(), mode='majority', threshold=0.3)
+
+        with self.assertRaises(ConsensusError):
+            cs.consensus([])
+
+
+def random_trees(n, ntrees, seed):
+    random.seed(seed)
+    names = [f'x{i}' for i in range(n)]
+    trees = []
+    for _ in range(ntrees):
+        t = Tree()
+        t.populate(n, names=names)
+        trees.append(t)
+    return trees
+
+
+def expected_supports(tree, trees, transfer):
+    """Return dict node -> support, computed with sets of leaf names."""
+    all_names = set(tree.leaf_names())
+    n = len(all_names)
+
+    def sides(t):
+        return [set(node.leaf_names()) for node in t.traverse() if node is not t]
+
+    supports = {}
+    for node in tree.traverse():
+        if node is tree or node.is_leaf:
+            continue
+
+        names = set(node.leaf_names())
+        p = min(len(names), n - len(names))
+        if p < 2:
+            continue  # trivial split
+
+        values = []
+        for t in trees:
+            if transfer:
+                d = min(min(len(names ^ s), n - len(names ^ s)) for s in sides(t))
+                values.append(1 - d / (p - 1))
+            else:
+                values.append(any(s == names or s == all_names - names
+                                  for s in sides(t)))
+        supports[node] = sum(values) / len(values)
+
+    return supports
+
+
+class TestSupport(unittest.TestCase):
+
+    def test_support(self):
+        for seed in range(10):
+            t, *trees = random_trees(12, 6, seed)
+            trees.append(t.copy())
+
+            for transfer in [False, True]:
+                cs.map_support(t, trees, prop='sup', transfer=transfer)
+
+                expected = expected_supports(t, trees, transfer)
+                result = {node: node.props['sup'] for node in t.traverse()
+                          if 'sup' in node.props}
+                self.assertEqual(result.keys(), expected.keys())
+                for node in expected:
+                    self.assertAlmostEqual(result[node], expected[node])
+
+    def test_same_trees(self):
+        t, = random_trees(30, 1, 1)
+        t.map_support([t.copy() for _ in range(3)], transfer=True)
+        self.assertTrue(all(n.support == 1 for n in t.traverse()
+                            if not n.is_leaf and not n.is_root))
+
+    def test_rooted(self):
+        t = Tree('(((a,b),c),(d,e));')
+        t.map_support(['(((a,b),c),(d,e));', '(((a,c),b),(d,e));'],
+                      unrooted=False)
+        self.assertEqual(t['a'].up.support, 0.5)
+        self.assertEqual(t['a'].up.up.support, 1)
+        self.assertEqual(t['d'].up.support, 1)
+
+    def test_processes(self):
+        t, *trees = random_trees(20, 7, 2)
+        newicks = [tree.write() for tree in trees]
+
+        for transfer in [False, True]:
+            smap = cs.map_support(t, newicks, transfer=transfer)
+            smap_parallel = cs.map_support(t, newicks, transfer=transfer,
+                                           processes=2, chunk_size=3)
+            self.assertEqual(smap_parallel.ntrees, len(newicks))
+            for s1, s2 in zip(smap_parallel.supports(), smap.supports()):
+                self.assertAlmostEqual(s1, s2)
+
+    def test_errors(self):
+        t = Tree('((a,b),(c,d));')
+
+        with self.assertRaises(ConsensusError):
+            t.map_support(['((a,b),(c,e));'])
+
+        with self.assertRaises(ConsensusError):
+            t.map_support(['((a,b),c);'])
+
+        with self.assertRaises(ConsensusError):
+            t.map_support(['((a,b),(c,d));'], unrooted=False, transfer=True)
+
+        with self.assertRaises(ConsensusError):
+            t.map_support([])
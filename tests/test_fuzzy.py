@@ -0,0 +1,128 @@
+"""
+Tests for the fuzzy matching of taxa names.
+"""
+
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+
+from ete4.ncbi_taxonomy import fuzzy
+from ete4.ncbi_taxonomy.fuzzy import NameMatcher
+
+
+NAMES = ['Homo sapiens', 'Homo', 'Homininae', 'Pan troglodytes',
+         'Mus musculus', 'Escherichia coli', 'Bacteria', 'Bacteria']
+TAXIDS = [9606, 9605, 207598, 9598, 10090, 562, 2, 629395]
+
+
+def edit_distance(a, b):
+    """Return the edit distance between a and b (with dynamic programming)."""
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j-1] + 1,
+                               previous[j-1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+class TestFuzzy(unittest.TestCase):
+
+    def test_levenshtein(self):
+        random.seed(1)
+        for _ in range(2000):
+            a = ''.join(random.choices('abc', k=random.randint(0, 12)))
+            b = ''.join(random.choices('abc', k=random.randint(0, 12)))
+            self.assertEqual(fuzzy.levenshtein(a, b), edit_distance(a, b))
+
+        self.assertEqual(fuzzy.levenshtein('Homo sapiens', 'homo sapiens'), 1)
+        self.assertEqual(fuzzy.levenshtein('a' * 100, 'b' * 100), 100)
+
+    def test_search(self):
+        matcher = NameMatcher.from_names(NAMES, TAXIDS, chunk_size=3)
+
+        self.assertEqual(len(matcher), len(NAMES))
+        self.assertEqual([matcher.name(i) for i in range(len(NAMES))], NAMES)
+
+        self.assertEqual(matcher.search('homo sapiens', k=1),
+                         [(9606, 'Homo sapiens', 1)])
+
+        taxid, name, score = matcher.search('Homo sapeins', k=1)[0]
+        self.assertEqual((taxid, name), (9606, 'Homo sapiens'))
+        self.assertAlmostEqual(score, 1 - 2/12)
+
+        results = matcher.search('Homo', k=3)
+        self.assertEqual(results[0], (9605, 'Homo', 1))
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(s1 >= s2 for (_, _, s1), (_, _, s2)
+                            in zip(results, results[1:])))
+
+        self.assertEqual(matcher.search('Homo', k=3, sim=0.9),
+                         [(9605, 'Homo', 1)])
+        self.assertEqual(matcher.search('Bacteria', k=5, sim=1),
+                         [(2, 'Bacteria', 1), (629395, 'Bacteria', 1)])
+        self.assertEqual(matcher.search('xyz'), [])
+        self.assertEqual(matcher.search(''), [])
+
+    def test_search_many(self):
+        matcher = NameMatcher.from_names(NAMES, TAXIDS)
+
+        names = ['Escherichia colli', 'mus muscullus', 'zzz']
+        results = matcher.search_many(names, k=1, sim=0.8)
+        self.assertEqual(results, {
+            'Escherichia colli': [(562, 'Escherichia coli', 1 - 1/17)],
+            'mus muscullus': [(10090, 'Mus musculus', 1 - 1/13)],
+            'zzz': []})
+
+    def test_synonyms(self):
+        # Scientific names come before equally similar synonyms.
+        matcher = NameMatcher.from_names(['Homo', 'Hamo', 'Homo'],
+                                         [1, 2, 3], nspecies=2)
+        self.assertEqual(matcher.search('homo', k=2),
+                         [(1, 'Homo', 1), (3, 'Homo', 1)])
+
+    def test_many_names(self):
+        random.seed(2)
+        words = [''.join(random.choices('abcdefghijklmnopqrstuvwxyz', k=8))
+                 for _ in range(2000)]
+        names = [f'{w1.capitalize()} {w2}' for w1, w2 in zip(words, words[1:])]
+        matcher = NameMatcher.from_names(names, range(len(names)),
+                                         chunk_size=500)
+
+        whole = NameMatcher.from_names(names, range(len(names)))  # 1 chunk
+        for array in ['grams', 'starts', 'postings']:
+            self.assertEqual(getattr(matcher, array).tolist(),
+                             getattr(whole, array).tolist())
+
+        for taxid in random.sample(range(len(names)), 50):
+            name = names[taxid]
+            typo = name[:5] + name[6:]  # one letter missing
+            best = matcher.search(typo, k=1)[0]
+            self.assertEqual(best[1:], (name, 1 - 1/len(typo)))
+
+    def test_save_and_db(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dbfile = os.path.join(tmpdir, 'taxa.sqlite')
+
+            db = sqlite3.connect(dbfile)
+            db.execute('CREATE TABLE species (taxid INT PRIMARY KEY, spname TEXT)')
+            db.execute('CREATE TABLE synonym (taxid INT, spname TEXT)')
+            db.executemany('INSERT INTO species VALUES (?, ?)',
+                           [(9606, 'Homo sapiens'), (9605, 'Homo')])
+            db.execute('INSERT INTO synonym VALUES (9606, "Human")')
+            db.commit()
+
+            matcher = fuzzy.get_matcher(dbfile, db)  # builds and saves it
+            self.assertTrue(os.path.exists(dbfile + fuzzy.SUFFIX))
+            self.assertEqual(matcher.nspecies, 2)
+            self.assertEqual(matcher.search('human', k=1),
+                             [(9606, 'Human', 1)])
+
+            loaded = NameMatcher.load(dbfile + fuzzy.SUFFIX)
+            for name in ['homo', 'Humans', 'Homo sapiens']:
+                self.assertEqual(loaded.search(name), matcher.search(name))
+
+            db.close()
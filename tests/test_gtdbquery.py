@@ -147,6 +147,52 @@ class Test_gtdbquery(unittest.TestCase):
 
         self.assertEqual(set(out), set(['s__MP8T-1 sp002825535', 's__MP8T-1 sp003345545', 's__MP8T-1 sp002825465', 's__MP8T-1 sp004524565', 's__MP8T-1 sp004524595', 's__SMTZ1-83 sp011364985', 's__SMTZ1-83 sp011365025', 's__SMTZ1-83 sp001563325', 's__TEKIR-14 sp004524445', 's__SHMX01 sp008080745', 's__OWC5 sp003345595', 's__OWC5 sp003345555', 's__JACAEL01 sp013388835', 's__B65-G9 sp003662765', 's__SMTZ1-45 sp001563335', 's__SMTZ1-45 sp011364905', 's__SMTZ1-45 sp001940705', 's__SMTZ1-45 sp004376265', 's__SMTZ1-45 sp002825515', 's__WTCK01 sp013138615', 's__TEKIR-12S sp004524435']))
 
+    def test_descendant_intervals(self):
+        gtdb = GTDBTaxa(dbfile=DATABASE_PATH)
+
+        for intermediate_nodes in [True, False]:
+            out = gtdb.get_descendant_taxa('c__Thorarchaeia', intermediate_nodes=intermediate_nodes)
+            self.assertEqual(gtdb.count_descendant_taxa('c__Thorarchaeia', intermediate_nodes),
+                             len(out))
+
+        self.assertTrue(gtdb.is_ancestor('c__Thorarchaeia', 'GB_GCA_003662765.1'))
+        self.assertTrue(gtdb.is_ancestor('d__Bacteria', 'RS_GCF_006228565.1'))
+        self.assertFalse(gtdb.is_ancestor('o__Peptococcales', 'GB_GCA_003662765.1'))
+        self.assertFalse(gtdb.is_ancestor('c__Thorarchaeia', 'c__Thorarchaeia'))
+
+    def test_chunked_queries(self):
+        gtdb = GTDBTaxa(dbfile=DATABASE_PATH)
+        gtdb_chunked = GTDBTaxa(dbfile=DATABASE_PATH)
+        gtdb_chunked.chunk_size = 2  # so the queries below need several chunks
+
+        names = ['c__Thorarchaeia', 'RS_GCF_001477695.1', 'd__Bacteria',
+                 'o__Peptococcales', 'f__Korarchaeaceae', 'not a name']
+        self.assertEqual(gtdb_chunked.get_rank(names), gtdb.get_rank(names))
+        self.assertEqual(len(gtdb.get_rank(names)), 5)
+
+        name2taxid = gtdb._get_name_translator(names)
+        self.assertEqual(gtdb_chunked._get_name_translator(names), name2taxid)
+
+        taxids = [taxid for ids in name2taxid.values() for taxid in ids]
+        self.assertEqual(gtdb_chunked._get_taxid_translator(taxids),
+                         gtdb._get_taxid_translator(taxids))
+        self.assertEqual(gtdb_chunked._get_lineage_translator(taxids),
+                         gtdb._get_lineage_translator(taxids))
+
+    def test_fuzzy_name_translation(self):
+        gtdb = GTDBTaxa(dbfile=DATABASE_PATH)
+
+        self.assertEqual(gtdb.get_fuzzy_name_translation('c__Thorarchaeia'),
+                         ('c__Thorarchaeia', 1))
+
+        name, score = gtdb.get_fuzzy_name_translation('c__Thorarchaea')
+        self.assertEqual(name, 'c__Thorarchaeia')
+        self.assertAlmostEqual(score, 1 - 1/14)
+
+        name2matches = gtdb.get_fuzzy_name_translator(['o__Peptococales', 'zzz'])
+        self.assertEqual(list(name2matches), ['o__Peptococales'])
+        self.assertEqual(name2matches['o__Peptococales'][0][0], 'o__Peptococcales')
+
     def test_get_topology(self):
         gtdb = GTDBTaxa(dbfile=DATABASE_PATH)
         tree = gtdb.get_topology(['p__Huberarchaeota', 'o__Peptococcales', 'f__Korarchaeaceae', 's__Korarchaeum'],
@@ -0,0 +1,90 @@
+"""
+Tests related to importing ete4 (what is loaded, and how long it takes).
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import ete4
+
+
+# Modules that "import ete4; ete4.Tree" should not need to load.
+SLOW_MODULES = ['scipy', 'requests', 'ete4.evol', 'ete4.phyloxml',
+                'ete4.ncbi_taxonomy', 'ete4.gtdb_taxonomy', 'ete4.phylo']
+
+MAX_IMPORT_TIME = 2  # seconds (generous, it is usually a small fraction)
+
+
+def import_times(code):
+    """Return dict {module: cumulative import time (s)} when running code."""
+    env = dict(os.environ,
+               PYTHONPATH=os.path.dirname(os.path.dirname(ete4.__file__)))
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            env=env, capture_output=True, text=True, check=True)
+
+    # Lines look like "import time: self [us] | cumulative | imported package".
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('package'):
+            _, cumulative, module = line.split('|')
+            times[module.strip()] = int(cumulative) / 1e6
+
+    return times
+
+
+def test_import_time():
+    times = import_times('import ete4; ete4.Tree')
+
+    for module in SLOW_MODULES:
+        assert module not in times, f'{module} imported with ete4'
+
+    assert times['ete4'] < MAX_IMPORT_TIME
+
+
+def test_lazy_names():
+    times = import_times('import ete4; ete4.PhyloTree')
+    assert 'ete4.phylo.phylotree' in times
+    assert 'ete4.evol' not in times
+
+    from ete4.phylo.phylotree import PhyloTree
+    from ete4.evol import EvolTree
+    from ete4.ncbi_taxonomy import NCBITaxa
+    from ete4.phyloxml import Phyloxml
+
+    assert ete4.PhyloTree is PhyloTree
+    assert ete4.EvolTree is EvolTree
+    assert ete4.NCBITaxa is NCBITaxa
+    assert ete4.Phyloxml is Phyloxml
+    assert ete4.phylo.phylotree.PhyloTree is PhyloTree
+
+    assert 'NCBITaxa' in dir(ete4)
+
+    with pytest.raises(AttributeError):
+        ete4.not_in_ete4
+
+
+def test_star_import():
+    namespace = {}
+    exec('from ete4 import *', namespace)
+
+    for name in ['Tree', 'PhyloTree', 'NCBITaxa', 'GTDBTaxa', 'EvolTree',
+                 'EvolNode', 'Phyloxml', 'PhyloxmlTree', 'is_taxadb_up_to_date',
+                 'newick', 'nexus', 'ncbiquery', 'gtdbquery', 'phylo', 'evol']:
+        assert name in namespace, f'{name} not imported with *'
+
+    assert namespace['PhyloTree'] is ete4.PhyloTree
+
+
+def test_lazy_modules():
+    import ete4.ncbi_taxonomy.ncbiquery
+    import ete4.gtdb_taxonomy.gtdbquery
+
+    assert ete4.ncbiquery is ete4.ncbi_taxonomy.ncbiquery
+    assert ete4.gtdbquery is ete4.gtdb_taxonomy.gtdbquery
+    assert ete4.phyloxml.Phyloxml is ete4.Phyloxml
+    assert ete4.evol.EvolTree is ete4.EvolTree
+    assert ete4.tools.__name__ == 'ete4.tools'
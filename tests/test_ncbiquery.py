@@ -2,7 +2,9 @@
 Test the functionality of ncbiquery.py. To run with pytest.
 """
 
+import io
 import os
+import tarfile
 import pytest
 
 from ete4 import PhyloTree, NCBITaxa, ETE_DATA_HOME, update_ete_data
@@ -125,6 +127,146 @@ def test_ncbiquery():
     assert set(out) == {9597, 9598}
 
 
+def test_descendant_intervals():
+    ncbi = NCBITaxa(dbfile=DATABASE_PATH)
+
+    assert ncbi.count_descendant_taxa('9605', intermediate_nodes=True) == 8
+    assert ncbi.count_descendant_taxa('9605', intermediate_nodes=False) == 5
+    assert ncbi.count_descendant_taxa('Homo sapiens') == len(
+        ncbi.get_descendant_taxa('Homo sapiens'))
+
+    for taxid in ncbi.get_descendant_taxa('9605', intermediate_nodes=True):
+        assert ncbi.is_ancestor(9605, taxid)
+        assert not ncbi.is_ancestor(taxid, 9605)
+
+    for ancestor in HUMAN_LINEAGE[:-1]:
+        assert ncbi.is_ancestor(ancestor, 9606)
+
+    assert not ncbi.is_ancestor(9606, 9606)
+    assert not ncbi.is_ancestor(7507, 9606)
+
+
+def test_preload():
+    ncbi = NCBITaxa(dbfile=DATABASE_PATH)
+    ncbi_mem = NCBITaxa(dbfile=DATABASE_PATH, preload=True)
+
+    assert ncbi_mem.get_lineage(9606) == HUMAN_LINEAGE
+    assert ncbi_mem.get_lineage('649756') == ncbi.get_lineage('649756')
+
+    taxids = HUMAN_LINEAGE + [7507, 678, 42099, 649756, '9443']
+    assert ncbi_mem.get_rank(taxids) == ncbi.get_rank(taxids)
+    assert ncbi_mem.get_taxid_translator(taxids) == ncbi.get_taxid_translator(taxids)
+    assert ncbi_mem.get_common_names(taxids) == ncbi.get_common_names(taxids)
+    assert (ncbi_mem.get_lineage_translator(taxids) ==
+            ncbi.get_lineage_translator(taxids))
+
+    names = ['Mantis religiosa', 'homo sapiens', 'Bacteria', 'not a name']
+    assert ncbi_mem.get_name_translator(names) == ncbi.get_name_translator(names)
+
+    for intermediate_nodes in [False, True]:
+        assert (ncbi_mem.get_descendant_taxa('9605', intermediate_nodes) ==
+                ncbi.get_descendant_taxa('9605', intermediate_nodes))
+
+    t1 = ncbi.get_topology([9606, 7507, 9604])
+    t2 = ncbi_mem.get_topology([9606, 7507, 9604])
+    assert t1.write(props=['sci_name', 'rank']) == t2.write(props=['sci_name', 'rank'])
+
+
+def test_chunked_queries():
+    ncbi = NCBITaxa(dbfile=DATABASE_PATH)
+    ncbi_chunked = NCBITaxa(dbfile=DATABASE_PATH)
+    ncbi_chunked.chunk_size = 3  # so the queries below need several chunks
+
+    taxids = HUMAN_LINEAGE + [7507, 678, 42099, 649756, '9443']
+    assert ncbi_chunked.get_rank(taxids) == ncbi.get_rank(taxids)
+    assert (ncbi_chunked.get_taxid_translator(taxids) ==
+            ncbi.get_taxid_translator(taxids))
+    assert (ncbi_chunked.get_lineage_translator(taxids) ==
+            ncbi.get_lineage_translator(taxids))
+
+    names = ['Mantis religiosa', 'homo sapiens', 'Bacteria', 'not a name',
+             'Primates', 'Hominidae', 'a "quoted" name']
+    assert (ncbi_chunked.get_name_translator(names) ==
+            ncbi.get_name_translator(names))
+    assert len(ncbi.get_name_translator(names)) == 5
+
+
+def test_fuzzy_name_translation():
+    ncbi = NCBITaxa(dbfile=DATABASE_PATH)
+
+    assert (ncbi.get_fuzzy_name_translation('Homo sapiens') ==
+            (9606, 'Homo sapiens', 1))
+
+    taxid, name, score = ncbi.get_fuzzy_name_translation('Homo sapeins', sim=0.8)
+    assert (taxid, name) == (9606, 'Homo sapiens')
+    assert score == 1 - 2/12
+
+    name2matches = ncbi.get_fuzzy_name_translator(
+        ['mantis religiosaa', 'not really a taxon name'], k=2)
+    assert list(name2matches) == ['mantis religiosaa']
+    assert name2matches['mantis religiosaa'][0][:2] == (7507, 'Mantis religiosa')
+
+
+def test_update_db(tmp_path):
+    # Build a database from a tiny taxdump (with a node before its parent).
+    dumps = {
+        'nodes.dmp': ['1\t|\t1\t|\tno rank\t|',
+                      '3\t|\t2\t|\tspecies\t|',
+                      '2\t|\t1\t|\tgenus\t|',
+                      '4\t|\t2\t|\tspecies\t|'],
+        'names.dmp': ['1\t|\troot\t|\t\t|\tscientific name\t|',
+                      '2\t|\tGenus\t|\t\t|\tscientific name\t|',
+                      '3\t|\tGenus one\t|\t\t|\tscientific name\t|',
+                      '3\t|\tFirst\t|\t\t|\tsynonym\t|',
+                      '3\t|\tfirst\t|\t\t|\tequivalent name\t|',
+                      '4\t|\tGenus two\t|\t\t|\tscientific name\t|'],
+        'merged.dmp': ['5\t|\t4\t|']}
+
+    taxdump = tmp_path / 'taxdump.tar.gz'
+
+    def write_taxdump():
+        with tarfile.open(taxdump, 'w:gz') as tar:
+            for fname, lines in dumps.items():
+                data = ''.join(line + '\n' for line in lines).encode()
+                info = tarfile.TarInfo(fname)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+    write_taxdump()
+
+    dbfile = str(tmp_path / 'taxa.sqlite')
+    ncbiquery.update_db(dbfile, str(taxdump))
+
+    # No temporary files left (only the database and its index of names).
+    assert sorted(os.listdir(tmp_path)) == [
+        'taxa.sqlite', 'taxa.sqlite.names.npz', 'taxdump.tar.gz']
+
+    ncbi = NCBITaxa(dbfile=dbfile, update=False)
+
+    assert ncbi.get_lineage(3) == [1, 2, 3]
+    assert ncbi.get_rank([2, 3]) == {2: 'genus', 3: 'species'}
+    assert ncbi.get_name_translator(['first']) == {'first': [3]}
+    assert ncbi.get_taxid_translator([5]) == {5: 'Genus two'}
+    assert ncbi.get_descendant_taxa(2) == [3, 4]
+    assert ncbi.count_descendant_taxa(1, intermediate_nodes=True) == 3
+    assert ncbi.is_ancestor(2, 4)
+    assert ncbi.get_fuzzy_name_translation('genus one') == (3, 'Genus one', 1)
+    assert ncbi.get_fuzzy_name_translator(['frist'], sim=0.5) == {
+        'frist': [(3, 'First', 0.6)]}
+
+    # Updating the database also updates its copy in memory, and its taxa
+    # loaded in arrays.
+    ncbi = NCBITaxa(dbfile=dbfile, update=False, memory=True, preload=True)
+
+    dumps['names.dmp'][-1] = '4\t|\tGenus dos\t|\t\t|\tscientific name\t|'
+    write_taxdump()
+    ncbi.update_taxonomy_database(str(taxdump))
+
+    assert ncbi.db.execute('PRAGMA database_list').fetchone()[2] == ''  # memory
+    assert ncbi.get_taxid_translator([4, 5]) == {4: 'Genus dos', 5: 'Genus dos'}
+    assert ncbi.get_name_translator(['Genus dos']) == {'Genus dos': [4]}
+
+
 def test_get_topology():
     ncbi = NCBITaxa(dbfile=DATABASE_PATH)
 
@@ -102,3 +102,75 @@ end;
 
             trees = nexus.load(fp)
             assert trees == {}
+
+    def test_iter_trees(self):
+        lines_read = []  # to check that the lines are read only when needed
+
+        def lines():
+            text = """#NEXUS
+[Generated by a program; it has comments.]
+begin trees;
+  translate
+    1 Ephedra,
+    2 Gnetum,
+    3 Welwitschia
+  ;
+  tree gen.1 [&lnP=-10.5; &joint=-9] = [&U] (1:1,2:1,3:1);
+  tree gen.2 = [&U] ((1:1,2:1):1,3:2);
+  tree gen.3 = [&U] ((1:1,3:1):1,2:2);
+  tree gen.4 = [&U] (1:1,[a comment; with ;]
+                     (2:1,3:1):1);
+  tree gen.5 = [&U] ((2:1,3:1):1,1:2);
+  tree gen.6 = [&U] ((3:1,1:1):1,2:2);
+end;
+"""
+            for line in text.splitlines(keepends=True):
+                lines_read.append(line)
+                yield line
+
+        trees = nexus.iter_trees(lines())
+        name, tree = next(trees)
+        self.assertEqual(name, 'gen.1')
+        self.assertEqual(tree.write(), '(Ephedra:1,Gnetum:1,Welwitschia:1);')
+        self.assertEqual(len(lines_read), 9)  # not all the file
+
+        newicks = [(name, tree.write()) for name, tree in trees]
+        self.assertEqual(newicks[2], ('gen.4', '(Ephedra:1,(Gnetum:1,Welwitschia:1):1);'))
+        self.assertEqual(len(newicks), 5)
+
+        names = [name for name, _ in nexus.iter_trees(lines(), burnin=1, thin=2)]
+        self.assertEqual(names, ['gen.2', 'gen.4', 'gen.6'])
+
+        names = [name for name, _ in nexus.iter_trees(lines(), burnin=4)]
+        self.assertEqual(names, ['gen.5', 'gen.6'])
+
+        self.assertEqual(list(nexus.iter_trees(lines(), burnin=10)), [])
+
+        with self.assertRaises(nexus.NexusError):
+            list(nexus.iter_trees(lines(), thin=0))
+
+        with self.assertRaises(nexus.NexusError):
+            list(nexus.iter_trees(['#NEXUS\n', 'begin trees;\n',
+                                   'tree bad ((A,B),C);\n', 'end;\n']))
+
+    def test_quoted_names(self):
+        text = """#NEXUS
+begin trees;
+  translate
+    1 "Gorilla",
+    2 'Pan troglodytes',
+    3 "Homo sapiens; [modern]",
+    4 'Homo ''neanderthalensis'''
+  ;
+  tree "tree 1" = [&U] ((1,2),(3,4));
+end;
+"""
+        trees = dict(nexus.iter_trees(text.splitlines(keepends=True)))
+        self.assertEqual(list(trees), ['tree 1'])
+        self.assertEqual(list(trees['tree 1'].leaf_names()),
+                         ['Gorilla', 'Pan troglodytes',
+                          'Homo sapiens; [modern]', "Homo 'neanderthalensis'"])
+
+        self.assertEqual(nexus.get_trees(text), {
+            'tree 1': "((Gorilla,'Pan troglodytes'),"
+                      "('Homo sapiens; [modern]','Homo ''neanderthalensis'''));"})
@@ -5,8 +5,12 @@ import json
 from tempfile import NamedTemporaryFile
 import unittest
 
-from ete4 import Tree, PhyloTree
+import numpy as np
+from scipy.spatial.distance import squareform
+
+from ete4 import Tree, PhyloTree, operations as ops
 from ete4.core.tree import TreeError
+from ete4.core import stats
 from ete4.parser.newick import NewickError
 from ete4.parser import newick
 
@@ -350,6 +354,118 @@ class Test_Core_Tree(unittest.TestCase):
         t = Tree(nw, parser='multisupport')
         self.assertEqual(t.write(parser='multisupport'), nw)
 
+    def test_newick_deep_tree(self):
+        # Deeper than the recursion limit, to check that parsing is iterative.
+        depth = 5 * sys.getrecursionlimit()
+        nw = ('(' * depth + 'n0:1,n1:1)' +
+              ''.join(f',n{i}:1)' for i in range(2, depth + 1)) + 'root;')
+
+        t = Tree(nw, parser=1)
+
+        self.assertEqual(t.name, 'root')
+        self.assertEqual(len(t), depth + 1)
+        self.assertEqual(max(n.level for n in t), depth)
+        self.assertEqual([n.name for n in t.children], [None, f'n{depth}'])
+
+        self.assertRaises(NewickError, Tree, '((a,b);')
+        self.assertRaises(NewickError, Tree, '((a,b)c d);')
+
+        self.assertEqual(t.write(parser=1, format_root_node=True), nw)
+
+    def test_newick_write_chunks(self):
+        t = Tree(ds.nw_full)
+
+        chunks = list(newick.iter_dumps(t, props=['flag', 'mood'],
+                                        format_root_node=False, chunk_size=3))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join(chunks), ds.nw_full)
+
+        # Writing to a file object.
+        with NamedTemporaryFile(mode='w+t') as fp:
+            t.write(outfile=fp, props=['flag', 'mood'])
+            fp.seek(0)
+            self.assertEqual(fp.read(), ds.nw_full + '\n')
+
+        # Nodes seen as leaves by is_leaf_fn.
+        t = Tree('((a,b)c,(d,(e,f)g)h)i;', parser=1)
+        self.assertEqual(t.write(parser=8, is_leaf_fn=lambda n: n.name == 'g'),
+                         '((a,b)c,(d,g)h);')
+        self.assertEqual(newick.dumps(t['g'], props=[], parser=9), '(e,f);')
+
+    def test_newick_nhx(self):
+        nw = "('a b':1[&&NHX:taxid=9606:rate=0.5:sp=human],c[&&NHX:taxid=10])d;"
+
+        t = Tree(nw, parser=1)
+        self.assertEqual(t['a b'].props,
+                         {'name': 'a b', 'dist': 1.0,
+                          'taxid': '9606', 'rate': '0.5', 'sp': 'human'})
+
+        parser = dict(newick.PARSERS[1], nhx={'taxid': int, 'rate': float})
+        t = Tree(nw, parser=parser)
+        self.assertEqual(t['a b'].props,
+                         {'name': 'a b', 'dist': 1.0,
+                          'taxid': 9606, 'rate': 0.5, 'sp': 'human'})
+        self.assertEqual(t['c'].props, {'name': 'c', 'taxid': 10})
+        self.assertEqual(t.name, 'd')
+
+        parser = newick.make_parser(parser, dist='%.2f')
+        self.assertEqual(Tree(nw, parser=parser)['c'].props['taxid'], 10)
+        self.assertEqual(Tree(nw, parser=parser).write(parser=parser, props=[]),
+                         "('a b':1.00,c);")
+
+        for bad_nw in ['(a[&&NHX:x],b);', '(a[&&NHX:x=1=2],b);',
+                       '(a[&&XYZ:x=1],b);', '(a[&&NHX:x=1,b);', "('a,b);"]:
+            self.assertRaises(NewickError, Tree, bad_nw)
+
+        self.assertRaises(NewickError, Tree, '(a[&&NHX:taxid=x],b);',
+                          parser=dict(newick.PARSERS[1], nhx={'taxid': int}))
+
+    def test_newick_many_trees(self):
+        import io
+        import pickle
+
+        text = """[a comment; with semicolon]
+            (a,b)c;  ('d;e',f);
+            (g,
+             h);
+        """ + '(x,y);\n' * 20
+
+        self.assertEqual(newick.count_newicks(io.StringIO(text)), 23)
+        self.assertEqual(newick.count_newicks(io.StringIO(text), block_size=3), 23)
+
+        newicks = list(newick.iter_newicks(io.StringIO(text), block_size=5))
+        self.assertEqual(len(newicks), 23)
+        self.assertEqual(newicks[1:3], ["('d;e',f);", '(g,\n             h);'])
+
+        newicks = list(newick.iter_newicks(io.StringIO(text), skip=1, block_size=5))
+        self.assertEqual(newicks[0], "('d;e',f);")
+
+        trees = list(newick.iter_load(io.StringIO(text), parser=1, skip=1))
+        self.assertEqual([t.write() for t in trees[:2]], ["('d;e',f);", '(g,h);'])
+        self.assertEqual(len(trees), 22)
+
+        trees = list(newick.iter_load(io.StringIO(text), parser=1,
+                                      tree_class=PhyloTree,
+                                      processes=2, chunk_size=4))
+        self.assertEqual(len(trees), 23)
+        self.assertTrue(all(type(t) == PhyloTree for t in trees))
+        self.assertEqual(trees[0].write(), '(a,b);')
+        self.assertEqual(trees[-1].write(), '(x,y);')
+
+        pickles = list(newick.iter_load(io.StringIO(text), parser=1,
+                                        pickled=True,
+                                        processes=2, chunk_size=4))
+        self.assertEqual(pickle.loads(pickles[1]).write(), "('d;e',f);")
+
+        for skip in [0, 1, 2, 5]:  # unfinished last newick, skipped or not
+            for block_size in [3, 100]:
+                with self.assertRaises(NewickError):
+                    list(newick.iter_newicks(io.StringIO('(a,b);(c,d)\n'),
+                                             skip=skip, block_size=block_size))
+
+        self.assertEqual(list(newick.iter_newicks(io.StringIO('(a,b); \n'),
+                                                  skip=1, block_size=3)), [])
+
     def test_quoted_names(self):
         complex_name = "((A:0.0001[&&NHX:hello=true],B:0.011)90:0.01[&&NHX:hello=true],(C:0.01, D:0.001)hello:0.01);"
         # A quoted tree within a tree
@@ -623,6 +739,46 @@ class Test_Core_Tree(unittest.TestCase):
         self.assertEqual(matrix1, matrix2)
         self.assertEqual(len(list(t.descendants())), (sample_size*2)-2 )
 
+        # Children of removed nodes go after the kept children of the parent.
+        t = Tree('((a:1,(b:1,c:1)x:2)y:1,d:1,(e:1,f:1)z:3)r;', parser=1)
+        t.prune(['b', 'c', 'd', 'e'], preserve_branch_length=True)
+        self.assertEqual(t.write(parser=1), '(d:1,(b:1,c:1)x:3,e:4);')
+
+        # A node keeps its parent only if no other kept node is in the path.
+        t = Tree('(((a,b)c)w,d)root;', parser=1)
+        t.prune(['c', 'a', 'b', 'd'])
+        self.assertEqual(t.write(parser=1), '(((a,b)c)w,d);')
+        t = Tree('((((a,b)c)w)v,d)root;', parser=1)
+        t.prune(['c', 'a', 'b', 'd'])
+        self.assertEqual(t.write(parser=1), '(d,((a,b)c)w);')
+
+        # The cached statistics and indices are updated.
+        t = Tree()
+        t.populate(2000)
+        ti = t.copy()
+        ti.build_index()
+        len(t)  # compute the stats
+        sample = random.sample(list(t.leaves()), 1500)
+        t.prune(sample)
+        ti.prune([n.name for n in sample])
+        self.assertEqual(len(t), 1500)
+        self.assertEqual(len(list(t.descendants())), 2 * 1500 - 2)
+        self.assertEqual(set(t.leaves()), set(sample))
+        self.assertEqual(ti.get_distance(ti, ti[0], topological=True), 1)
+        self.assertEqual(list(ti.leaf_names()), list(t.leaf_names()))
+
+        # Pruning a subtree also updates the statistics of its ancestors.
+        t = Tree('((a,b,c)x,(d,e)y)r;', parser=1)
+        len(t)  # compute the stats
+        t['x'].prune(['a', 'b'])
+        self.assertEqual(len(t), 4)
+        self.assertEqual(t.get_farthest_leaf(), (t['a'], 2.0))
+
+        # Nodes must be under the tree.
+        t = Tree('((a,b)c,d)root;', parser=1)
+        self.assertRaises(TreeError, t['c'].prune, [t['d']])
+        self.assertRaises(TreeError, t.prune, [])
+
     def test_resolve_polytomy(self):
         t = Tree('((a,a,a,a),(b,b,b,(c,c,c)));')
         t.resolve_polytomy()
@@ -968,6 +1124,29 @@ class Test_Core_Tree(unittest.TestCase):
         self.assertEqual(cache_many[t], set([(leaf.name, leaf.dist, leaf.support) for leaf in t.leaves()]))
         self.assertEqual(cache_many_lof[t], set((n.name, n.dist, n.support) for n in t.traverse()))
 
+        cache_list = t.get_cached_content(container_type=list)
+        self.assertEqual(cache_list[t], list(t.leaves()))
+
+        leaves = list(t.leaves())
+        nodes = list(t.traverse('preorder'))
+        for lo, items in [(True, leaves), (False, nodes)]:
+            cache = t.get_cached_content(leaves_only=lo)
+            cache_range = t.get_cached_content(container_type='range', leaves_only=lo)
+            cache_bits = t.get_cached_content(container_type='bits', leaves_only=lo)
+            self.assertEqual(list(cache_range), list(cache))
+            for node, r in cache_range.items():
+                self.assertEqual(set(items[r.start:r.stop]), cache[node])
+                self.assertEqual(cache_bits[node],
+                                 sum(1 << i for i in r))
+
+        # Deep trees work too (no recursion).
+        deep = Tree()
+        node = deep
+        for i in range(5000):
+            node.add_child(name='l%d' % i)
+            node = node.add_child()
+        self.assertEqual(len(deep.get_cached_content(container_type='range')[deep]), 5001)
+        self.assertEqual(len(deep.get_cached_content()[deep]), 5001)
 
         #self.assertEqual(cache_name_lof[t], [t.name])
 
@@ -1071,6 +1250,297 @@ class Test_Core_Tree(unittest.TestCase):
         self.assertEqual(t['a'].id, (0,0))
         self.assertEqual(t['d'].id, (1,1))
 
+    def test_index(self):
+        """Test that an indexed tree finds the same nodes as a normal one."""
+        def check(t, t_indexed):  # same results with t and t_indexed
+            for n1, n2 in zip(t.traverse(), t_indexed.traverse()):
+                self.assertEqual(n1.id, n2.id)
+                self.assertEqual(n1.level, n2.level)
+                self.assertEqual(t_indexed[n2.id], n2)
+                if n1.name:
+                    self.assertEqual(t[n1.name].id, t_indexed[n2.name].id)
+                    self.assertEqual(n1.name in t, n2.name in t_indexed)
+            self.assertEqual('missing' in t, 'missing' in t_indexed)
+
+        t = Tree('((a,b)x,(c,(d,a)z)y,e)r;', parser=1)
+        ti = t.copy()
+        index = ti.build_index()
+
+        check(t, ti)
+        self.assertTrue(index.valid)
+
+        self.assertEqual(ti['a'].id, (0, 0))  # first in levelorder
+        self.assertEqual(ti['y']['a'].id, (1, 1, 1))  # first under y
+        self.assertTrue(ti['z'] in ti['y'])
+        self.assertFalse(ti['z'] in ti['x'])
+        self.assertFalse(Tree() in ti)
+        with self.assertRaises(TreeError):
+            ti['missing']
+        with self.assertRaises(AssertionError):
+            ti.common_ancestor(['a', 'b'])  # ambiguous name
+
+        # Changes in the topology are seen in the indexed tree.
+        for tree in [t, ti]:
+            ops.move(tree['y'])
+            tree['z'].detach()
+            tree['x'].add_child(name='f')
+            tree['e'].name = 'g'
+            tree.set_outgroup(tree['c'])
+            tree.ladderize()
+
+        self.assertFalse(index.valid)
+        check(t, ti)
+        self.assertTrue(index.valid)
+        self.assertEqual(ti['g'].level, t['g'].level)
+        self.assertFalse('e' in ti)
+        self.assertFalse('d' in ti)  # it was under z
+
+        # Copies and detached subtrees do not use the index.
+        self.assertIsNone(ti.copy()._index)
+        x = ti['x'].detach()
+        self.assertEqual(x.id, ())
+        self.assertFalse(x in ti)
+        self.assertIsNone(x._index)
+
+        with self.assertRaises(TreeError):
+            ti['c'].build_index()  # not from the root
+
+        ti.remove_index()
+        self.assertFalse(index.valid)
+        self.assertEqual(ti['c'].id, t['c'].id)
+        self.assertIsNone(ti['c']._index)
+
+    def test_index_lca(self):
+        """Test common ancestors and distances found with an index."""
+        t = Tree()
+        t.populate(200, dist_fn=random.random)
+        ti = t.copy()
+        index = ti.build_index(lca=True)
+
+        nodes = list(t.traverse())
+        nodes_i = list(ti.traverse())
+        pairs = [random.sample(range(len(nodes)), 2) for _ in range(300)]
+        pairs += [(i, i) for i in range(0, len(nodes), 10)]
+
+        ancestors = index.lca((nodes_i[i], nodes_i[j]) for i, j in pairs)
+        dists = index.distance((nodes_i[i], nodes_i[j]) for i, j in pairs)
+        dists_topo = index.distance(((nodes_i[i], nodes_i[j])
+                                     for i, j in pairs), topological=True)
+
+        for (i, j), a, d, d_topo in zip(pairs, ancestors, dists, dists_topo):
+            n1, n2 = nodes[i], nodes[j]
+            ancestor = t.common_ancestor([n1, n2])
+            self.assertEqual(index.nodes[a].id, ancestor.id)
+            self.assertEqual(ti.common_ancestor([nodes_i[i], nodes_i[j]]).id,
+                             ancestor.id)
+            self.assertAlmostEqual(d, t.get_distance(n1, n2))
+            self.assertAlmostEqual(ti.get_distance(nodes_i[i], nodes_i[j]), d)
+            self.assertEqual(d_topo, t.get_distance(n1, n2, topological=True))
+
+        # Nodes can also be given by their (python or numpy) numbers.
+        numbers = np.array([index.number(n) for n in nodes_i])[pairs]
+        self.assertEqual(list(index.lca(numbers)), list(ancestors))
+        mixed = [(int(n1), nodes_i[j]) for (n1, _), (_, j) in zip(numbers, pairs)]
+        self.assertEqual(list(index.distance(mixed)), list(dists))
+        with self.assertRaises(KeyError):
+            index.lca([(nodes[0], nodes_i[1])])  # node from another tree
+
+        # Branches without length give the same results as without index.
+        for nw in ['((a,b),(c,(d,e)));', '((a:1,b:2),(c:1,(d:1,e:2)));']:
+            t1, t2 = Tree(nw), Tree(nw)
+            t2.build_index(lca=True)
+            for n1, n2 in [('a', 'd'), ('d', 'e'), ('a', 'a')]:
+                try:
+                    expected = t1.get_distance(n1, n2)
+                except TypeError:
+                    self.assertRaises(TypeError, t2.get_distance, n1, n2)
+                else:
+                    self.assertEqual(t2.get_distance(n1, n2), expected)
+                self.assertEqual(t2.get_distance(n1, n2, topological=True),
+                                 t1.get_distance(n1, n2, topological=True))
+
+        # Common ancestor of several nodes, and errors.
+        leaves = list(t.leaves())[:5]
+        leaves_i = [ti[n.id] for n in leaves]
+        self.assertEqual(ti.common_ancestor(leaves_i).id,
+                         t.common_ancestor(leaves).id)
+        with self.assertRaises(TreeError):
+            ti.children[0].common_ancestor([ti.children[1]])
+
+        # Changes in distances and topology are taken into account.
+        leaf = nodes_i[-1]
+        leaf.dist += 1
+        self.assertAlmostEqual(ti.get_distance(ti, leaf),
+                               t.get_distance(t, nodes[-1]) + 1)
+        ti.children[0].detach()
+        self.assertEqual(ti.get_distance(ti, ti.children[0], topological=True), 1)
+
+    def test_index_props(self):
+        """Test searching nodes by property with the index."""
+        nw = '((a[&&NHX:taxid=1],b[&&NHX:taxid=2])x[&&NHX:taxid=1],c[&&NHX:taxid=1]);'
+        t = Tree(nw, parser=1)
+        ti = Tree(nw, parser=1)
+        index = ti.build_index()
+
+        def check(**conditions):
+            found = [n.id for n in t.search_nodes(**conditions)]
+            self.assertEqual([n.id for n in ti.search_nodes(**conditions)], found)
+            return found
+
+        self.assertEqual(check(taxid='1'), [(0,), (1,), (0, 0)])
+        self.assertEqual(check(taxid='1', name='a'), [(0, 0)])
+        self.assertEqual(check(taxid=None), [()])
+        self.assertEqual(check(name='b', children=[]), [(0, 1)])
+        self.assertEqual(index.counts['table_builds'], 1)  # only for taxid
+
+        self.assertEqual([n.id for n in ti['x'].search_nodes(taxid='1')],
+                         [(0,), (0, 0)])
+        self.assertEqual(list(ti.search_leaves_by_name('c')), [ti['c']])
+
+        # Changes in the properties make their table go away.
+        for tree in [t, ti]:
+            tree['b'].add_prop('taxid', '1')
+            tree['c'].del_prop('taxid')
+            tree['a'].name = 'd'
+        self.assertEqual(check(taxid='1'), [(0,), (0, 0), (0, 1)])
+        self.assertEqual(check(taxid=None), [(), (1,)])
+        self.assertEqual(check(name='d'), [(0, 0)])
+        self.assertEqual(index.counts['table_builds'], 2)  # built again once
+
+        for tree in [t, ti]:
+            tree['x'].detach()
+        self.assertEqual(check(taxid='1'), [])
+        self.assertEqual(index.counts['updates'], 2)
+
+        # Computed properties (like species) are updated with the names.
+        pt = PhyloTree('((Hsa_1,Ptr_1),(Mmu_1,Hsa_2));',
+                       sp_naming_function=lambda name: name.split('_')[0])
+        pt.build_index()
+        self.assertEqual([n.name for n in pt.search_nodes(species='Hsa')],
+                         ['Hsa_1', 'Hsa_2'])
+        pt['Hsa_2'].name = 'Ptr_2'
+        self.assertEqual([n.name for n in pt.search_nodes(species='Hsa')],
+                         ['Hsa_1'])
+        pt.set_species_naming_function(lambda name: name.split('_')[1])
+        self.assertEqual([n.name for n in pt.search_nodes(species='2')],
+                         ['Ptr_2'])
+
+        pt = PhyloTree('((Hsa_1,Ptr_1),(Mmu_1,Hsa_2));',
+                       sp_naming_function=lambda name: name.split('_')[0])
+        pt.build_index()
+        self.assertEqual(list(pt.search_nodes(evoltype='D')), [])
+        pt.get_speciation_trees()  # marks the duplications
+        self.assertEqual(list(pt.search_nodes(evoltype='D')), [pt])
+
+    def test_stats(self):
+        """Test the statistics of the subtrees, cached in the nodes."""
+        t = Tree('((a:1,b:2)x:1,(c:1,(d:3,e:1)y:0.5)z:2);', parser=1)
+
+        s = stats.get_stats(t)
+        self.assertEqual((s.nleaves, s.nnodes, s.height, s.height_topo, s.length),
+                         (5, 9, 5.5, 3, 11.5))
+        self.assertEqual(len(t), 5)
+        self.assertEqual(len(t['z']), 3)
+        self.assertEqual(t.get_farthest_leaf(), (t['d'], 5.5))
+        self.assertEqual(t.get_farthest_leaf(topological=True), (t['d'], 2.0))
+        self.assertEqual(t['a'].get_farthest_leaf(), (t['a'], 0.0))
+
+        # Changes clear the stats from the changed node up to the root.
+        self.assertIsNotNone(t['x']._stats)
+        t['d'].dist = 0.5
+        self.assertIsNone(t['y']._stats)
+        self.assertIsNone(t._stats)
+        self.assertIsNotNone(t['x']._stats)
+        self.assertEqual(t.get_farthest_leaf(), (t['e'], 3.5))
+
+        t['y'].add_child(name='f', dist=4)
+        self.assertEqual(len(t), 6)
+        self.assertEqual(t.get_farthest_leaf(), (t['f'], 6.5))
+
+        t['y'].detach()
+        self.assertEqual(len(t), 3)
+        self.assertEqual(stats.get_stats(t).length, 7)
+
+        t['z'].add_prop('dist', 10)
+        self.assertEqual(t.get_farthest_leaf(), (t['c'], 11.0))
+
+        ops.to_dendrogram(t)
+        self.assertEqual(t.get_farthest_leaf(), (t['a'], 2.0))
+
+        # Properties changed directly leave outdated stats, which are redone.
+        for leaf in t.leaves():
+            leaf.props['dist'] = 0.5
+        self.assertEqual(t.get_farthest_leaf(), (t['a'], 1.5))
+
+        # Random changes keep the stats like when computed from scratch.
+        t = Tree()
+        t.populate(50, dist_fn=random.random)
+        len(t)  # compute all the stats
+        for _ in range(20):
+            node = random.choice(list(t.descendants()))
+            if random.random() < 0.5:
+                node.add_child(dist=random.random())
+            else:
+                t.set_outgroup(node)
+            tc = t.copy()  # its nodes have no stats
+            for n, nc in zip(t.traverse(), tc.traverse()):
+                s, sc = stats.get_stats(n), stats.get_stats(nc)
+                self.assertEqual(s[:2] + s[3:4], sc[:2] + sc[3:4])
+                self.assertAlmostEqual(s.height, sc.height)
+                self.assertAlmostEqual(s.length, sc.length)
+
+    def test_props_array(self):
+        """Test getting and setting properties as numpy arrays."""
+        t = Tree('((a:1,b:2)x:1,(c:1,(d:3,e:1)y:0.5)z:2);', parser=1)
+
+        for order in ['preorder', 'postorder', 'levelorder']:
+            nodes, parents = t.get_nodes_array(order)
+            self.assertEqual(list(nodes), list(t.traverse(order)))
+            self.assertEqual([nodes[i] if i != -1 else None for i in parents],
+                             [n.up for n in nodes])
+
+            dists = t.get_props_array('dist', order)
+            self.assertEqual(dists.dtype, np.float64)
+            self.assertTrue(np.isnan(dists[list(nodes).index(t)]))
+            self.assertEqual(np.nansum(dists), 11.5)
+
+        self.assertEqual(list(t.get_props_array('name', 'postorder', None,
+                                                object)),
+                         ['a', 'b', 'x', 'c', 'd', 'e', 'y', 'z', None])
+        self.assertEqual(list(t.get_props_array('support', default=0)), [0] * 9)
+
+        # Setting values updates the stats and index, and nan removes them.
+        t.build_index()
+        self.assertEqual(len(t), 5)
+        self.assertEqual(t.get_distance(t, 'd'), 5.5)
+
+        dists = t.get_props_array('dist')
+        t.set_props_array('dist', dists / np.nansum(dists))
+        self.assertAlmostEqual(t.get_distance(t, 'd'), 5.5 / 11.5)
+        self.assertEqual(t.get_farthest_leaf()[0], t['d'])
+
+        t.set_props_array('name', [None, 'X', 'Z', 'A', 'B', 'C', 'Y', 'D', 'E'],
+                          'levelorder')
+        self.assertAlmostEqual(t.get_distance(t, 'D'), 5.5 / 11.5)
+        self.assertFalse('d' in t)
+
+        t.set_props_array('dist', np.full(9, np.nan))
+        self.assertEqual(t.write(parser=1), '((A,B)X,(C,(D,E)Y)Z);')
+        self.assertEqual(stats.get_stats(t).length, 8)
+
+        t.set_props_array('size', np.arange(9))
+        self.assertEqual(t['E'].props['size'], 8)
+        self.assertEqual(type(t['E'].props['size']), int)
+
+        t.set_props_array('code', np.arange(9))
+        self.assertEqual(list(t.search_nodes(code=8)), [t['E']])
+        t.set_props_array('code', [None] * 8 + [7])
+        self.assertEqual(list(t.search_nodes(code=8)), [])
+        self.assertEqual(list(t.search_nodes(code=7)), [t['E']])
+
+        with self.assertRaises(AssertionError):
+            t.set_props_array('dist', [1, 2])
+
     def test_ultrametric(self):
         EPSILON = 1e-5  # small number for the purposes of comparing distances
 
@@ -1435,44 +1905,53 @@ class Test_Core_Tree(unittest.TestCase):
             self.assertEqual(rf_max, real_max)
             self.assertEqual(rf, RF)
 
-        # TODO: Fix the tests from this line to the end of this function.
-        # # Testing RF with branch support thresholds.
-        # # test discarding lowly supported branches
-        # for RF, unrooted, nw1, nw2 in samples:
-        #     # Add fake internal nodes with low support
-        #     for x in "jlnqr":
-        #         nw1 = nw1.replace(x, "(%s,(%s1, %s11)0.6)" %(x, x, x) )
-        #         nw2 = nw2.replace(x, "(%s,(%s1, %s11)0.5)" %(x, x, x) )
-        #     t1 = Tree(nw1, parser=0)
-        #     t2 = Tree(nw2, parser=0)
-        #     rf, rf_max, names, r1, r2, d1, d2 = t1.robinson_foulds(t2, unrooted_trees=unrooted,
-        #                                                            min_support_t1 = 0.1, min_support_t2 = 0.1)
-        #     self.assertEqual(len(names), 30)
-        #     real_max = (30*2) - 4 if not unrooted else (30*2) - 6
-        #     self.assertEqual(rf_max, real_max)
-        #     self.assertEqual(rf, RF)
-
-        #     rf, rf_max, names, r1, r2, d1, d2 = t1.robinson_foulds(t2, unrooted_trees=unrooted,
-        #                                                            min_support_t1 = 0.0, min_support_t2 = 0.51)
-        #     self.assertEqual(len(names), 30)
-        #     real_max = (30*2) - 4 - 5 if not unrooted else (30*2) - 6 -5 # -5 to discount low support branches
-        #     self.assertEqual(rf_max, real_max)
-        #     self.assertEqual(rf, RF)
-
-        #     rf, rf_max, names, r1, r2, d1, d2 = t1.robinson_foulds(t2, unrooted_trees=unrooted,
-        #                                                            min_support_t1 = 0.61, min_support_t2 = 0.0)
-        #     self.assertEqual(len(names), 30)
-        #     real_max = (30*2) - 4 - 5 if not unrooted else (30*2) - 6 -5 # -5 to discount low support branches
-        #     self.assertEqual(rf_max, real_max)
-        #     self.assertEqual(rf, RF)
-
-
-        #     rf, rf_max, names, r1, r2, d1, d2 = t1.robinson_foulds(t2, unrooted_trees=unrooted,
-        #                                                            min_support_t1 = 0.61, min_support_t2 = 0.51)
-        #     self.assertEqual(len(names), 30)
-        #     real_max = (30*2) - 4 - 10 if not unrooted else (30*2) - 6 -10 # -10 to discount low support branches
-        #     self.assertEqual(rf_max, real_max)
-        #     self.assertEqual(rf, RF)
+        # Testing RF with branch support thresholds.
+        # test discarding lowly supported branches
+        for RF, unrooted, nw1, nw2 in samples:
+            # Add fake internal nodes with low support
+            for x in "jlnqr":
+                nw1 = nw1.replace(x, "(%s,(%s1, %s11)0.6)" %(x, x, x) )
+                nw2 = nw2.replace(x, "(%s,(%s1, %s11)0.5)" %(x, x, x) )
+            t1 = Tree(nw1, parser=0)
+            t2 = Tree(nw2, parser=0)
+            rf, rf_max, names, r1, r2, d1, d2 = t1.robinson_foulds(t2, unrooted_trees=unrooted,
+                                                                   min_support_t1 = 0.1, min_support_t2 = 0.1)
+            self.assertEqual(len(names), 30)
+            real_max = (30*2) - 4 if not unrooted else (30*2) - 6
+            self.assertEqual(rf_max, real_max)
+            self.assertEqual(rf, RF)
+
+            rf, rf_max, names, r1, r2, d1, d2 = t1.robinson_foulds(t2, unrooted_trees=unrooted,
+                                                                   min_support_t1 = 0.0, min_support_t2 = 0.51)
+            self.assertEqual(len(names), 30)
+            real_max = (30*2) - 4 - 5 if not unrooted else (30*2) - 6 -5 # -5 to discount low support branches
+            self.assertEqual(rf_max, real_max)
+            self.assertEqual(rf, RF)
+
+            rf, rf_max, names, r1, r2, d1, d2 = t1.robinson_foulds(t2, unrooted_trees=unrooted,
+                                                                   min_support_t1 = 0.61, min_support_t2 = 0.0)
+            self.assertEqual(len(names), 30)
+            real_max = (30*2) - 4 - 5 if not unrooted else (30*2) - 6 -5 # -5 to discount low support branches
+            self.assertEqual(rf_max, real_max)
+            self.assertEqual(rf, RF)
+
+
+            rf, rf_max, names, r1, r2, d1, d2 = t1.robinson_foulds(t2, unrooted_trees=unrooted,
+                                                                   min_support_t1 = 0.61, min_support_t2 = 0.51)
+            self.assertEqual(len(names), 30)
+            real_max = (30*2) - 4 - 10 if not unrooted else (30*2) - 6 -10 # -10 to discount low support branches
+            self.assertEqual(rf_max, real_max)
+            self.assertEqual(rf, RF)
+
+        # a conflicting branch with low support
+        t1 = Tree('(((a,b)0.9,(c,d)0.2),e);')
+        t2 = Tree('(((a,b)1,(c,e)1),d);')
+        rf, rf_max, names, r1, r2, d1, d2 = t1.robinson_foulds(t2)
+        self.assertEqual((rf, rf_max), (4, 6))  # cd, abcd, ce, abce differ
+        rf, rf_max, names, r1, r2, d1, d2 = t1.robinson_foulds(t2, min_support_t1=0.5)
+        self.assertEqual((rf, rf_max), (3, 5))  # cd is not counted
+        self.assertEqual(d1, {('c', 'd')})
+        self.assertEqual(d2, set())
 
     # TODO: Fix the check_monophyly() function and this test.
     def test_monophyly(self):
@@ -1615,6 +2094,43 @@ class Test_Core_Tree(unittest.TestCase):
         self.assertEqual((t_pkl["A"]).props['complex'][0], [0,1])
         self.assertEqual((t_deep["A"]).props['testfn'](), "YES")
 
+        # Shallow copies: new nodes, with copies of the props dicts.
+        t_shallow = t.copy("shallow")
+        self.assertEqual(t_shallow.write(props=None, format_root_node=True,
+                                         parser=1),
+                         t.write(props=None, format_root_node=True, parser=1))
+        self.assertEqual(t_shallow["A"].props['testfn'](), "YES")
+        self.assertIs(t_shallow["A"].props['complex'], t['A'].props['complex'])
+        t_shallow["A"].name = "A2"
+        t_shallow["Internal_2"].detach()
+        self.assertEqual(t.write(parser=1), "((A,B)Internal_1:0.7,(C,D)Internal_2:0.5);")
+        self.assertEqual(len(t_shallow), 2)
+        self.assertIsNone(t_shallow.up)
+        self.assertIsNone(t['A'].copy("shallow").up)
+
+        # Shared copies: new nodes, with the same props dicts.
+        for with_index in [False, True]:
+            t1 = t.copy("shallow")
+            leaf = t1["A"]
+            if with_index:
+                t1.build_index()
+            t_shared = t1.copy("shared")
+            t_shared["A"].name = "A2"
+            self.assertEqual(leaf.name, "A2")
+            self.assertIs(t1["A2"], leaf)
+            self.assertTrue("A2" in t1)
+            self.assertEqual(list(t1.search_nodes(name="A2")), [leaf])
+            self.assertIsNot(t_shared["A2"], leaf)
+
+        # The class of the nodes (and their attributes) are kept.
+        pt = PhyloTree('((Hsa_1,Ptr_1),Mmu_1);',
+                       sp_naming_function=lambda name: name.split('_')[0])
+        pt['Hsa_1']._leaf = True
+        pt_shallow = pt.copy("shallow")
+        self.assertTrue(all(type(n) == PhyloTree for n in pt_shallow.traverse()))
+        self.assertEqual(pt_shallow['Hsa_1'].species, 'Hsa')
+        self.assertTrue(pt_shallow['Hsa_1']._leaf)
+
     def test_cophenetic_matrix(self):
         t = Tree(ds.nw_full)
         dists, leaves = t.cophenetic_matrix()
@@ -1691,6 +2207,84 @@ class Test_Core_Tree(unittest.TestCase):
                 self.assertAlmostEqual(actualdists[i][j], dists[i][j], places=4)
         self.assertEqual(actualleaves, leaves)
 
+    def test_cophenetic_matrix_options(self):
+        t = Tree()
+        t.populate(50, dist_fn=random.random)
+        dists, names = t.cophenetic_matrix()
+        self.assertEqual(dists.shape, (50, 50))
+        self.assertEqual(names, sorted(names))
+
+        dists_topo, _ = t.cophenetic_matrix(topological=True)
+        for i, j in [(0, 1), (3, 7), (10, 40), (49, 0), (5, 5)]:
+            n1, n2 = t[names[i]], t[names[j]]
+            self.assertAlmostEqual(dists[i, j], t.get_distance(n1, n2))
+            self.assertEqual(dists_topo[i, j],
+                             t.get_distance(n1, n2, topological=True))
+
+        dists32, _ = t.cophenetic_matrix(dtype=np.float32)
+        self.assertEqual(dists32.dtype, np.float32)
+        self.assertTrue(np.allclose(dists32, dists))
+
+        condensed, _ = t.cophenetic_matrix(condensed=True)
+        self.assertTrue(np.allclose(squareform(condensed), dists))
+
+        with NamedTemporaryFile(suffix='.npy') as fp:
+            out = np.lib.format.open_memmap(fp.name, mode='w+',
+                                            dtype=np.float64, shape=(50, 50))
+            t.cophenetic_matrix(out=out)
+            out.flush()
+            self.assertTrue(np.allclose(np.load(fp.name), dists))
+
+        with self.assertRaises(AssertionError):
+            t.cophenetic_matrix(out=np.zeros((3, 3)))
+
+        self.assertEqual(Tree('a;').cophenetic_matrix()[0].tolist(), [[0]])
+
+    def test_bipartitions(self):
+        # Trees with more leaves than bits in a machine word.
+        names = ['n%d' % i for i in range(100)]
+        t1 = Tree()
+        t1.populate(100, names=names)
+        t2 = Tree()
+        t2.populate(100, names=names)
+
+        def as_names(edges):
+            return sorted((sorted(n.name for n in a), sorted(n.name for n in b))
+                          for a, b in edges)
+
+        self.assertEqual(as_names(t1.edges()),
+                         as_names(t1.edges(t1.get_cached_content())))
+
+        t1_copy = t1.copy()
+        t1_copy.children.reverse()  # same topology, different order
+        self.assertEqual(t1.get_topology_id(), t1_copy.get_topology_id())
+        self.assertNotEqual(t1.get_topology_id(), t2.get_topology_id())
+
+        for unrooted in [False, True]:
+            rf, rf_max, common, parts1, parts2, _, _ = \
+                t1.robinson_foulds(t1_copy, unrooted_trees=unrooted)
+            self.assertEqual(rf, 0)
+            self.assertEqual(parts1, parts2)
+            self.assertEqual(len(common), 100)
+
+            rf12 = t1.robinson_foulds(t2, unrooted_trees=unrooted)[:2]
+            rf21 = t2.robinson_foulds(t1, unrooted_trees=unrooted)[:2]
+            self.assertEqual(rf12, rf21)
+            self.assertTrue(0 < rf12[0] <= rf12[1])
+
+        # Branches with low support are discarded.
+        t1 = Tree('(((a,b)0.5,c)0.9,(d,e)1);', parser=0)
+        t2 = Tree('(((a,c)0.5,b)0.9,(d,e)1);', parser=0)
+        self.assertEqual(t1.robinson_foulds(t2)[:2], [2, 6])
+        self.assertEqual(t1.robinson_foulds(t2, min_support_t1=0.6,
+                                            min_support_t2=0.6)[:2], [0, 4])
+
+        # Edges are decoded into tuples of sorted names.
+        t = Tree('((a,b),(c,(d,e)));')
+        parts = t.robinson_foulds(t)[3]
+        self.assertEqual(sorted(p for p in parts if 1 < len(p) < 5),
+                         [('a', 'b'), ('c', 'd', 'e'), ('d', 'e')])
+
 
 if __name__ == '__main__':
     unittest.main()